@@ -5,14 +5,30 @@ Scalable microservice for converting audio to text
 """
 
 import os
+import asyncio
 import tempfile
 import logging
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from typing import Optional, Dict, Any
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+import numpy as np
 import whisper
 import torch
 import uvicorn
+import redis.asyncio as redis
+
+from batching import BatchScheduler
+from jobs import RESULT_CHANNEL, JobQueue
+from longform import transcribe_long
+
+from voice_common.audio import AudioFormatError, decode_audio
+from voice_common.inference import ModelReplicas, cpu_limit
+from voice_common.metrics import ServiceMetrics, instrument
+from voice_common.prefork import PoolFull, PreforkPool
+from voice_common.quantize import load_whisper
+from voice_common.readiness import Readiness, install_probes
+from voice_common.registry import ModelRegistry, UnknownModel, model_memory_bytes
+from voice_common.singleflight import SingleFlight, flight_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -34,44 +50,359 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Micro-batching: requests arriving within the window share one encoder pass
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "20"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+# Clips past 30 s and other model sizes run unbatched on these threads, each
+# with its own model replica, so they never block the batches
+UNBATCHED_WORKERS = int(os.getenv("UNBATCHED_WORKERS", "1"))
+
+# Opt-in fast path: encode clips up to SHORT_CONTEXT_MAX_SECONDS on a context
+# sized to the clip rather than 30 s, re-running on the full context when the
+# average log-probability drops below SHORT_CONTEXT_MIN_LOGPROB
+SHORT_CONTEXT_ENABLED = os.getenv("SHORT_CONTEXT_ENABLED", "false").lower() == "true"
+SHORT_CONTEXT_MAX_SECONDS = float(os.getenv("SHORT_CONTEXT_MAX_SECONDS", "8"))
+SHORT_CONTEXT_MARGIN_SECONDS = float(os.getenv("SHORT_CONTEXT_MARGIN_SECONDS", "1.0"))
+SHORT_CONTEXT_MIN_LOGPROB = float(os.getenv("SHORT_CONTEXT_MIN_LOGPROB", "-0.7"))
+
+# Model storage and optional int8 dynamic quantization (CPU only)
+MODELS_DIR = os.getenv("MODELS_DIR", "/app/models")
+WHISPER_QUANTIZE = os.getenv("WHISPER_QUANTIZE", "none").lower()
+
+# Checkpoints come from the MODELS_DIR volume (populate it with
+# python -m voice_common.modelstore prepare) and are checksummed before loading; downloading a missing one is a
+# development fallback. Loading runs in the background behind /readyz.
+MODEL_ALLOW_DOWNLOAD = os.getenv("MODEL_ALLOW_DOWNLOAD", "true").lower() == "true"
+MODEL_VERIFY = os.getenv("MODEL_VERIFY", "true").lower() == "true"
+# Transcribe a second of silence before reporting ready
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+
+# Per-request model selection: MODEL_SIZE loads at startup and stays resident,
+# other sizes load on first use and are evicted least-recently-used. A size
+# that cannot fit in the budget beside MODEL_SIZE is refused with 400 (fp32
+# medium needs about 3 GB, so add it only with a larger budget or int8).
+MODEL_SIZE = os.getenv("MODEL_SIZE", "base")
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "3072"))
+AVAILABLE_MODELS = [m.strip() for m in os.getenv("AVAILABLE_MODELS", "tiny,base,small").split(",") if m.strip()]
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Long-form mode: recordings past LONGFORM_MIN_SECONDS are split at pauses
+# into pieces of at most LONGFORM_PIECE_SECONDS and transcribed in parallel
+# by worker processes forked after the model loads. Each worker shares the
+# MODEL_SIZE weights copy-on-write and only ever runs that size, so long-form
+# requests for another size go through the batch scheduler instead.
+LONGFORM_ENABLED = os.getenv("LONGFORM_ENABLED", "true").lower() == "true"
+LONGFORM_WORKERS = int(os.getenv("LONGFORM_WORKERS", str(min(2, cpu_limit()))))
+LONGFORM_MAX_QUEUE = int(os.getenv("LONGFORM_MAX_QUEUE", "64"))
+LONGFORM_MIN_SECONDS = float(os.getenv("LONGFORM_MIN_SECONDS", "120"))
+LONGFORM_PIECE_SECONDS = float(os.getenv("LONGFORM_PIECE_SECONDS", "60"))
+LONGFORM_OVERLAP_SECONDS = float(os.getenv("LONGFORM_OVERLAP_SECONDS", "1.0"))
+LONGFORM_THREADS = int(os.getenv("LONGFORM_THREADS", str(max(1, cpu_limit() // max(1, LONGFORM_WORKERS)))))
+
+# Background jobs: Redis Streams consumer group shared by every replica
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "1"))
+JOB_CLAIM_IDLE_MS = int(os.getenv("JOB_CLAIM_IDLE_MS", "60000"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "86400"))
+
+# Largest upload /transcribe and /jobs accept; queued uploads are held in Redis
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 << 20)))
+
+# Identical uploads already being transcribed share the running result
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+
 # Global model variable
 model = None
+model_registry = None
+batch_scheduler = None
+longform_pool = None
+redis_client = None
+job_queue = None
+in_flight = SingleFlight() if COALESCE_ENABLED else None
+readiness = Readiness()
+install_probes(app, readiness)
+metrics = ServiceMetrics("stt", optional=("coalescing",))
+instrument(app, metrics)
+
+@metrics.on_scrape
+def refresh_gauges(m: ServiceMetrics):
+    longform = longform_pool.stats() if longform_pool else {"running": 0, "queued": 0}
+    batching = batch_scheduler.stats() if batch_scheduler else {"queued": 0, "unbatched_in_flight": 0}
+    m.set_queue(longform["running"] + batching["unbatched_in_flight"], longform["queued"] + batching["queued"])
+    if model_registry:
+        m.set_model_memory({
+            r["model"]: r["memory_mb"] * 2**20 for r in model_registry.stats()["resident_models"]
+        })
+
+def load_audio_file(content: bytes, suffix: str) -> np.ndarray:
+    """Decode a compressed upload through Whisper's ffmpeg loader"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        temp_file.write(content)
+        temp_file_path = temp_file.name
+    try:
+        return whisper.load_audio(temp_file_path)
+    finally:
+        os.unlink(temp_file_path)
 
 def load_whisper_model():
-    """Load Whisper model with optimal settings"""
-    global model
+    """Create the model registry and load the default model with optimal settings"""
+    global model, model_registry
+    
+    quantize = WHISPER_QUANTIZE == "int8" and DEVICE == "cpu"
     
-    model_size = os.getenv("MODEL_SIZE", "base")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    logger.info(f"Loading Whisper model '{MODEL_SIZE}'{' (int8)' if quantize else ''} on device '{DEVICE}'")
     
-    logger.info(f"Loading Whisper model '{model_size}' on device '{device}'")
+    model_registry = ModelRegistry(
+        loader=lambda size: ModelReplicas(
+            load_whisper(size, DEVICE, quantize, MODELS_DIR, MODEL_VERIFY, MODEL_ALLOW_DOWNLOAD)
+        ),
+        memory_of=lambda replicas: model_memory_bytes(replicas.model) * replicas.count,
+        budget_bytes=MODEL_MEMORY_BUDGET_MB << 20,
+        available=sorted(set(AVAILABLE_MODELS) | {MODEL_SIZE}),
+        quantized=quantize
+    )
     
     try:
-        model = whisper.load_model(model_size, device=device)
+        model = model_registry.acquire(MODEL_SIZE, pin=True).model
         logger.info("Whisper model loaded successfully")
     except Exception as e:
         logger.error(f"Failed to load Whisper model: {e}")
         raise
 
+def warm_up(whisper_model):
+    """Run the model once so the first request does not pay for lazy setup"""
+    whisper_model.transcribe(np.zeros(whisper.audio.SAMPLE_RATE, dtype=np.float32), fp16=False)
+
+def init_longform_worker():
+    """Set up a forked long-form worker: its thread count, then warm-up"""
+    torch.set_num_threads(LONGFORM_THREADS)
+    if MODEL_WARMUP:
+        warm_up(model)
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize the STT service"""
-    load_whisper_model()
+    """Start loading in the background; /livez answers at once, /readyz once loaded"""
+    readiness.start(load_service())
+
+async def load_service():
+    """Load the model and start the workers that depend on it, in startup order"""
+    global batch_scheduler, longform_pool, redis_client, job_queue
+    threads = torch.get_num_threads()
+    if LONGFORM_ENABLED:
+        # Until the workers are forked, stay on one thread so torch never
+        # starts the OpenMP pool that would hang them
+        torch.set_num_threads(1)
+    with readiness.step("loading_model"):
+        await asyncio.to_thread(load_whisper_model)
+    
+    if LONGFORM_ENABLED:
+        # Fork before the model runs here and before the batch worker thread
+        # and Redis connection exist; each worker warms itself up
+        with readiness.step("forking_workers"):
+            longform_pool = PreforkPool(
+                LONGFORM_WORKERS,
+                LONGFORM_MAX_QUEUE,
+                initializer=init_longform_worker
+            )
+            await asyncio.to_thread(longform_pool.start)
+        torch.set_num_threads(threads)
+    
+    if MODEL_WARMUP:
+        with readiness.step("warming_up"):
+            await asyncio.to_thread(warm_up, model)
+    
+    batch_scheduler = BatchScheduler(
+        lambda size: model_registry.acquire(size).get(),
+        MODEL_SIZE,
+        window_ms=BATCH_WINDOW_MS,
+        max_batch_size=BATCH_MAX_SIZE,
+        unbatched_workers=UNBATCHED_WORKERS,
+        short_context_seconds=SHORT_CONTEXT_MAX_SECONDS if SHORT_CONTEXT_ENABLED else 0.0,
+        short_context_margin=SHORT_CONTEXT_MARGIN_SECONDS,
+        short_context_min_logprob=SHORT_CONTEXT_MIN_LOGPROB
+    )
+    batch_scheduler.start()
+    
+    if JOBS_ENABLED:
+        try:
+            redis_client = redis.from_url(REDIS_URL)
+            await redis_client.ping()
+            job_queue = JobQueue(
+                redis_client,
+                process_job,
+                concurrency=JOB_CONCURRENCY,
+                claim_idle_ms=JOB_CLAIM_IDLE_MS,
+                max_attempts=JOB_MAX_ATTEMPTS,
+                ttl=JOB_TTL_SECONDS
+            )
+            await job_queue.start()
+        except Exception as e:
+            logger.warning(f"Job queue disabled, Redis unavailable: {e}")
+            redis_client = None
+            job_queue = None
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers"""
+    await readiness.cancel()
+    if job_queue:
+        await job_queue.stop()
+    if redis_client:
+        await redis_client.close()
+    if batch_scheduler:
+        await batch_scheduler.stop()
+    if longform_pool:
+        longform_pool.shutdown()
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
-        "status": "healthy",
+        "status": "healthy" if readiness.ready else readiness.state,
         "service": "stt",
+        "readiness": readiness.stats(),
         "model_loaded": model is not None,
-        "device": "cuda" if torch.cuda.is_available() else "cpu"
+        "device": DEVICE,
+        "batching": batch_scheduler.stats() if batch_scheduler else None,
+        "longform": longform_pool.stats() if longform_pool else None,
+        "jobs": job_queue.stats() if job_queue else None,
+        "coalescing": in_flight.stats() if in_flight else None
     }
 
+async def decode_upload(content: bytes, content_type: Optional[str], filename: Optional[str]) -> np.ndarray:
+    """WAV/PCM decode in memory; compressed formats still go through ffmpeg"""
+    with metrics.stage("decode"):
+        try:
+            audio_array = await asyncio.to_thread(decode_audio, content, content_type)
+        except AudioFormatError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid audio: {e}")
+        if audio_array is None:
+            suffix = os.path.splitext(filename or "")[1] or ".wav"
+            audio_array = await asyncio.to_thread(load_audio_file, content, suffix)
+        return audio_array
+
+async def read_upload(audio: UploadFile) -> bytes:
+    """Read an upload, rejecting it with 413 past UPLOAD_MAX_BYTES"""
+    if audio.size is not None and audio.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Audio exceeds the {UPLOAD_MAX_BYTES} byte limit")
+    content = await audio.read(UPLOAD_MAX_BYTES + 1)
+    if len(content) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Audio exceeds the {UPLOAD_MAX_BYTES} byte limit")
+    return content
+
+def resolve_model(name: Optional[str]) -> str:
+    """Validate a requested model size, defaulting to MODEL_SIZE"""
+    try:
+        return model_registry.validate(name, MODEL_SIZE)
+    except UnknownModel as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def check_long_form(model_size: str, long_form: Optional[bool]):
+    """Reject forcing long-form mode on a size the forked workers do not hold"""
+    if long_form and model_size != MODEL_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Long-form mode is only available for the default model '{MODEL_SIZE}'"
+        )
+
+def format_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a Whisper result into the service's response body"""
+    segments = result.get("segments", [])
+    return {
+        "text": result["text"].strip(),
+        "language": result.get("language", "unknown"),
+        "segments": [
+            {
+                "start": seg["start"],
+                "end": seg["end"],
+                "text": seg["text"].strip()
+            }
+            for seg in segments
+        ],
+        "confidence": sum(seg.get("avg_logprob", 0) for seg in segments) / max(len(segments), 1),
+        "timing": result.get("timing", {})
+    }
+
+def transcribe_piece(audio: np.ndarray, language: Optional[str]) -> Dict[str, Any]:
+    """Transcribe one piece of a long recording inside a forked worker.
+
+    Uses the MODEL_SIZE model inherited from the parent, never the registry,
+    so a worker cannot load a private copy of another size.
+    """
+    options = {"fp16": DEVICE == "cuda"}
+    if language:
+        options["language"] = language
+    return model.transcribe(audio, **options)
+
+async def transcribe_array(audio_array: np.ndarray, language: Optional[str], model_size: Optional[str],
+                           long_form: Optional[bool] = None) -> Dict[str, Any]:
+    """Batch short clips; split and fan out long recordings across worker processes"""
+    if long_form is None:
+        long_form = len(audio_array) > LONGFORM_MIN_SECONDS * whisper.audio.SAMPLE_RATE
+    if not (long_form and longform_pool and (model_size or MODEL_SIZE) == MODEL_SIZE):
+        result = await batch_scheduler.submit(audio_array, language=language, model_size=model_size)
+        timing = result["timing"]
+        # Inference time is the whole batch's, shared by every clip in it
+        metrics.observe_inference(timing["queue_wait"], timing["inference"])
+    else:
+        result = await transcribe_long_form(audio_array, language)
+        timing = result["timing"]
+        metrics.observe("inference", timing["total"])
+    metrics.observe_audio(len(audio_array) / whisper.audio.SAMPLE_RATE, timing.get("inference", timing["total"]))
+    return result
+
+async def transcribe_long_form(audio_array: np.ndarray, language: Optional[str]) -> Dict[str, Any]:
+    """Split at pauses and transcribe the pieces on the forked workers"""
+    return await transcribe_long(
+        longform_pool.run,
+        transcribe_piece,
+        audio_array,
+        parallelism=longform_pool.workers,
+        max_seconds=LONGFORM_PIECE_SECONDS,
+        min_seconds=LONGFORM_PIECE_SECONDS / 3,
+        overlap_seconds=LONGFORM_OVERLAP_SECONDS,
+        language=language
+    )
+
+async def transcribe_upload(content: bytes, content_type: Optional[str], filename: Optional[str],
+                            language: Optional[str], model_size: Optional[str],
+                            long_form: Optional[bool] = None) -> Dict[str, Any]:
+    """Decode and transcribe an upload, sharing the result with identical uploads in flight"""
+    async def transcribe():
+        audio_array = await decode_upload(content, content_type, filename)
+        return await transcribe_array(audio_array, language, model_size, long_form)
+
+    if not in_flight:
+        return await transcribe()
+    options = {"content_type": content_type, "language": language,
+               "model": model_size or MODEL_SIZE, "long_form": long_form}
+    if len(content) > 1 << 20:
+        key = await asyncio.to_thread(flight_key, content, **options)
+    else:
+        key = flight_key(content, **options)
+    result, shared = await in_flight.run(key, transcribe)
+    if shared:
+        metrics.observe_coalesced()
+    return result
+
+async def process_job(content: bytes, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one queued job through the same pipeline as /transcribe"""
+    async with metrics.track("job"):
+        result = await transcribe_upload(
+            content, options.get("content_type"), options.get("filename"),
+            options.get("language"), options.get("model"), options.get("long_form")
+        )
+        with metrics.stage("encode"):
+            return format_result(result)
+
 @app.post("/transcribe")
 async def transcribe_audio(
     audio: UploadFile = File(...),
-    language: Optional[str] = None
+    language: Optional[str] = None,
+    model_size: Optional[str] = Query(None, alias="model"),
+    long_form: Optional[bool] = None
 ):
     """
     Transcribe audio file to text
@@ -79,70 +410,114 @@ async def transcribe_audio(
     Args:
         audio: Audio file (wav, mp3, m4a, etc.)
         language: Optional language code (e.g., 'en', 'es', 'fr')
+        model: Optional Whisper size (e.g., 'tiny' for short commands, 'small' for dictation)
+        long_form: Force (true) or disable (false) parallel long-form mode;
+            by default it is used for recordings longer than LONGFORM_MIN_SECONDS;
+            only the default model runs in long-form mode
     
     Returns:
         Transcription result with text and metadata
     """
-    if model is None:
-        raise HTTPException(status_code=503, detail="STT model not loaded")
+    readiness.require()
     
     # Validate file type
     if not audio.content_type.startswith('audio/'):
         raise HTTPException(status_code=400, detail="File must be an audio file")
+    model_size = resolve_model(model_size)
+    check_long_form(model_size, long_form)
     
     try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            content = await audio.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        content = await read_upload(audio)
         
         # Transcribe audio
         logger.info(f"Transcribing audio file: {audio.filename}")
         
-        transcribe_options = {}
-        if language:
-            transcribe_options["language"] = language
-        
-        result = model.transcribe(temp_file_path, **transcribe_options)
-        
-        # Clean up temp file
-        os.unlink(temp_file_path)
+        # Wait for a batch slot, or fan a long recording out to the workers;
+        # an identical upload already in flight is answered by that one
+        result = await transcribe_upload(content, audio.content_type, audio.filename, language, model_size, long_form)
+        timing = result.get("timing", {})
+        if "pieces" in timing:
+            logger.info(
+                f"Transcribed {audio.filename} ({timing['audio_seconds']:.0f}s) in {timing['total']:.3f}s "
+                f"as {timing['pieces']} parallel pieces"
+            )
+        else:
+            logger.info(
+                f"Transcribed {audio.filename} in {timing.get('total', 0):.3f}s "
+                f"(queue {timing.get('queue_wait', 0):.3f}s, batch of {timing.get('batch_size', 1)})"
+            )
         
         # Return structured result
-        return {
-            "text": result["text"].strip(),
-            "language": result.get("language", "unknown"),
-            "segments": [
-                {
-                    "start": seg["start"],
-                    "end": seg["end"],
-                    "text": seg["text"].strip()
-                }
-                for seg in result.get("segments", [])
-            ],
-            "confidence": sum(seg.get("avg_logprob", 0) for seg in result.get("segments", [])) / max(len(result.get("segments", [])), 1)
-        }
+        with metrics.stage("encode"):
+            response = format_result(result)
+            response["model"] = model_size
+            return response
         
+    except HTTPException:
+        raise
+    except PoolFull as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Long-form workers are busy, retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(f"Transcription failed: {e}")
-        # Clean up temp file if it exists
-        if 'temp_file_path' in locals():
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
 
+@app.post("/jobs", status_code=202)
+async def create_job(
+    audio: UploadFile = File(...),
+    language: Optional[str] = None,
+    model_size: Optional[str] = Query(None, alias="model"),
+    long_form: Optional[bool] = None
+):
+    """
+    Queue audio for transcription by whichever replica is free
+    
+    Poll GET /jobs/{job_id} or subscribe to the returned Redis channel for the result.
+    """
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Job queue not available")
+    
+    if not audio.content_type.startswith('audio/'):
+        raise HTTPException(status_code=400, detail="File must be an audio file")
+    model_size = resolve_model(model_size)
+    check_long_form(model_size, long_form)
+    
+    content = await read_upload(audio)
+    job_id = await job_queue.enqueue(content, {
+        "language": language,
+        "model": model_size,
+        "long_form": long_form,
+        "content_type": audio.content_type,
+        "filename": audio.filename
+    })
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "channel": RESULT_CHANNEL.format(job_id)
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status, and once finished the result, of a queued job"""
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Job queue not available")
+    
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.get("/models")
 async def list_models():
-    """List available Whisper models"""
+    """List available Whisper models and the ones currently resident"""
     return {
-        "available_models": [
-            "tiny", "base", "small", "medium", "large", "large-v2", "large-v3"
-        ],
-        "current_model": os.getenv("MODEL_SIZE", "base"),
-        "device": "cuda" if torch.cuda.is_available() else "cpu"
+        "available_models": model_registry.available if model_registry else AVAILABLE_MODELS,
+        "current_model": MODEL_SIZE,
+        "device": DEVICE,
+        **(model_registry.stats() if model_registry else {})
     }
 
 if __name__ == "__main__":
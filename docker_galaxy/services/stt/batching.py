@@ -0,0 +1,310 @@
+"""
+Dynamic micro-batching for the STT service
+Groups concurrent short clips so the mel and encoder stages run as one padded batch
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+import torch
+import whisper
+
+from voice_common import shortcontext
+
+logger = logging.getLogger(__name__)
+
+# Whisper's own fallback and silence thresholds from transcribe()
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+# A clip's result, or the exception that failed it alone
+Outcome = Union[Dict[str, Any], Exception]
+
+
+@dataclass
+class BatchItem:
+    audio: np.ndarray
+    language: Optional[str]
+    model_size: str
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class BatchScheduler:
+    """Collects transcription requests into micro-batches.
+
+    The first request to arrive opens a window of ``window_ms``; everything
+    that arrives before it closes (up to ``max_batch_size`` items) is encoded
+    together. Decoding still runs per item so each request keeps its own
+    language and fallback behaviour, and an item that fails fails alone.
+    Clips longer than Whisper's 30 s window and clips for a size other than
+    ``default_model`` skip batching: they go through ``model.transcribe`` on
+    ``unbatched_workers`` separate threads, so minutes of audio or a first
+    load never hold up the short clips queued behind them.
+
+    ``get_model`` maps a model size to a loaded model and runs on the thread
+    that uses it, so a size requested for the first time is loaded there. It
+    must hand each thread its own instance (see ``ModelReplicas``): Whisper
+    decoding is not thread-safe.
+
+    With ``short_context_seconds`` set, clips up to that length are first
+    encoded on a context sized to the longest of them instead of 30 s; any
+    whose result fails the confidence guard is re-run on the full context.
+    """
+
+    def __init__(self, get_model: Callable[[str], Any], default_model: str,
+                 window_ms: float = 20.0, max_batch_size: int = 8, unbatched_workers: int = 1, history: int = 512,
+                 short_context_seconds: float = 0.0, short_context_margin: float = 1.0,
+                 short_context_min_logprob: float = shortcontext.DEFAULT_MIN_LOGPROB):
+        self.get_model = get_model
+        self.default_model = default_model
+        self.short_context_seconds = short_context_seconds
+        self.short_context_margin = short_context_margin
+        self.short_context_min_logprob = short_context_min_logprob
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # A single worker runs the batches on its own model replica
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stt-batch")
+        self._unbatched_pool = ThreadPoolExecutor(max_workers=max(1, unbatched_workers),
+                                                  thread_name_prefix="stt-unbatched")
+        self._unbatched_in_flight = 0
+        self._task: Optional[asyncio.Task] = None
+        self._latencies = deque(maxlen=history)
+        self._batch_sizes = deque(maxlen=history)
+        self.batches = 0
+        self.requests = 0
+        self.unbatched = 0
+        self.reduced_context = 0
+        self.reduced_fallbacks = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._unbatched_pool.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, audio: np.ndarray, language: Optional[str] = None,
+                     model_size: Optional[str] = None) -> Dict[str, Any]:
+        """Queue one clip and wait for its transcription"""
+        future = asyncio.get_running_loop().create_future()
+        item = BatchItem(
+            audio=audio,
+            language=language,
+            model_size=model_size or self.default_model,
+            future=future
+        )
+        if item.model_size != self.default_model or len(audio) > whisper.audio.N_SAMPLES:
+            return await self._run_unbatched(item)
+        await self._queue.put(item)
+        return await future
+
+    async def _run_unbatched(self, item: BatchItem) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        self._unbatched_in_flight += 1
+        try:
+            result, started = await loop.run_in_executor(self._unbatched_pool, self._transcribe_unbatched, item)
+        finally:
+            self._unbatched_in_flight -= 1
+        finished = time.perf_counter()
+        self.unbatched += 1
+        result["timing"] = {
+            "queue_wait": started - item.enqueued_at,
+            "inference": finished - started,
+            "total": finished - item.enqueued_at,
+            "batch_size": 1,
+        }
+        self._latencies.append(result["timing"]["total"])
+        return result
+
+    def _transcribe_unbatched(self, item: BatchItem):
+        started = time.perf_counter()
+        return self._transcribe_full(self.get_model(item.model_size), item), started
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            started = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self._pool, self._transcribe_batch, batch)
+            except Exception as e:
+                logger.error(f"Batch transcription failed: {e}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            self.batches += 1
+            self.requests += len(batch)
+            self._batch_sizes.append(len(batch))
+            for item, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    if not item.future.done():
+                        item.future.set_exception(result)
+                    continue
+                timing = {
+                    "queue_wait": started - item.enqueued_at,
+                    "inference": finished - started,
+                    "total": finished - item.enqueued_at,
+                    "batch_size": len(batch),
+                }
+                self._latencies.append(timing["total"])
+                result["timing"] = timing
+                if not item.future.done():
+                    item.future.set_result(result)
+
+    def _transcribe_batch(self, batch: List[BatchItem]) -> List[Outcome]:
+        results: List[Optional[Outcome]] = [None] * len(batch)
+        try:
+            self._encode_and_decode(batch, results)
+        except Exception as e:
+            # Whatever the shared pass did not finish is retried clip by clip,
+            # so one bad clip fails only its own request
+            logger.warning(f"Batch of {len(batch)} failed ({e}), transcribing the rest one by one")
+            for i, item in enumerate(batch):
+                if results[i] is None:
+                    try:
+                        results[i] = self._transcribe_full(self.get_model(item.model_size), item)
+                    except Exception as item_error:
+                        results[i] = item_error
+        return results
+
+    def _encode_and_decode(self, batch: List[BatchItem], results: List[Optional[Outcome]]):
+        model = self.get_model(self.default_model)
+        short = list(range(len(batch)))
+        if self.short_context_seconds:
+            short = self._decode_reduced(model, batch, short, results)
+
+        if short:
+            with torch.no_grad():
+                mels = torch.stack([
+                    whisper.log_mel_spectrogram(
+                        whisper.pad_or_trim(batch[i].audio),
+                        n_mels=model.dims.n_mels,
+                        device=model.device
+                    )
+                    for i in short
+                ])
+                features = model.embed_audio(mels)
+
+            for row, i in enumerate(short):
+                results[i] = self._decode(model, batch[i], features[row])
+
+    def _decode_reduced(self, model, batch: List[BatchItem], indices: List[int],
+                        results: List[Optional[Dict[str, Any]]]) -> List[int]:
+        """Encode short clips on a reduced context; returns the ones that need the full one"""
+        limit = self.short_context_seconds * whisper.audio.SAMPLE_RATE
+        eligible = [i for i in indices if len(batch[i].audio) <= limit]
+        if not eligible:
+            return indices
+
+        n_ctx = shortcontext.audio_context(
+            max(len(batch[i].audio) for i in eligible), self.short_context_margin, model.dims.n_audio_ctx
+        )
+        with torch.no_grad():
+            mels = torch.stack([shortcontext.log_mel(model, batch[i].audio, n_ctx) for i in eligible])
+            features = shortcontext.embed_audio(model, mels)
+
+        remaining = [i for i in indices if i not in eligible]
+        for row, i in enumerate(eligible):
+            options = whisper.DecodingOptions(
+                language=batch[i].language,
+                without_timestamps=True,
+                fp16=model.device.type == "cuda"
+            )
+            decoded = shortcontext.decode(model, features[row], n_ctx, options)
+            if shortcontext.acceptable(decoded, self.short_context_min_logprob):
+                self.reduced_context += 1
+                results[i] = shortcontext.to_result(decoded, len(batch[i].audio) / whisper.audio.SAMPLE_RATE)
+            else:
+                self.reduced_fallbacks += 1
+                remaining.append(i)
+        return remaining
+
+    def _decode(self, model, item: BatchItem, features: torch.Tensor) -> Dict[str, Any]:
+        options = whisper.DecodingOptions(
+            language=item.language,
+            without_timestamps=True,
+            fp16=model.device.type == "cuda"
+        )
+        decoded = whisper.decode(model, features, options)
+
+        # transcribe() drops a window it judges silent rather than returning
+        # what the decoder hallucinated there
+        if decoded.no_speech_prob > NO_SPEECH_THRESHOLD and decoded.avg_logprob < LOGPROB_THRESHOLD:
+            return {"text": "", "language": decoded.language, "segments": []}
+
+        # Same quality gate transcribe() uses before retrying at higher temperature
+        if (decoded.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                or decoded.avg_logprob < LOGPROB_THRESHOLD):
+            return self._transcribe_full(model, item)
+
+        duration = len(item.audio) / whisper.audio.SAMPLE_RATE
+        return {
+            "text": decoded.text,
+            "language": decoded.language,
+            "segments": [{
+                "start": 0.0,
+                "end": duration,
+                "text": decoded.text,
+                "avg_logprob": decoded.avg_logprob
+            }]
+        }
+
+    def _transcribe_full(self, model, item: BatchItem) -> Dict[str, Any]:
+        options = {"fp16": model.device.type == "cuda"}
+        if item.language:
+            options["language"] = item.language
+        return model.transcribe(item.audio, **options)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "batches": self.batches,
+            "requests": self.requests,
+            "queued": self._queue.qsize(),
+            "unbatched": self.unbatched,
+            "unbatched_in_flight": self._unbatched_in_flight,
+            "avg_batch_size": (sum(self._batch_sizes) / len(self._batch_sizes)) if self._batch_sizes else 0.0,
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+            "latency_p99": percentile(0.99),
+            "reduced_context": self.reduced_context,
+            "reduced_fallbacks": self.reduced_fallbacks,
+        }
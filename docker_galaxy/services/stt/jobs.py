@@ -0,0 +1,232 @@
+"""
+Asynchronous transcription jobs on Redis Streams
+Any replica can enqueue; every replica pulls from one consumer group and reclaims work from dead pods
+"""
+
+import asyncio
+import json
+import logging
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from redis.exceptions import ResponseError
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "stt:jobs"
+GROUP_NAME = "stt-workers"
+JOB_KEY = "stt:job:{}"
+AUDIO_KEY = "stt:job:{}:audio"
+RESULT_CHANNEL = "stt:job:{}:done"
+
+Processor = Callable[[bytes, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class JobQueue:
+    """Redis Streams work queue shared by all STT replicas.
+
+    The audio blob is stored under its own key so stream entries stay small;
+    job state lives in a hash that ``GET /jobs/{id}`` reads. Each replica runs
+    ``concurrency`` consumers, so a busy pod simply stops pulling and the idle
+    ones take the next entries. Entries left pending by a crashed pod are
+    taken over with XAUTOCLAIM once they have been idle for ``claim_idle_ms``.
+    """
+
+    def __init__(self, redis_client, process: Processor, concurrency: int = 1,
+                 claim_idle_ms: int = 60000, max_attempts: int = 3, ttl: int = 86400,
+                 consumer: Optional[str] = None):
+        self.redis = redis_client
+        self.process = process
+        self.concurrency = max(1, concurrency)
+        self.claim_idle_ms = claim_idle_ms
+        self.max_attempts = max_attempts
+        self.ttl = ttl
+        self.consumer = consumer or socket.gethostname()
+        self._tasks = []
+        self.processed = 0
+        self.failed = 0
+        self.claimed = 0
+
+    async def start(self):
+        try:
+            await self.redis.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._tasks = [asyncio.create_task(self._consume(i)) for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._reclaim()))
+        logger.info(f"Job consumer {self.consumer} started with {self.concurrency} worker(s)")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, audio: bytes, options: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        job_key = JOB_KEY.format(job_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(AUDIO_KEY.format(job_id), audio, ex=self.ttl)
+            pipe.hset(job_key, mapping={
+                "status": "queued",
+                "options": json.dumps(options),
+                "created_at": time.time(),
+                "attempts": 0
+            })
+            pipe.expire(job_key, self.ttl)
+            pipe.xadd(STREAM_KEY, {"job_id": job_id})
+            await pipe.execute()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self.redis.hgetall(JOB_KEY.format(job_id))
+        if not raw:
+            return None
+        job = {_text(k): _text(v) for k, v in raw.items()}
+        info = {
+            "job_id": job_id,
+            "status": job.get("status"),
+            "attempts": int(job.get("attempts", 0)),
+            "created_at": float(job["created_at"]) if "created_at" in job else None,
+            "finished_at": float(job["finished_at"]) if "finished_at" in job else None,
+            "worker": job.get("worker"),
+        }
+        if "result" in job:
+            info["result"] = json.loads(job["result"])
+        if "error" in job:
+            info["error"] = job["error"]
+        return info
+
+    async def _consume(self, index: int):
+        consumer = f"{self.consumer}-{index}"
+        while True:
+            try:
+                entries = await self.redis.xreadgroup(
+                    GROUP_NAME, consumer, {STREAM_KEY: ">"}, count=1, block=5000
+                )
+                for _, messages in entries or []:
+                    for entry_id, fields in messages:
+                        await self._handle(entry_id, fields, consumer)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job consumer {consumer} error: {e}")
+                await asyncio.sleep(1)
+
+    async def _reclaim(self):
+        """Take over entries another consumer read but never acknowledged"""
+        consumer = f"{self.consumer}-reclaim"
+        while True:
+            try:
+                await asyncio.sleep(self.claim_idle_ms / 1000.0)
+                response = await self.redis.xautoclaim(
+                    STREAM_KEY, GROUP_NAME, consumer, self.claim_idle_ms, start_id="0-0", count=self.concurrency
+                )
+                # Redis 7 appends a list of deleted ids; only the first two items matter
+                for entry_id, fields in response[1]:
+                    if fields:
+                        self.claimed += 1
+                        logger.info(f"Reclaimed stale job entry {_text(entry_id)}")
+                        await self._handle(entry_id, fields, consumer)
+                    else:
+                        await self.redis.xack(STREAM_KEY, GROUP_NAME, entry_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job reclaim error: {e}")
+
+    async def _handle(self, entry_id, fields, consumer: str):
+        job_id = _text(fields.get(b"job_id") or fields.get("job_id"))
+        job_key = JOB_KEY.format(job_id)
+        if not await self.redis.exists(job_key):
+            # Expired while queued: writing to it would recreate the hash without a TTL
+            logger.warning(f"Job {job_id} expired before it ran, dropping it")
+            await self._discard(entry_id, job_id)
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(job_key, "attempts", 1)
+            pipe.hset(job_key, mapping={"status": "processing", "worker": consumer})
+            # Keeps the TTL even if the hash expired since the check above
+            pipe.expire(job_key, self.ttl)
+            attempts, _, _ = await pipe.execute()
+        heartbeat = asyncio.create_task(self._heartbeat(entry_id, consumer))
+
+        try:
+            audio = await self.redis.get(AUDIO_KEY.format(job_id))
+            if audio is None:
+                raise RuntimeError("Job audio expired or missing")
+            options = json.loads(_text(await self.redis.hget(job_key, "options")) or "{}")
+            result = await self.process(audio, options)
+        except Exception as e:
+            if attempts < self.max_attempts:
+                # Leave the entry pending so it is reclaimed and retried
+                logger.warning(f"Job {job_id} attempt {attempts} failed: {e}")
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.hset(job_key, "status", "queued")
+                    pipe.expire(job_key, self.ttl)
+                    await pipe.execute()
+                return
+            logger.error(f"Job {job_id} failed: {e}")
+            self.failed += 1
+            await self._finish(entry_id, job_id, "failed", error=str(e))
+            return
+        finally:
+            heartbeat.cancel()
+
+        self.processed += 1
+        await self._finish(entry_id, job_id, "done", result=result)
+
+    async def _heartbeat(self, entry_id, consumer: str):
+        """Keep a long job's idle time low so other replicas don't reclaim it"""
+        while True:
+            await asyncio.sleep(self.claim_idle_ms / 3000.0)
+            try:
+                await self.redis.xclaim(STREAM_KEY, GROUP_NAME, consumer, 0, [entry_id], justid=True)
+            except Exception as e:
+                logger.warning(f"Job heartbeat failed: {e}")
+
+    async def _finish(self, entry_id, job_id: str, status: str,
+                      result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        job_key = JOB_KEY.format(job_id)
+        fields = {"status": status, "finished_at": time.time()}
+        message = {"job_id": job_id, "status": status}
+        if result is not None:
+            fields["result"] = json.dumps(result)
+            message["result"] = result
+        if error is not None:
+            fields["error"] = error
+            message["error"] = error
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(job_key, mapping=fields)
+            pipe.expire(job_key, self.ttl)
+            pipe.delete(AUDIO_KEY.format(job_id))
+            pipe.xack(STREAM_KEY, GROUP_NAME, entry_id)
+            pipe.xdel(STREAM_KEY, entry_id)
+            pipe.publish(RESULT_CHANNEL.format(job_id), json.dumps(message))
+            await pipe.execute()
+
+    async def _discard(self, entry_id, job_id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(AUDIO_KEY.format(job_id))
+            pipe.xack(STREAM_KEY, GROUP_NAME, entry_id)
+            pipe.xdel(STREAM_KEY, entry_id)
+            await pipe.execute()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "consumer": self.consumer,
+            "concurrency": self.concurrency,
+            "processed": self.processed,
+            "failed": self.failed,
+            "claimed": self.claimed,
+        }
+
+
+def _text(value) -> Optional[str]:
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
@@ -0,0 +1,154 @@
+"""
+Long-form transcription for the STT service
+Splits long recordings at pauses, transcribes the pieces in parallel and stitches the segments back together
+"""
+
+import asyncio
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+# Longest run of repeated words looked for where two pieces meet
+MAX_SEAM_WORDS = 8
+
+
+@dataclass
+class Piece:
+    start: int  # sample offsets into the full recording
+    end: int
+    keep_from: int  # segments centred before this sample belong to the previous piece
+
+
+def frame_energy_db(audio: np.ndarray, frame: int) -> np.ndarray:
+    count = len(audio) // frame
+    frames = audio[:count * frame].reshape(count, frame).astype(np.float64)
+    return 10.0 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+
+def split_at_silence(audio: np.ndarray, max_seconds: float = 60.0, min_seconds: float = 20.0,
+                     overlap_seconds: float = 1.0, frame_ms: int = 30, pause_ms: int = 300,
+                     margin_db: float = 10.0) -> List[Piece]:
+    """Cut ``audio`` into pieces of at most ``max_seconds``.
+
+    Each cut goes in the quietest ``pause_ms`` stretch between ``min_seconds``
+    and ``max_seconds`` into the current piece. A stretch counts as a pause
+    when it is within ``margin_db`` of the recording's noise floor; if there
+    is none, the piece is cut at ``max_seconds`` and the next one starts
+    ``overlap_seconds`` earlier so no word is lost at the seam.
+    """
+    max_samples = int(max_seconds * SAMPLE_RATE)
+    min_samples = int(min(min_seconds, max_seconds) * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    frame = SAMPLE_RATE * frame_ms // 1000
+    if len(audio) <= max_samples or len(audio) < frame:
+        return [Piece(0, len(audio), 0)]
+
+    energy = frame_energy_db(audio, frame)
+    # Mean power over a pause-length run, so a cut lands in a real pause
+    # rather than in the gap between two syllables
+    run = max(1, pause_ms // frame_ms)
+    power = np.convolve(10.0 ** (energy / 10.0), np.ones(run) / run, mode="same")
+    smoothed = 10.0 * np.log10(power + 1e-10)
+    silence_db = np.percentile(energy, 10) + margin_db
+
+    pieces = []
+    start, keep_from = 0, 0
+    while len(audio) - start > max_samples:
+        lo, hi = (start + min_samples) // frame, (start + max_samples) // frame
+        quietest = lo + int(np.argmin(smoothed[lo:hi])) if hi > lo else hi
+        if hi > lo and smoothed[quietest] <= silence_db:
+            cut = quietest * frame + frame // 2
+            pieces.append(Piece(start, cut, keep_from))
+            start, keep_from = cut, cut
+        else:
+            cut = start + max_samples
+            pieces.append(Piece(start, cut, keep_from))
+            # A segment spanning the seam is kept by whichever piece holds
+            # its midpoint, so the one cut short at an edge gives way
+            start, keep_from = cut - overlap, cut - overlap // 2
+    pieces.append(Piece(start, len(audio), keep_from))
+    return pieces
+
+
+def _words(text: str) -> List[str]:
+    return [re.sub(r"[^\w']", "", w.lower()) for w in text.split()]
+
+
+def strip_repeated_prefix(previous: str, text: str) -> str:
+    """Drop leading words of ``text`` that repeat the tail of ``previous``"""
+    before, after = _words(previous), text.split()
+    normalized = _words(text)
+    for n in range(min(MAX_SEAM_WORDS, len(before), len(after)), 0, -1):
+        if before[-n:] == normalized[:n] and any(before[-n:]):
+            return " " + " ".join(after[n:]) if n < len(after) else ""
+    return text
+
+
+def merge_results(pieces: List[Piece], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Stitch per-piece results onto the recording's timeline.
+
+    A segment belongs to the piece whose ``keep_from`` range holds its
+    midpoint. After a hard cut, Whisper starts the next piece with a segment
+    at 0 s that runs well past the seam, so going by start time would drop it.
+    """
+    segments: List[Dict[str, Any]] = []
+    languages: Dict[str, int] = {}
+    for piece, next_piece, result in zip(pieces, pieces[1:] + [None], results):
+        offset = piece.start / SAMPLE_RATE
+        keep_from = piece.keep_from / SAMPLE_RATE
+        keep_until = next_piece.keep_from / SAMPLE_RATE if next_piece else float("inf")
+        if result.get("language"):
+            languages[result["language"]] = languages.get(result["language"], 0) + 1
+
+        first = True
+        for segment in result.get("segments", []):
+            start, end = segment["start"] + offset, segment["end"] + offset
+            if not keep_from <= (start + end) / 2 < keep_until:
+                continue
+            text = segment["text"]
+            if first and segments and piece.keep_from != piece.start:
+                # Hard cut with overlap: the seam may repeat a few words
+                text = strip_repeated_prefix(segments[-1]["text"], text)
+            first = False
+            if not text.strip():
+                continue
+            segments.append({**segment, "id": len(segments), "start": start, "end": end, "text": text})
+
+    return {
+        "text": "".join(s["text"] for s in segments),
+        "language": max(languages, key=languages.get) if languages else None,
+        "segments": segments,
+    }
+
+
+async def transcribe_long(run: Callable[..., Awaitable[Dict[str, Any]]], fn: Callable[..., Dict[str, Any]],
+                          audio: np.ndarray, parallelism: int, max_seconds: float, min_seconds: float,
+                          overlap_seconds: float, **options) -> Dict[str, Any]:
+    """Split ``audio``, run ``fn(piece, **options)`` through ``run`` concurrently and merge.
+
+    ``parallelism`` caps how many pieces of this recording are in flight at
+    once, so one recording cannot fill the whole pool queue by itself.
+    """
+    started = time.perf_counter()
+    pieces = split_at_silence(audio, max_seconds, min_seconds, overlap_seconds)
+    limit = asyncio.Semaphore(max(1, parallelism))
+
+    async def transcribe_piece(piece: Piece) -> Dict[str, Any]:
+        async with limit:
+            return await run(fn, audio[piece.start:piece.end], **options)
+
+    results = await asyncio.gather(*(transcribe_piece(p) for p in pieces))
+    merged = merge_results(pieces, results)
+    elapsed = time.perf_counter() - started
+    merged["timing"] = {
+        "total": elapsed,
+        "pieces": len(pieces),
+        "audio_seconds": len(audio) / SAMPLE_RATE,
+        "rtf": elapsed / max(len(audio) / SAMPLE_RATE, 1e-6),
+    }
+    return merged
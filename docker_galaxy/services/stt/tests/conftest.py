@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The service modules sit next to app.py, not in a package
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,57 @@
+import numpy as np
+
+from longform import SAMPLE_RATE, merge_results, split_at_silence
+
+
+def speech_without_pauses(seconds: int) -> np.ndarray:
+    """Noise with a 30 ms gap every 150 ms: syllable breaks, never a 300 ms pause"""
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, 0.1, seconds * SAMPLE_RATE).astype(np.float32)
+    frame = SAMPLE_RATE * 30 // 1000
+    for start in range(0, len(audio), 5 * frame):
+        audio[start:start + frame] = 0
+    return audio
+
+
+def fake_transcribe(piece_start: float, piece_seconds: float, segment_seconds: float = 5.0) -> dict:
+    """Whisper-like result: segments from 0 s, one word per second of the recording"""
+    segments = []
+    start = 0.0
+    while start < piece_seconds:
+        end = min(start + segment_seconds, piece_seconds)
+        words = [f"w{t}" for t in range(int(piece_start + start), int(np.ceil(piece_start + end)))]
+        segments.append({"start": start, "end": end, "text": " " + " ".join(words)})
+        start = end
+    return {"language": "en", "segments": segments}
+
+
+def test_hard_cut_overlaps_pieces():
+    audio = speech_without_pauses(130)
+    pieces = split_at_silence(audio, max_seconds=60, min_seconds=20, overlap_seconds=1.0)
+    assert [(p.start / SAMPLE_RATE, p.end / SAMPLE_RATE) for p in pieces] == [(0, 60), (59, 119), (118, 130)]
+
+
+def test_hard_cut_keeps_segment_spanning_seam():
+    audio = speech_without_pauses(130)
+    pieces = split_at_silence(audio, max_seconds=60, min_seconds=20, overlap_seconds=1.0)
+    results = [fake_transcribe(p.start / SAMPLE_RATE, (p.end - p.start) / SAMPLE_RATE) for p in pieces]
+
+    merged = merge_results(pieces, results)
+
+    assert merged["text"].split() == [f"w{t}" for t in range(130)]
+    starts = [s["start"] for s in merged["segments"]]
+    assert starts == sorted(starts)
+
+
+def test_pause_cut_has_no_overlap():
+    audio = speech_without_pauses(90)
+    audio[40 * SAMPLE_RATE:41 * SAMPLE_RATE] = 0
+    pieces = split_at_silence(audio, max_seconds=60, min_seconds=20, overlap_seconds=1.0)
+    assert len(pieces) == 2
+    assert pieces[1].start == pieces[0].end == pieces[1].keep_from
+    assert 40 * SAMPLE_RATE <= pieces[0].end <= 41 * SAMPLE_RATE
+
+    results = [fake_transcribe(p.start / SAMPLE_RATE, (p.end - p.start) / SAMPLE_RATE) for p in pieces]
+    words = merge_results(pieces, results)["text"].split()
+    # The word for the second the cut lands in comes from both pieces
+    assert sorted(set(words), key=lambda w: int(w[1:])) == [f"w{t}" for t in range(90)]
@@ -5,21 +5,63 @@ Scalable microservice for converting text to speech
 """
 
 import os
+import asyncio
 import tempfile
 import logging
-from typing import Optional, List
+from typing import Optional
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel
+import redis.asyncio as redis
+import soundfile as sf
 import torch
 import uvicorn
 from TTS.api import TTS
 
+from voice_common.audiocache import AudioCache, audio_key
+from voice_common.inference import InferenceExecutor, InferenceQueueFull, ModelReplicas, cpu_limit
+from voice_common.metrics import ServiceMetrics, instrument
+from voice_common.readiness import Readiness, install_probes
+from voice_common.ttsstore import catalog, ensure_local, use_models_dir
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = os.getenv("MODEL_NAME", "tts_models/en/ljspeech/tacotron2-DDC")
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Models are read from the MODELS_DIR volume (populate it with
+# python -m voice_common.ttsstore prepare) and checksummed before loading; downloading a missing one is a
+# development fallback. Loading runs in the background behind /readyz.
+MODELS_DIR = os.getenv("MODELS_DIR", "/app/models")
+MODEL_ALLOW_DOWNLOAD = os.getenv("MODEL_ALLOW_DOWNLOAD", "true").lower() == "true"
+MODEL_VERIFY = os.getenv("MODEL_VERIFY", "true").lower() == "true"
+# Synthesize one short sentence before reporting ready
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+use_models_dir(MODELS_DIR)
+
+# Synthesis runs on a thread pool so the event loop never waits on the model.
+# INFERENCE_WORKERS calls run at once (each extra worker holds a model
+# replica), up to INFERENCE_MAX_QUEUE more wait and the rest get 503.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "8"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "2"))
+# Torch threads per worker; the workers together stay within the CPU limit
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(max(1, cpu_limit() // max(1, INFERENCE_WORKERS)))))
+
+# Synthesized audio cache keyed by normalized text, model, voice, speed,
+# language and format. Tiers: memory LRU, files under CACHE_DIR on the cache
+# volume (read through mmap), then Redis when REDIS_URL is set, so replicas
+# share what any of them rendered. Voice cloning is not cached.
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_MEMORY_MB = int(os.getenv("CACHE_MEMORY_MB", "64"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(7 * 86400)))
+CACHE_DIR = os.getenv("CACHE_DIR", "/app/cache/audio")
+CACHE_DISK_MB = int(os.getenv("CACHE_DISK_MB", "1024"))
+REDIS_URL = os.getenv("REDIS_URL", "")
+
 # Initialize FastAPI app
 app = FastAPI(
     title="StarTales TTS Service",
@@ -36,6 +78,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+readiness = Readiness()
+install_probes(app, readiness)
+metrics = ServiceMetrics("tts", optional=("text",))
+instrument(app, metrics)
+
 # Request models
 class TTSRequest(BaseModel):
     text: str
@@ -50,37 +97,131 @@ class VoiceCloneRequest(BaseModel):
 
 # Global TTS model
 tts_model = None
+model_replicas = None
+synthesis_pool = InferenceExecutor(INFERENCE_WORKERS, INFERENCE_MAX_QUEUE, INFERENCE_RETRY_AFTER, "tts-synthesis")
+redis_client = None
+audio_cache = AudioCache(
+    CACHE_MEMORY_MB << 20, CACHE_TTL_SECONDS, CACHE_DIR, CACHE_DISK_MB << 20
+) if CACHE_ENABLED else None
+
+@metrics.on_scrape
+def refresh_gauges(m: ServiceMetrics):
+    stats = synthesis_pool.stats()
+    m.set_queue(stats["running"], stats["queued"])
 
 def load_tts_model():
     """Load TTS model with optimal settings"""
     global tts_model
     
-    model_name = os.getenv("MODEL_NAME", "tts_models/en/ljspeech/tacotron2-DDC")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    
-    logger.info(f"Loading TTS model '{model_name}' on device '{device}'")
+    logger.info(f"Loading TTS model '{MODEL_NAME}' on device '{DEVICE}'")
     
     try:
-        tts_model = TTS(model_name=model_name, progress_bar=False, gpu=(device == "cuda"))
+        ensure_local(MODEL_NAME, MODEL_VERIFY, MODEL_ALLOW_DOWNLOAD)
+        tts_model = TTS(model_name=MODEL_NAME, progress_bar=False, gpu=(DEVICE == "cuda"))
         logger.info("TTS model loaded successfully")
+        metrics.set_model_memory({MODEL_NAME: model_memory_bytes(tts_model)})
     except Exception as e:
         logger.error(f"Failed to load TTS model: {e}")
         raise
 
+def model_memory_bytes(tts) -> int:
+    """Bytes held by the synthesizer's acoustic model and vocoder"""
+    synthesizer = getattr(tts, 'synthesizer', None)
+    total = 0
+    for name in ("tts_model", "vocoder_model"):
+        module = getattr(synthesizer, name, None)
+        if isinstance(module, torch.nn.Module):
+            total += sum(t.numel() * t.element_size() for t in module.parameters())
+            total += sum(t.numel() * t.element_size() for t in module.buffers())
+    return total
+
+def run_to_file(method: str, text: str, output_path: str, **kwargs):
+    """Call one of the model's *_to_file methods on this worker's replica"""
+    getattr(model_replicas.get(), method)(text=text, file_path=output_path, **kwargs)
+
+async def synthesize_to_file(method: str, text: str, output_path: str, **kwargs):
+    """Run ``method`` on the synthesis pool and record its timing; raises InferenceQueueFull when saturated"""
+    _, queue_wait, seconds = await synthesis_pool.run_timed(run_to_file, method, text, output_path, **kwargs)
+    metrics.observe_inference(queue_wait, seconds)
+    metrics.observe_audio(sf.info(output_path).duration, seconds)
+    metrics.observe_text(len(text), seconds)
+
+def overloaded_error(exc: InferenceQueueFull) -> HTTPException:
+    """Build the 503 returned when the synthesis queue is full"""
+    return HTTPException(
+        status_code=503,
+        detail="Synthesis queue is full, retry later",
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+def discard(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def wav_response(audio: bytes, cache_source: str) -> Response:
+    headers = {"Content-Disposition": 'attachment; filename="speech.wav"'}
+    if audio_cache:
+        headers["X-TTS-Cache"] = cache_source
+    return Response(audio, media_type="audio/wav", headers=headers)
+
+def warm_up():
+    """Run the model once so the first request does not pay for lazy setup"""
+    with tempfile.NamedTemporaryFile(suffix=".wav") as temp_file:
+        run_to_file("tts_to_file", "Ready.", temp_file.name)
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize the TTS service"""
-    load_tts_model()
+    """Start loading in the background; /livez answers at once, /readyz once loaded"""
+    # Keep parallel workers from oversubscribing the CPU limit
+    torch.set_num_threads(TORCH_THREADS)
+    readiness.start(load_service())
+
+async def load_service():
+    global model_replicas, redis_client
+    with readiness.step("loading_model"):
+        await asyncio.to_thread(load_tts_model)
+        model_replicas = ModelReplicas(tts_model)
+    if MODEL_WARMUP:
+        with readiness.step("warming_up"):
+            # On the pool, so the worker that claims the loaded model is the one warmed
+            await synthesis_pool.run(warm_up)
+    # Read the model catalog once here rather than on every /models request
+    with readiness.step("reading_catalog"):
+        try:
+            await asyncio.to_thread(catalog)
+        except Exception as e:
+            logger.warning(f"Model catalog unavailable: {e}")
+    if audio_cache and REDIS_URL:
+        try:
+            redis_client = redis.from_url(REDIS_URL)
+            await redis_client.ping()
+            audio_cache.redis = redis_client
+            logger.info("Redis connection established for the audio cache")
+        except Exception as e:
+            logger.warning(f"Redis connection failed, caching locally only: {e}")
+            redis_client = None
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await readiness.cancel()
+    synthesis_pool.shutdown()
+    if redis_client:
+        await redis_client.close()
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
-        "status": "healthy",
+        "status": "healthy" if readiness.ready else readiness.state,
         "service": "tts",
+        "readiness": readiness.stats(),
         "model_loaded": tts_model is not None,
-        "device": "cuda" if torch.cuda.is_available() else "cpu",
-        "model_name": os.getenv("MODEL_NAME", "tts_models/en/ljspeech/tacotron2-DDC")
+        "device": DEVICE,
+        "model_name": MODEL_NAME,
+        "inference": synthesis_pool.stats(),
+        "cache": audio_cache.stats() if audio_cache else None
     }
 
 @app.post("/synthesize")
@@ -94,12 +235,17 @@ async def synthesize_speech(request: TTSRequest):
     Returns:
         Audio file response
     """
-    if tts_model is None:
-        raise HTTPException(status_code=503, detail="TTS model not loaded")
+    readiness.require()
     
     if not request.text.strip():
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     
+    # Repeated lines are served from the cache without touching the model
+    key = audio_key(request.text, MODEL_NAME, request.voice, request.speed, request.language)
+    cached, cache_source = await audio_cache.get(key) if audio_cache else (None, "miss")
+    if cached is not None:
+        return wav_response(bytes(cached), cache_source)
+    
     try:
         # Create temporary file for output
         with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
@@ -108,22 +254,25 @@ async def synthesize_speech(request: TTSRequest):
         logger.info(f"Synthesizing speech for text: {request.text[:50]}...")
         
         # Generate speech
-        tts_model.tts_to_file(
-            text=request.text,
-            file_path=output_path,
+        await synthesize_to_file(
+            "tts_to_file",
+            request.text,
+            output_path,
             speaker=request.voice,
             language=request.language,
             speed=request.speed
         )
         
-        # Return audio file
-        return FileResponse(
-            output_path,
-            media_type="audio/wav",
-            filename="speech.wav",
-            background=lambda: os.unlink(output_path)  # Clean up after sending
-        )
+        with open(output_path, "rb") as f:
+            audio = f.read()
+        discard(output_path)
+        if audio_cache:
+            await audio_cache.set(key, audio)
+        return wav_response(audio, cache_source)
         
+    except InferenceQueueFull as e:
+        discard(output_path)
+        raise overloaded_error(e)
     except Exception as e:
         logger.error(f"Speech synthesis failed: {e}")
         # Clean up temp file if it exists
@@ -145,8 +294,7 @@ async def clone_voice_speech(request: VoiceCloneRequest):
     Returns:
         Audio file response with cloned voice
     """
-    if tts_model is None:
-        raise HTTPException(status_code=503, detail="TTS model not loaded")
+    readiness.require()
     
     if not hasattr(tts_model, 'tts_with_vc_to_file'):
         raise HTTPException(status_code=501, detail="Voice cloning not supported by current model")
@@ -159,10 +307,11 @@ async def clone_voice_speech(request: VoiceCloneRequest):
         logger.info(f"Cloning voice for text: {request.text[:50]}...")
         
         # Generate speech with voice cloning
-        tts_model.tts_with_vc_to_file(
-            text=request.text,
+        await synthesize_to_file(
+            "tts_with_vc_to_file",
+            request.text,
+            output_path,
             speaker_wav=request.speaker_wav,
-            file_path=output_path,
             language=request.language
         )
         
@@ -174,6 +323,9 @@ async def clone_voice_speech(request: VoiceCloneRequest):
             background=lambda: os.unlink(output_path)  # Clean up after sending
         )
         
+    except InferenceQueueFull as e:
+        discard(output_path)
+        raise overloaded_error(e)
     except Exception as e:
         logger.error(f"Voice cloning failed: {e}")
         # Clean up temp file if it exists
@@ -188,26 +340,26 @@ async def clone_voice_speech(request: VoiceCloneRequest):
 async def list_models():
     """List available TTS models"""
     try:
-        available_models = TTS.list_models()
+        # Cached after the first read; the catalog only changes with the TTS package
+        available_models = catalog()
         return {
             "available_models": available_models,
-            "current_model": os.getenv("MODEL_NAME", "tts_models/en/ljspeech/tacotron2-DDC"),
-            "device": "cuda" if torch.cuda.is_available() else "cpu"
+            "current_model": MODEL_NAME,
+            "device": DEVICE
         }
     except Exception as e:
         logger.error(f"Failed to list models: {e}")
         return {
             "available_models": [],
-            "current_model": os.getenv("MODEL_NAME", "tts_models/en/ljspeech/tacotron2-DDC"),
-            "device": "cuda" if torch.cuda.is_available() else "cpu",
+            "current_model": MODEL_NAME,
+            "device": DEVICE,
             "error": str(e)
         }
 
 @app.get("/voices")
 async def list_voices():
     """List available voices for current model"""
-    if tts_model is None:
-        raise HTTPException(status_code=503, detail="TTS model not loaded")
+    readiness.require()
     
     try:
         # Get speakers if available
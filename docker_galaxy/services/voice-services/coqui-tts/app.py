@@ -6,24 +6,33 @@ Provides text-to-speech synthesis using Coqui TTS
 
 import os
 import io
-import json
 import asyncio
 import logging
-import tempfile
 import base64
-from typing import Optional, Dict, Any, List
-from pathlib import Path
+import time
+from contextlib import aclosing
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
 
 import torch
 import numpy as np
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 import redis.asyncio as redis
 from TTS.api import TTS
 import soundfile as sf
 
+from prerender import LineBundle
+from streaming import FRAME_HEADER, numbered_frames, pcm16, split_text, wav_header
+
+from voice_common.audiocache import Audio, AudioCache, audio_key, wav_duration, wav_info
+from voice_common.inference import InferenceExecutor, InferenceQueueFull, ModelReplicas, cpu_limit
+from voice_common.metrics import ServiceMetrics, instrument
+from voice_common.prefork import PreforkPool
+from voice_common.readiness import Readiness, install_probes
+from voice_common.ttsstore import ChecksumMismatch, ensure_local, use_models_dir
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -32,13 +41,74 @@ logger = logging.getLogger(__name__)
 MODEL_NAME = os.getenv("MODEL_NAME", "tts_models/en/ljspeech/tacotron2-DDC")
 DEVICE = os.getenv("DEVICE", "cpu")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+FALLBACK_MODEL_NAME = "tts_models/en/ljspeech/fast_pitch"
+
+# Models are read from the MODELS_DIR volume (populate it with
+# python -m voice_common.ttsstore prepare) and checksummed before loading; downloading a missing one is a
+# development fallback. Loading runs in the background behind /readyz.
+MODELS_DIR = os.getenv("MODELS_DIR", "/app/models")
+MODEL_ALLOW_DOWNLOAD = os.getenv("MODEL_ALLOW_DOWNLOAD", "true").lower() == "true"
+MODEL_VERIFY = os.getenv("MODEL_VERIFY", "true").lower() == "true"
+# Synthesize one short sentence before reporting ready
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+use_models_dir(MODELS_DIR)
+
+# Synthesis pool, so the event loop never waits on the model. "thread":
+# workers share a process and each extra worker holds its own model replica.
+# "prefork": workers are processes forked after the model loads, sharing its
+# weights copy-on-write. Either way INFERENCE_WORKERS calls run at once, up to
+# INFERENCE_MAX_QUEUE more wait and the rest get 503 with Retry-After.
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "8"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "2"))
+# Torch threads per worker; the workers together stay within the CPU limit
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(max(1, cpu_limit() // max(1, INFERENCE_WORKERS)))))
+DEFAULT_SAMPLE_RATE = 22050
+
+# /synthesize/stream synthesizes sentence by sentence (long sentences split at
+# clauses up to STREAM_SEGMENT_MAX_CHARS), at most STREAM_LOOKAHEAD segments
+# ahead of the client, with STREAM_PAUSE_MS of silence between segments
+STREAM_SEGMENT_MAX_CHARS = int(os.getenv("STREAM_SEGMENT_MAX_CHARS", "250"))
+STREAM_LOOKAHEAD = int(os.getenv("STREAM_LOOKAHEAD", "2"))
+STREAM_PAUSE_MS = float(os.getenv("STREAM_PAUSE_MS", "150"))
+# How long a later segment may wait out a full synthesis queue before the stream ends
+STREAM_SEGMENT_TIMEOUT = float(os.getenv("STREAM_SEGMENT_TIMEOUT", "30"))
+# /ws/stream?protocol=binary sends PCM in frames of about this many milliseconds
+WS_FRAME_MS = int(os.getenv("WS_FRAME_MS", "200"))
+# Slice size when replaying a cached stream
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", "32768"))
+
+# Synthesized audio cache keyed by normalized text, model, speaker, speed,
+# language and format. Tiers: memory LRU, files under CACHE_DIR on the models
+# volume (read through mmap), then Redis, shared with the other replicas
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_MEMORY_MB = int(os.getenv("CACHE_MEMORY_MB", "64"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(7 * 86400)))
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(MODELS_DIR, "audio-cache"))
+CACHE_DISK_MB = int(os.getenv("CACHE_DISK_MB", "1024"))
+# Content-pack narration pre-rendered by prerender.py; lines whose text,
+# speaker and model match are served from it before the cache is consulted
+LINE_BUNDLE = os.getenv("LINE_BUNDLE", os.path.join(MODELS_DIR, "lines.bundle"))
 
 # Initialize FastAPI app
 app = FastAPI(title="Coqui TTS Service", version="1.0.0")
 
 # Global variables
 tts_model = None
+model_replicas = None
 redis_client = None
+synthesis_pool = InferenceExecutor(INFERENCE_WORKERS, INFERENCE_MAX_QUEUE, INFERENCE_RETRY_AFTER, "tts-synthesis")
+loaded_model_name = None
+line_bundle: Optional[LineBundle] = None
+audio_cache = AudioCache(
+    CACHE_MEMORY_MB << 20, CACHE_TTL_SECONDS, CACHE_DIR, CACHE_DISK_MB << 20
+) if CACHE_ENABLED else None
+readiness = Readiness()
+install_probes(app, readiness)
+
+metrics = ServiceMetrics("coqui-tts", optional=("text", "first_audio"))
+instrument(app, metrics)
 
 class TTSRequest(BaseModel):
     text: str
@@ -53,6 +123,7 @@ class TTSResponse(BaseModel):
     duration: float
     processing_time: float
     speaker_id: Optional[str] = None
+    cache: Optional[str] = None  # "bundle", "memory", "disk", "redis" or "miss"
 
 class VoiceInfo(BaseModel):
     id: str
@@ -68,26 +139,92 @@ class StreamingTTSMessage(BaseModel):
     total_chunks: Optional[int] = None
     speaker_id: Optional[str] = None
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup"""
-    global tts_model, redis_client
-    
+class StreamingAudioStart(BaseModel):
+    """Sent before an utterance's binary frames in protocol=binary mode"""
+    type: str = "start"
+    id: Optional[str] = None  # Echoes the request's "id"
+    format: str = "pcm_s16le"
+    sample_rate: int
+    channels: int = 1
+    frame_header: str = FRAME_HEADER  # struct format of each frame's sequence number
+    speaker_id: Optional[str] = None
+    cache: Optional[str] = None
+
+class StreamingAudioEnd(BaseModel):
+    """Sent after an utterance's last binary frame"""
+    type: str = "end"
+    id: Optional[str] = None
+    frames: int
+    duration: float
+    processing_time: float
+    error: Optional[str] = None  # Set when synthesis failed part way through
+
+def load_model(model_name: str) -> TTS:
+    """Construct TTS from the volume; never downloads unless MODEL_ALLOW_DOWNLOAD is set"""
+    ensure_local(model_name, MODEL_VERIFY, MODEL_ALLOW_DOWNLOAD)
+    model = TTS(model_name=model_name, progress_bar=False)
+    if DEVICE == "cuda" and torch.cuda.is_available():
+        model = model.to(DEVICE)
+    return model
+
+def load_with_fallback() -> Tuple[TTS, str]:
     logger.info(f"Loading TTS model: {MODEL_NAME}")
     try:
-        tts_model = TTS(model_name=MODEL_NAME, progress_bar=False)
-        if DEVICE == "cuda" and torch.cuda.is_available():
-            tts_model = tts_model.to(DEVICE)
+        model = load_model(MODEL_NAME)
         logger.info(f"TTS model loaded on device: {DEVICE}")
+        return model, MODEL_NAME
+    except ChecksumMismatch:
+        # A corrupt volume needs fixing, not papering over with another model
+        raise
     except Exception as e:
         logger.error(f"Failed to load TTS model: {e}")
         # Fallback to a simpler model
-        try:
-            tts_model = TTS(model_name="tts_models/en/ljspeech/fast_pitch", progress_bar=False)
-            logger.info("Loaded fallback TTS model")
-        except Exception as e2:
-            logger.error(f"Failed to load fallback model: {e2}")
-            tts_model = None
+        model = load_model(FALLBACK_MODEL_NAME)
+        logger.info("Loaded fallback TTS model")
+        return model, FALLBACK_MODEL_NAME
+
+@app.on_event("startup")
+async def startup_event():
+    """Start loading in the background; /livez answers at once, /readyz once loaded"""
+    # Keep parallel workers from oversubscribing the CPU limit. A prefork
+    # parent stays on one thread so torch never starts the OpenMP pool that
+    # would hang its forked workers; each worker sets its own count.
+    torch.set_num_threads(1 if INFERENCE_MODE == "prefork" else TORCH_THREADS)
+    readiness.start(load_service())
+
+def init_worker():
+    """Set up a forked worker: its thread count, then warm-up"""
+    torch.set_num_threads(TORCH_THREADS)
+    if MODEL_WARMUP:
+        synthesize_wav("Ready.")
+
+async def load_service():
+    """Load the model and start the workers that depend on it, in startup order"""
+    global tts_model, model_replicas, redis_client, synthesis_pool, loaded_model_name, line_bundle
+    
+    with readiness.step("loading_model"):
+        tts_model, loaded_model_name = await asyncio.to_thread(load_with_fallback)
+        metrics.set_model_memory({loaded_model_name: model_memory_bytes(tts_model)})
+        if INFERENCE_MODE != "prefork":
+            model_replicas = ModelReplicas(tts_model)
+    
+    if INFERENCE_MODE == "prefork":
+        # Fork before the parent runs the model or opens any other connection;
+        # each worker warms itself up
+        with readiness.step("forking_workers"):
+            synthesis_pool.shutdown()
+            synthesis_pool = PreforkPool(
+                INFERENCE_WORKERS,
+                INFERENCE_MAX_QUEUE,
+                INFERENCE_RETRY_AFTER,
+                full_error=InferenceQueueFull,
+                initializer=init_worker
+            )
+            await asyncio.to_thread(synthesis_pool.start)
+    elif MODEL_WARMUP:
+        with readiness.step("warming_up"):
+            # On the pool, so the worker that claims the loaded model is the one warmed
+            await synthesis_pool.run(synthesize_wav, "Ready.")
     
     # Initialize Redis connection
     try:
@@ -97,11 +234,28 @@ async def startup_event():
     except Exception as e:
         logger.warning(f"Redis connection failed: {e}")
         redis_client = None
+    if audio_cache:
+        audio_cache.redis = redis_client
+    
+    with readiness.step("opening_bundle"):
+        line_bundle = LineBundle.open(LINE_BUNDLE)
+        if line_bundle:
+            logger.info(f"Serving {len(line_bundle)} pre-rendered lines from {LINE_BUNDLE}")
+            if line_bundle.meta.get("model") != loaded_model_name:
+                logger.warning(f"Line bundle was rendered with {line_bundle.meta.get('model')}, "
+                               f"not {loaded_model_name}; none of its lines will match")
+
+@metrics.on_scrape
+def refresh_gauges(m: ServiceMetrics):
+    stats = synthesis_pool.stats()
+    m.set_queue(stats["running"], stats["queued"])
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     global redis_client
+    await readiness.cancel()
+    synthesis_pool.shutdown()
     if redis_client:
         await redis_client.close()
 
@@ -109,18 +263,22 @@ async def shutdown_event():
 async def health_check():
     """Health check endpoint"""
     return {
-        "status": "healthy" if tts_model else "degraded",
-        "model": MODEL_NAME,
+        "status": "healthy" if readiness.ready else readiness.state,
+        "readiness": readiness.stats(),
+        "model": loaded_model_name or MODEL_NAME,
         "device": DEVICE,
         "redis_connected": redis_client is not None,
-        "model_loaded": tts_model is not None
+        "model_loaded": tts_model is not None,
+        "inference": synthesis_pool.stats(),
+        "cache": audio_cache.stats() if audio_cache else None,
+        "bundle": line_bundle.stats() if line_bundle else None
     }
 
 @app.get("/models")
 async def get_models():
     """Get available TTS models"""
     return {
-        "current_model": MODEL_NAME,
+        "current_model": loaded_model_name or MODEL_NAME,
         "available_models": [
             "tts_models/en/ljspeech/tacotron2-DDC",
             "tts_models/en/ljspeech/fast_pitch",
@@ -164,126 +322,324 @@ async def get_voices():
     
     return voices
 
+def synthesize_wav(text: str, speaker_id: Optional[str] = None) -> Tuple[np.ndarray, int]:
+    """Run the model and return float32 samples with their sample rate"""
+    model = model_replicas.get() if model_replicas else tts_model
+    if speaker_id and getattr(model, 'speakers', None):
+        wav = model.tts(text=text, speaker=speaker_id)
+    else:
+        wav = model.tts(text=text)
+    synthesizer = getattr(model, 'synthesizer', None)
+    sample_rate = getattr(synthesizer, 'output_sample_rate', None) or DEFAULT_SAMPLE_RATE
+    return np.asarray(wav, dtype=np.float32), sample_rate
+
+def model_memory_bytes(tts) -> int:
+    """Bytes held by the synthesizer's acoustic model and vocoder"""
+    synthesizer = getattr(tts, 'synthesizer', None)
+    total = 0
+    for name in ("tts_model", "vocoder_model"):
+        module = getattr(synthesizer, name, None)
+        if isinstance(module, torch.nn.Module):
+            total += sum(t.numel() * t.element_size() for t in module.parameters())
+            total += sum(t.numel() * t.element_size() for t in module.buffers())
+    return total
+
+async def synthesize(text: str, speaker_id: Optional[str] = None) -> Tuple[np.ndarray, int]:
+    """Synthesize on the pool; raises InferenceQueueFull when it is saturated"""
+    (wav, sample_rate), queue_wait, seconds = await synthesis_pool.run_timed(synthesize_wav, text, speaker_id)
+    metrics.observe_inference(queue_wait, seconds)
+    metrics.observe_audio(len(wav) / sample_rate, seconds)
+    metrics.observe_text(len(text), seconds)
+    return wav, sample_rate
+
+def overloaded_error(exc: InferenceQueueFull) -> HTTPException:
+    """Build the 503 returned when the synthesis queue is full"""
+    return HTTPException(
+        status_code=503,
+        detail="Synthesis queue is full, retry later",
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+def wav_bytes(wav: np.ndarray, sample_rate: int) -> bytes:
+    """Encode samples as a WAV file in memory"""
+    buffer = io.BytesIO()
+    sf.write(buffer, wav, sample_rate, format='WAV', subtype='PCM_16')
+    return buffer.getvalue()
+
+def cache_key(text: str, speaker_id: Optional[str], fmt: str, speed: Optional[float] = 1.0,
+              language: Optional[str] = "en") -> str:
+    return audio_key(text, loaded_model_name or MODEL_NAME, speaker_id, speed, language, fmt)
+
+async def lookup_audio(text: str, speaker_id: Optional[str], fmt: str, speed: Optional[float] = 1.0,
+                       language: Optional[str] = "en") -> Tuple[Optional[Audio], str]:
+    """A pre-rendered line, else a cached result; returns (wav or None, source)"""
+    if line_bundle:
+        # The bundle holds whole WAVs, which every endpoint can send as they are
+        audio = line_bundle.get(cache_key(text, speaker_id, "wav", speed, language))
+        if audio is not None:
+            return audio, "bundle"
+    if audio_cache:
+        return await audio_cache.get(cache_key(text, speaker_id, fmt, speed, language))
+    return None, "miss"
+
+async def synthesize_cached(text: str, speaker_id: Optional[str], speed: Optional[float] = 1.0,
+                            language: Optional[str] = "en") -> Tuple[Audio, str]:
+    """WAV for ``text`` from the cache, or synthesized and remembered; returns (wav, cache source)"""
+    cached, source = await lookup_audio(text, speaker_id, "wav", speed, language)
+    if cached is not None:
+        return cached, source
+    wav, sample_rate = await synthesize(text, speaker_id)
+    with metrics.stage("encode"):
+        data = wav_bytes(wav, sample_rate)
+    if audio_cache:
+        await audio_cache.set(cache_key(text, speaker_id, "wav", speed, language), data)
+    return data, "miss"
+
 @app.post("/synthesize", response_model=TTSResponse)
 async def synthesize_speech(request: TTSRequest):
     """Synthesize speech from text"""
-    if not tts_model:
-        raise HTTPException(status_code=503, detail="TTS model not loaded")
+    readiness.require()
     
     try:
-        import time
         start_time = time.time()
         
-        # Create temporary file for output
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
-            output_path = tmp_file.name
-        
-        # Synthesize speech
-        if hasattr(tts_model, 'tts_to_file'):
-            # Multi-speaker model
-            if request.speaker_id and hasattr(tts_model, 'speakers') and tts_model.speakers:
-                tts_model.tts_to_file(
-                    text=request.text,
-                    file_path=output_path,
-                    speaker=request.speaker_id
-                )
-            else:
-                tts_model.tts_to_file(
-                    text=request.text,
-                    file_path=output_path
-                )
-        else:
-            # Single speaker model
-            wav = tts_model.tts(text=request.text)
-            sf.write(output_path, wav, 22050)
-        
-        # Read the generated audio
-        audio_data, sample_rate = sf.read(output_path)
-        
-        # Clean up temp file
-        os.unlink(output_path)
-        
-        # Convert to bytes and encode
-        audio_bytes = io.BytesIO()
-        sf.write(audio_bytes, audio_data, sample_rate, format='WAV')
-        audio_bytes.seek(0)
+        # Synthesize speech, or reuse the audio of an identical request
+        audio_file, cache_source = await synthesize_cached(
+            request.text, request.speaker_id, request.speed, request.language
+        )
         
         # Encode to base64
-        audio_b64 = base64.b64encode(audio_bytes.read()).decode('utf-8')
+        with metrics.stage("encode"):
+            audio_b64 = base64.b64encode(audio_file).decode('utf-8')
         
         processing_time = time.time() - start_time
-        duration = len(audio_data) / sample_rate
+        sample_rate, duration = wav_duration(audio_file)
         
         return TTSResponse(
             audio_data=audio_b64,
             sample_rate=sample_rate,
             duration=duration,
             processing_time=processing_time,
-            speaker_id=request.speaker_id
+            speaker_id=request.speaker_id,
+            cache=cache_source if audio_cache or line_bundle else None
         )
         
+    except InferenceQueueFull as e:
+        raise overloaded_error(e)
     except Exception as e:
         logger.error(f"TTS synthesis error: {e}")
         raise HTTPException(status_code=500, detail=f"Synthesis failed: {str(e)}")
 
+async def synthesize_segment(text: str, speaker_id: Optional[str]) -> Tuple[np.ndarray, int]:
+    """Synthesize a later segment of a stream that is already playing, waiting out a full queue"""
+    deadline = time.perf_counter() + STREAM_SEGMENT_TIMEOUT
+    while True:
+        try:
+            return await synthesize(text, speaker_id)
+        except InferenceQueueFull:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+async def synthesize_segments(segments: List[str], speaker_id: Optional[str]) -> AsyncIterator[Tuple[np.ndarray, int]]:
+    """Yield each segment's audio in order while up to STREAM_LOOKAHEAD later ones synthesize
+    
+    The first segment is synthesized on demand, so a full queue raises
+    InferenceQueueFull before anything has been sent. Close the iterator
+    (``aclosing``) to stop synthesizing ahead when the client goes away.
+    """
+    first = await synthesize(segments[0], speaker_id)
+    # Bounded, so synthesis stays at most STREAM_LOOKAHEAD segments ahead of the client
+    ready: asyncio.Queue = asyncio.Queue(maxsize=max(1, STREAM_LOOKAHEAD))
+    
+    async def synthesize_rest():
+        try:
+            for text in segments[1:]:
+                await ready.put(await synthesize_segment(text, speaker_id))
+        except Exception as e:
+            await ready.put(e)
+            return
+        await ready.put(None)
+    
+    producer = asyncio.create_task(synthesize_rest())
+    try:
+        yield first
+        while (item := await ready.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+
 @app.post("/synthesize/stream")
 async def synthesize_speech_stream(request: TTSRequest):
-    """Stream synthesized speech in chunks"""
-    if not tts_model:
-        raise HTTPException(status_code=503, detail="TTS model not loaded")
+    """Stream speech as a WAV that starts playing once the first sentence is synthesized
+    
+    The text is split into sentences and synthesized in order while earlier
+    ones are sent. The WAV header leaves the length open, as live streams do.
+    """
+    readiness.require()
+    start = time.perf_counter()
+    
+    segments = split_text(request.text, STREAM_SEGMENT_MAX_CHARS)
+    if not segments:
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    
+    key = cache_key(request.text, request.speaker_id, "wav-stream", request.speed, request.language)
+    cached, cache_source = await lookup_audio(
+        request.text, request.speaker_id, "wav-stream", request.speed, request.language
+    )
+    if cached is not None:
+        async def send_cached():
+            for offset in range(0, len(cached), STREAM_CHUNK_BYTES):
+                if offset == 0:
+                    metrics.observe_first_audio(time.perf_counter() - start, "/synthesize/stream")
+                yield bytes(cached[offset:offset + STREAM_CHUNK_BYTES])
+        
+        return StreamingResponse(
+            send_cached(),
+            media_type="audio/wav",
+            headers={"Content-Disposition": "attachment; filename=speech.wav", "X-TTS-Cache": cache_source}
+        )
+    
+    # Synthesize the first segment before the response starts, so overload can still be a 503
+    audio = synthesize_segments(segments, request.speaker_id)
+    try:
+        first, sample_rate = await anext(audio)
+    except InferenceQueueFull as e:
+        raise overloaded_error(e)
+    except Exception as e:
+        logger.error(f"Streaming TTS error: {e}")
+        raise HTTPException(status_code=500, detail=f"Synthesis failed: {str(e)}")
     
     async def generate_audio_stream():
-        try:
-            # Create temporary file for output
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
-                output_path = tmp_file.name
-            
-            # Synthesize speech
-            if hasattr(tts_model, 'tts_to_file'):
-                if request.speaker_id and hasattr(tts_model, 'speakers') and tts_model.speakers:
-                    tts_model.tts_to_file(
-                        text=request.text,
-                        file_path=output_path,
-                        speaker=request.speaker_id
-                    )
-                else:
-                    tts_model.tts_to_file(
-                        text=request.text,
-                        file_path=output_path
-                    )
-            else:
-                wav = tts_model.tts(text=request.text)
-                sf.write(output_path, wav, 22050)
+        async with aclosing(audio):
+            with metrics.stage("encode"):
+                chunk = pcm16(first)
+                pause = bytes(2 * int(sample_rate * STREAM_PAUSE_MS / 1000))
+            pcm = [chunk]
+            metrics.observe_first_audio(time.perf_counter() - start, "/synthesize/stream")
+            yield wav_header(sample_rate) + chunk
             
-            # Stream the audio file in chunks
-            chunk_size = 4096
-            with open(output_path, 'rb') as f:
-                while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
+            try:
+                async for wav, _ in audio:
+                    with metrics.stage("encode"):
+                        chunk = pause + pcm16(wav)
+                    pcm.append(chunk)
                     yield chunk
-            
-            # Clean up
-            os.unlink(output_path)
-            
-        except Exception as e:
-            logger.error(f"Streaming TTS error: {e}")
-            yield b""  # Empty chunk to signal error
+            except Exception as e:
+                logger.error(f"Streaming TTS error, ending stream early: {e}")
+                return
+        
+        # Only a stream that ran to the end is worth replaying
+        if audio_cache:
+            data = b"".join(pcm)
+            await audio_cache.set(key, wav_header(sample_rate, data_size=len(data)) + data)
     
     return StreamingResponse(
         generate_audio_stream(),
         media_type="audio/wav",
-        headers={"Content-Disposition": "attachment; filename=speech.wav"}
+        headers={"Content-Disposition": "attachment; filename=speech.wav", "X-TTS-Cache": cache_source}
     )
 
+async def send_binary_utterance(websocket: WebSocket, data: Dict[str, Any]):
+    """Send one utterance as a start message, sequence-numbered PCM frames and an end message"""
+    start = time.perf_counter()
+    speaker_id = data.get("speaker_id")
+    segments = split_text(data["text"], STREAM_SEGMENT_MAX_CHARS)
+    if not segments:
+        await websocket.send_json({"error": "Text cannot be empty", "id": data.get("id")})
+        return
+    
+    sequence = 0
+    size = 0
+    error = None
+    key = cache_key(data["text"], speaker_id, "wav-stream", data.get("speed", 1.0), data.get("language", "en"))
+    cached, cache_source = await lookup_audio(
+        data["text"], speaker_id, "wav-stream", data.get("speed", 1.0), data.get("language", "en")
+    )
+    
+    if cached is not None:
+        sample_rate, offset, size = wav_info(cached)
+        await websocket.send_json(StreamingAudioStart(
+            id=data.get("id"), sample_rate=sample_rate, speaker_id=speaker_id, cache=cache_source
+        ).dict())
+        metrics.observe_first_audio(time.perf_counter() - start)
+        for frame in numbered_frames(cached[offset:offset + size], 0, 2 * int(sample_rate * WS_FRAME_MS / 1000)):
+            await websocket.send_bytes(frame)
+            sequence += 1
+        await websocket.send_json(StreamingAudioEnd(
+            id=data.get("id"),
+            frames=sequence,
+            duration=size / (2 * sample_rate),
+            processing_time=time.perf_counter() - start
+        ).dict())
+        return
+    
+    sample_rate = DEFAULT_SAMPLE_RATE
+    pcm = []
+    async with aclosing(synthesize_segments(segments, speaker_id)) as audio:
+        try:
+            async for wav, sample_rate in audio:
+                with metrics.stage("encode"):
+                    chunk = pcm16(wav)
+                if sequence == 0:
+                    await websocket.send_json(StreamingAudioStart(
+                        id=data.get("id"), sample_rate=sample_rate, speaker_id=speaker_id,
+                        cache=cache_source if audio_cache or line_bundle else None
+                    ).dict())
+                    metrics.observe_first_audio(time.perf_counter() - start)
+                else:
+                    chunk = bytes(2 * int(sample_rate * STREAM_PAUSE_MS / 1000)) + chunk
+                for frame in numbered_frames(chunk, sequence, 2 * int(sample_rate * WS_FRAME_MS / 1000)):
+                    await websocket.send_bytes(frame)
+                    sequence += 1
+                pcm.append(chunk)
+                size += len(chunk)
+        except InferenceQueueFull:
+            if sequence == 0:
+                raise
+            error = "Synthesis queue is full"
+        except WebSocketDisconnect:
+            raise
+        except Exception as e:
+            if sequence == 0:
+                raise
+            logger.error(f"WebSocket TTS error, ending utterance early: {e}")
+            error = f"TTS error: {str(e)}"
+    
+    await websocket.send_json(StreamingAudioEnd(
+        id=data.get("id"),
+        frames=sequence,
+        duration=size / (2 * sample_rate),
+        processing_time=time.perf_counter() - start,
+        error=error
+    ).dict())
+    
+    # Same audio as /synthesize/stream, so either can replay the other's
+    if audio_cache and error is None:
+        pcm = b"".join(pcm)
+        await audio_cache.set(key, wav_header(sample_rate, data_size=len(pcm)) + pcm)
+
 @app.websocket("/ws/stream")
-async def websocket_stream(websocket: WebSocket):
-    """WebSocket endpoint for real-time TTS streaming"""
+async def websocket_stream(websocket: WebSocket, protocol: str = Query("json")):
+    """WebSocket endpoint for real-time TTS streaming
+    
+    ``protocol=json`` (default) answers each text with one "complete" message
+    holding the whole WAV in base64. ``protocol=binary`` streams each text
+    sentence by sentence: a "start" JSON message with the audio format, binary
+    frames of 16-bit PCM each prefixed by a little-endian uint32 sequence
+    number, then an "end" JSON message.
+    """
     await websocket.accept()
     
-    if not tts_model:
-        await websocket.send_json({"error": "TTS model not loaded"})
+    if protocol not in ("json", "binary"):
+        await websocket.send_json({"error": f"Unknown protocol '{protocol}', use 'json' or 'binary'"})
+        await websocket.close()
+        return
+    
+    if not readiness.ready:
+        await websocket.send_json({"error": f"Service is {readiness.state}", "retry_after": readiness.retry_after})
         await websocket.close()
         return
     
@@ -302,44 +658,35 @@ async def websocket_stream(websocket: WebSocket):
             speaker_id = data.get("speaker_id")
             
             try:
-                # Create temporary file
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
-                    output_path = tmp_file.name
-                
-                # Synthesize
-                if hasattr(tts_model, 'tts_to_file'):
-                    if speaker_id and hasattr(tts_model, 'speakers') and tts_model.speakers:
-                        tts_model.tts_to_file(
-                            text=text,
-                            file_path=output_path,
-                            speaker=speaker_id
-                        )
-                    else:
-                        tts_model.tts_to_file(text=text, file_path=output_path)
-                else:
-                    wav = tts_model.tts(text=text)
-                    sf.write(output_path, wav, 22050)
-                
-                # Read and encode audio
-                with open(output_path, 'rb') as f:
-                    audio_data = f.read()
+                if protocol == "binary":
+                    async with metrics.track("/ws/stream"):
+                        await send_binary_utterance(websocket, data)
+                    continue
                 
-                audio_b64 = base64.b64encode(audio_data).decode('utf-8')
-                
-                # Send response
-                response = StreamingTTSMessage(
-                    type="complete",
-                    audio_data=audio_b64,
-                    chunk_index=0,
-                    total_chunks=1,
-                    speaker_id=speaker_id
-                )
-                
-                await websocket.send_json(response.dict())
-                
-                # Clean up
-                os.unlink(output_path)
+                async with metrics.track("/ws/stream"):
+                    # Synthesize, or reuse the audio of an identical request
+                    audio_file, _ = await synthesize_cached(
+                        text, speaker_id, data.get("speed", 1.0), data.get("language", "en")
+                    )
+                    with metrics.stage("encode"):
+                        audio_b64 = base64.b64encode(audio_file).decode('utf-8')
+                    
+                    # Send response
+                    response = StreamingTTSMessage(
+                        type="complete",
+                        audio_data=audio_b64,
+                        chunk_index=0,
+                        total_chunks=1,
+                        speaker_id=speaker_id
+                    )
+                    
+                    await websocket.send_json(response.dict())
                 
+            except InferenceQueueFull as e:
+                logger.warning("Rejecting WebSocket synthesis, queue is full")
+                await websocket.send_json({"error": "Synthesis queue is full", "retry_after": e.retry_after})
+            except WebSocketDisconnect:
+                raise
             except Exception as e:
                 logger.error(f"WebSocket TTS error: {e}")
                 await websocket.send_json({"error": f"TTS error: {str(e)}"})
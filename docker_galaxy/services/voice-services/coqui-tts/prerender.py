@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Offline pre-rendering of content-pack narration
+Synthesizes the fixed lines of the mission and world packs into one indexed bundle the service serves through mmap
+
+Usage:
+    python prerender.py build --packs /app/content/packs --bundle /app/models/lines.bundle
+    python prerender.py info --bundle /app/models/lines.bundle
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from streaming import pcm16, wav_header
+
+from voice_common.audiocache import KEY_PREFIX, audio_key, normalize_text
+from voice_common.inference import cpu_limit
+
+logger = logging.getLogger(__name__)
+
+# Layout: header | WAV files back to back | offset table sorted by digest | JSON metadata
+MAGIC = b"STLB"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIQQQ")  # magic, version, reserved, lines, table offset, metadata offset, metadata size
+ENTRY = struct.Struct("<20sQI")  # key digest, WAV offset, WAV size
+DATA_START = 64
+
+# Keys whose strings are spoken; ids, conditions and stats never are
+SPOKEN_KEYS = ("name", "description", "desc", "twist", "narration", "dialogue", "lines", "text")
+PACK_GLOBS = ("missions/*.json", "worlds/*.json")
+
+
+def digest_of(key: str) -> bytes:
+    return bytes.fromhex(key[len(KEY_PREFIX):])
+
+
+def spoken_strings(node: Any, spoken: bool = False) -> Iterator[str]:
+    """Strings under SPOKEN_KEYS anywhere in a pack, including lists such as "dialogue": [...]"""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from spoken_strings(value, key in SPOKEN_KEYS)
+    elif isinstance(node, list):
+        for value in node:
+            yield from spoken_strings(value, spoken)
+    elif isinstance(node, str) and spoken and node.strip():
+        yield node
+
+
+def pack_lines(packs_dir: str) -> List[str]:
+    """Every spoken line of the mission and world packs, normalized and deduplicated in pack order"""
+    root = Path(packs_dir)
+    lines: Dict[str, None] = {}
+    for pattern in PACK_GLOBS:
+        for path in sorted(root.glob(pattern)):
+            try:
+                pack = json.loads(path.read_text())
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable content pack {path}: {e}")
+                continue
+            for text in spoken_strings(pack):
+                lines.setdefault(normalize_text(text))
+    return list(lines)
+
+
+class LineBundle:
+    """Read-only view of a bundle file.
+
+    The file stays mapped for the life of the process and ``get`` returns a
+    slice of the mapping, so serving a line copies nothing until it is sent.
+    A rebuild replaces the file by rename, which leaves this mapping intact.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mapped)
+        magic, version, _, count, table_offset, meta_offset, meta_size = HEADER.unpack_from(self._view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} line bundle")
+        self.index: Dict[bytes, Tuple[int, int]] = {}
+        for i in range(count):
+            digest, offset, size = ENTRY.unpack_from(self._view, table_offset + i * ENTRY.size)
+            self.index[digest] = (offset, size)
+        self.meta: Dict[str, Any] = json.loads(bytes(self._view[meta_offset:meta_offset + meta_size]))
+        self.hits = 0
+        self.bytes_served = 0
+
+    @classmethod
+    def open(cls, path: str) -> Optional["LineBundle"]:
+        """The bundle at ``path``, or None when there is none or it is unreadable"""
+        try:
+            return cls(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Ignoring unreadable line bundle {path}: {e}")
+            return None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return digest_of(key) in self.index
+
+    def get(self, key: str) -> Optional[memoryview]:
+        entry = self.index.get(digest_of(key))
+        if entry is None:
+            return None
+        offset, size = entry
+        self.hits += 1
+        self.bytes_served += size
+        return self._view[offset:offset + size]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "lines": len(self.index),
+            "bytes": len(self._mapped),
+            "model": self.meta.get("model"),
+            "speaker": self.meta.get("speaker"),
+            "created": self.meta.get("created"),
+            "hits": self.hits,
+            "bytes_served": self.bytes_served,
+        }
+
+
+# Set in the parent before the pool forks, so workers share the weights copy-on-write
+_model = None
+
+
+def _init_worker(torch_threads: int):
+    import torch
+    torch.set_num_threads(torch_threads)
+
+
+def _render_batch(batch: List[Tuple[str, str]], speaker: Optional[str]) -> List[Tuple[str, Optional[bytes], str]]:
+    """Synthesize (key, text) pairs into (key, WAV bytes or None, error) on this worker"""
+    results = []
+    sample_rate = getattr(getattr(_model, "synthesizer", None), "output_sample_rate", None) or 22050
+    for key, text in batch:
+        try:
+            wav = _model.tts(text=text, speaker=speaker) if speaker else _model.tts(text=text)
+            pcm = pcm16(np.asarray(wav, dtype=np.float32))
+            results.append((key, wav_header(sample_rate, data_size=len(pcm)) + pcm, ""))
+        except Exception as e:
+            results.append((key, None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def batches(pending: List[Tuple[str, str]], batch_size: int) -> List[List[Tuple[str, str]]]:
+    """Longest lines first, so the slowest batches start early and the pool drains evenly"""
+    pending = sorted(pending, key=lambda item: len(item[1]), reverse=True)
+    return [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+
+def load_model(model_name: str, models_dir: str, verify: bool, allow_download: bool):
+    """The same volume-first loading the service does"""
+    from TTS.api import TTS
+    from voice_common.ttsstore import ensure_local, use_models_dir
+
+    use_models_dir(models_dir)
+    ensure_local(model_name, verify, allow_download)
+    return TTS(model_name=model_name, progress_bar=False)
+
+
+def build(packs_dir: str, bundle_path: str, model_name: str, models_dir: str, speaker: Optional[str] = None,
+          language: str = "en", workers: int = 0, batch_size: int = 8, verify: bool = True,
+          allow_download: bool = True) -> Dict[str, int]:
+    """Write the bundle for every pack line, reusing the audio of lines already in the old bundle"""
+    global _model
+
+    lines = pack_lines(packs_dir)
+    wanted = {audio_key(text, model_name, speaker, 1.0, language): text for text in lines}
+    previous = LineBundle.open(bundle_path)
+    reused = [key for key in wanted if previous is not None and key in previous]
+    pending = [(key, text) for key, text in wanted.items() if previous is None or key not in previous]
+    logger.info(f"{len(lines)} distinct lines: {len(reused)} already rendered, {len(pending)} to render")
+
+    stats = {"lines": len(wanted), "reused": len(reused), "rendered": 0, "failed": 0, "dropped": 0}
+    if previous is not None:
+        stats["dropped"] = len(previous) - len(reused)
+    if not pending and not stats["dropped"] and previous is not None:
+        logger.info(f"{bundle_path} is up to date")
+        return stats
+
+    workers = workers or cpu_limit()
+    if pending:
+        _model = load_model(model_name, models_dir, verify, allow_download)
+
+    target = Path(bundle_path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_suffix(f".{os.getpid()}.tmp")
+    table: List[Tuple[bytes, int, int]] = []
+    start = time.perf_counter()
+
+    with open(tmp, "wb") as out:
+        out.write(bytes(DATA_START))
+
+        def append(key: str, audio) -> None:
+            table.append((digest_of(key), out.tell(), len(audio)))
+            out.write(audio)
+
+        for key in reused:
+            append(key, previous.get(key))
+
+        work = batches(pending, max(1, batch_size))
+        if workers == 1 or len(work) <= 1:
+            done_batches = (_render_batch(batch, speaker) for batch in work)
+        else:
+            done_batches = _render_parallel(work, speaker, workers)
+        for results in done_batches:
+            for key, audio, error in results:
+                if audio is None:
+                    logger.warning(f"Failed to render {wanted[key][:50]!r}: {error}")
+                    stats["failed"] += 1
+                    continue
+                append(key, audio)
+                stats["rendered"] += 1
+            logger.info(f"Rendered {stats['rendered'] + stats['failed']}/{len(pending)} lines "
+                        f"in {time.perf_counter() - start:.1f}s")
+
+        table.sort()
+        table_offset = out.tell()
+        for entry in table:
+            out.write(ENTRY.pack(*entry))
+        meta = json.dumps({
+            "model": model_name,
+            "speaker": speaker,
+            "language": language,
+            "lines": len(table),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }).encode()
+        meta_offset = out.tell()
+        out.write(meta)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, 0, len(table), table_offset, meta_offset, len(meta)))
+
+    # Rename into place; a running service keeps its mapping of the old file
+    os.replace(tmp, target)
+    logger.info(f"Wrote {len(table)} lines to {target} ({target.stat().st_size >> 20} MB)")
+    return stats
+
+
+def _render_parallel(work: List[List[Tuple[str, str]]], speaker: Optional[str], workers: int) -> Iterator[list]:
+    """Yield batch results as they finish, with at most two batches queued per worker"""
+    torch_threads = max(1, cpu_limit() // workers)
+    with ProcessPoolExecutor(workers, mp_context=get_context("fork"),
+                             initializer=_init_worker, initargs=(torch_threads,)) as pool:
+        queue = iter(work)
+        running = set()
+        while True:
+            for batch in queue:
+                running.add(pool.submit(_render_batch, batch, speaker))
+                if len(running) >= 2 * workers:
+                    break
+            if not running:
+                return
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render content-pack narration into a line bundle")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Render new and changed lines and rewrite the bundle")
+    build_cmd.add_argument("--packs", default=os.getenv("CONTENT_PACKS_DIR", "/app/content/packs"))
+    build_cmd.add_argument("--bundle", default=os.getenv("LINE_BUNDLE", "/app/models/lines.bundle"))
+    build_cmd.add_argument("--model", default=os.getenv("MODEL_NAME", "tts_models/en/ljspeech/tacotron2-DDC"))
+    build_cmd.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "/app/models"))
+    build_cmd.add_argument("--speaker", default=None)
+    build_cmd.add_argument("--language", default="en")
+    build_cmd.add_argument("--workers", type=int, default=0, help="Processes; 0 uses every available CPU")
+    build_cmd.add_argument("--batch-size", type=int, default=8, help="Lines per task sent to a worker")
+    build_cmd.add_argument("--no-download", action="store_true", help="Fail instead of downloading a missing model")
+    build_cmd.add_argument("--no-verify", action="store_true", help="Skip model checksum verification")
+    info_cmd = sub.add_parser("info", help="Describe an existing bundle")
+    info_cmd.add_argument("--bundle", default=os.getenv("LINE_BUNDLE", "/app/models/lines.bundle"))
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    if args.command == "build":
+        stats = build(
+            args.packs, args.bundle, args.model, args.models_dir, args.speaker, args.language,
+            args.workers, args.batch_size, not args.no_verify, not args.no_download
+        )
+        print(json.dumps(stats))
+        if stats["failed"]:
+            sys.exit(1)
+    else:
+        bundle = LineBundle.open(args.bundle)
+        if bundle is None:
+            sys.exit(f"No readable bundle at {args.bundle}")
+        print(json.dumps(bundle.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
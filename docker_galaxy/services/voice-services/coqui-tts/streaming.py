@@ -0,0 +1,85 @@
+"""
+Incremental streaming synthesis
+Splits text into sentence-sized segments and encodes audio as an open-ended WAV stream or numbered PCM frames
+"""
+
+import re
+import struct
+from typing import Iterator, List, Union
+
+import numpy as np
+
+# Sizes for a stream whose length is not known up front; players read to EOF
+STREAMING_SIZE = 0xFFFFFFFF
+# Binary WebSocket frames start with their sequence number
+FRAME_HEADER = "<I"
+
+SENTENCE_END = re.compile(r"(?:(?<=[.!?…])|(?<=[.!?…][\"'”’)\]]))\s+")
+CLAUSE_END = re.compile(r"(?<=[,;:—–])\s+")
+# Endings that look like a sentence break but rarely are
+ABBREVIATIONS = ("mr.", "mrs.", "ms.", "dr.", "st.", "vs.", "etc.", "e.g.", "i.e.", "no.", "capt.", "gen.", "adm.")
+
+
+def split_text(text: str, max_chars: int = 250, min_chars: int = 12) -> List[str]:
+    """Break ``text`` into sentences, splitting any longer than ``max_chars`` at clauses.
+
+    Fragments under ``min_chars`` are joined to the next segment so the model
+    is not asked to voice "Yes." and "Dr." on their own.
+    """
+    text = " ".join(text.split())
+    pieces: List[str] = []
+    for sentence in SENTENCE_END.split(text):
+        if pieces and (len(pieces[-1]) < min_chars or pieces[-1].lower().endswith(ABBREVIATIONS)):
+            sentence = pieces.pop() + " " + sentence
+        pieces.append(sentence)
+
+    segments: List[str] = []
+    for sentence in pieces:
+        segments.extend(_split_long(sentence, max_chars) if len(sentence) > max_chars else [sentence])
+    return [s for s in segments if s.strip()]
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Pack clauses greedily up to ``max_chars``; a clause longer than that splits at a space"""
+    parts: List[str] = []
+    current = ""
+    for clause in CLAUSE_END.split(sentence):
+        while len(clause) > max_chars:
+            cut = clause.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(clause[:cut])
+            clause = clause[cut:].lstrip()
+        if current and len(current) + 1 + len(clause) > max_chars:
+            parts.append(current)
+            current = clause
+        else:
+            current = f"{current} {clause}" if current else clause
+    if current:
+        parts.append(current)
+    return parts
+
+
+def wav_header(sample_rate: int, channels: int = 1, data_size: int = STREAMING_SIZE) -> bytes:
+    """16-bit PCM WAV header; the default sizes mark a stream of unknown length"""
+    block_align = channels * 2
+    riff_size = STREAMING_SIZE if data_size == STREAMING_SIZE else 36 + data_size
+    return (
+        b"RIFF" + struct.pack("<I", riff_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, 16)
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+
+def pcm16(wav: np.ndarray) -> bytes:
+    """Float samples in [-1, 1] as little-endian 16-bit PCM"""
+    return (np.clip(wav, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def numbered_frames(pcm: Union[bytes, memoryview], first_sequence: int, frame_bytes: int) -> Iterator[bytes]:
+    """Split 16-bit PCM into frames, each prefixed with its sequence number"""
+    frame_bytes = max(2, frame_bytes - frame_bytes % 2)
+    for index, offset in enumerate(range(0, len(pcm), frame_bytes)):
+        yield struct.pack(FRAME_HEADER, first_sequence + index) + bytes(pcm[offset:offset + frame_bytes])
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Synthetic audio corpus for the STT load tests
+Generates speech-like and noise clips locally and deterministically, so benchmark runs need no downloads
+
+Usage:
+    python corpus.py --output ./corpus --lengths 2,5,10,30 --per-length 3
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import shutil
+import subprocess
+import sys
+import wave
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+MANIFEST = "manifest.json"
+
+# Sentences in the game's register; espeak renders them, the formant engine only mimics their rhythm
+PHRASES = [
+    "set course for the outer colonies",
+    "open the treasury and show this quarter's budget",
+    "hail the trade federation on a secure channel",
+    "how many ships are docked at the orbital station",
+    "send the science team to survey the northern ice fields",
+    "what is the status of the mining operation",
+    "raise taxes on luxury imports by two percent",
+    "schedule a summit with the joint chiefs tomorrow",
+    "the fleet is ready to jump when you give the order",
+    "reroute power from the shields to the engines",
+    "ask the ambassador whether the treaty still holds",
+    "launch the reconnaissance drones over the border worlds",
+]
+
+# (F1, F2, F3) in Hz for a handful of vowels
+VOWELS = [(730, 1090, 2440), (270, 2290, 3010), (530, 1840, 2480),
+          (300, 870, 2240), (640, 1190, 2390), (490, 1350, 1690)]
+
+# clip kind -> SNR in dB of the added noise (None: no speech, or no noise)
+KINDS = {"speech": None, "speech_noisy": 10.0, "noise": None}
+
+
+def formant_envelope(freqs: np.ndarray, formants, bandwidth: float = 90.0) -> np.ndarray:
+    gain = np.zeros_like(freqs)
+    for i, f in enumerate(formants):
+        gain += (0.6 ** i) / (1.0 + ((freqs - f) / bandwidth) ** 2)
+    return gain
+
+
+def syllable(rng: np.random.Generator, f0: float, seconds: float) -> np.ndarray:
+    """One voiced syllable: harmonics shaped by a vowel's formants, with a rise-fall envelope"""
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    # Gentle pitch drift and vibrato so no two syllables are identical
+    pitch = f0 * (1.0 + rng.uniform(-0.08, 0.08) * t / max(seconds, 1e-3) + 0.01 * np.sin(2 * np.pi * 5.5 * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    harmonics = np.arange(1, int(3800 / f0) + 1)
+    gains = formant_envelope(harmonics * f0, VOWELS[rng.integers(len(VOWELS))])
+    voiced = (gains[:, None] * np.sin(harmonics[:, None] * phase[None, :])).sum(axis=0)
+    envelope = np.sin(np.pi * np.linspace(0, 1, n)) ** 0.6
+    return voiced * envelope
+
+
+def consonant(rng: np.random.Generator, seconds: float) -> np.ndarray:
+    """Short burst of high-passed noise standing in for a fricative or plosive"""
+    n = int(seconds * SAMPLE_RATE)
+    noise = rng.standard_normal(n)
+    noise = np.diff(noise, prepend=0.0)  # first difference tilts the spectrum upwards
+    return 0.15 * noise * np.hanning(n)
+
+
+def formant_speech(rng: np.random.Generator, phrase: str, seconds: float) -> np.ndarray:
+    """Speech-like audio following the phrase's word and syllable rhythm, padded or repeated to ``seconds``"""
+    f0 = rng.choice([110.0, 140.0, 190.0, 220.0])
+    out: List[np.ndarray] = [np.zeros(int(0.2 * SAMPLE_RATE))]
+    total = len(out[0])
+    target = int(seconds * SAMPLE_RATE)
+    words = phrase.split()
+    i = 0
+    while total < target:
+        word = words[i % len(words)]
+        i += 1
+        for _ in range(max(1, sum(c in "aeiouy" for c in word))):
+            if rng.random() < 0.6:
+                out.append(consonant(rng, rng.uniform(0.03, 0.08)))
+            out.append(syllable(rng, f0 * rng.uniform(0.9, 1.1), rng.uniform(0.12, 0.25)))
+        # Word gap, with a longer pause at the end of each sentence
+        out.append(np.zeros(int(SAMPLE_RATE * (0.45 if i % len(words) == 0 else rng.uniform(0.04, 0.12)))))
+        total = sum(len(x) for x in out)
+    audio = np.concatenate(out)[:target]
+    return audio / (np.abs(audio).max() + 1e-9) * 0.5
+
+
+def espeak_binary() -> Optional[str]:
+    return shutil.which("espeak-ng") or shutil.which("espeak")
+
+
+def espeak_speech(binary: str, text: str, seconds: float, voice: str) -> Optional[np.ndarray]:
+    """Render ``text`` with a locally installed espeak, resampled to 16 kHz; None if it fails"""
+    try:
+        wav = subprocess.run([binary, "-v", voice, "--stdout", text], check=True, capture_output=True).stdout
+        audio, rate = read_wav_bytes(wav)
+    except (subprocess.CalledProcessError, wave.Error, OSError) as e:
+        logger.warning(f"espeak failed, using the formant engine: {e}")
+        return None
+    if rate != SAMPLE_RATE:
+        positions = np.arange(int(len(audio) * SAMPLE_RATE / rate)) * rate / SAMPLE_RATE
+        audio = np.interp(positions, np.arange(len(audio)), audio)
+    target = int(seconds * SAMPLE_RATE)
+    pad = np.zeros(int(0.3 * SAMPLE_RATE))
+    reps = int(np.ceil(target / (len(audio) + len(pad))))
+    return np.concatenate([np.concatenate([audio, pad])] * reps)[:target]
+
+
+def colored_noise(rng: np.random.Generator, n: int) -> np.ndarray:
+    """Pink-ish noise: white noise shaped by 1/sqrt(f) in the frequency domain"""
+    spectrum = np.fft.rfft(rng.standard_normal(n))
+    spectrum /= np.sqrt(np.maximum(np.arange(len(spectrum)), 1))
+    noise = np.fft.irfft(spectrum, n)
+    return noise / (np.abs(noise).max() + 1e-9)
+
+
+def mix_at_snr(speech: np.ndarray, noise: np.ndarray, snr_db: float) -> np.ndarray:
+    speech_power = np.mean(speech ** 2) + 1e-12
+    noise_power = np.mean(noise ** 2) + 1e-12
+    scaled = noise * np.sqrt(speech_power / (noise_power * 10 ** (snr_db / 10)))
+    mixed = speech + scaled
+    return mixed / max(1.0, np.abs(mixed).max() / 0.9)
+
+
+def read_wav_bytes(data: bytes):
+    with wave.open(io.BytesIO(data)) as w:
+        frames = w.readframes(w.getnframes())
+        audio = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768.0
+        if w.getnchannels() > 1:
+            audio = audio.reshape(-1, w.getnchannels()).mean(axis=1)
+        return audio, w.getframerate()
+
+
+def write_wav(path: Path, audio: np.ndarray):
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(pcm.tobytes())
+
+
+def generate(output: str, lengths: List[float], per_length: int, seed: int = 0,
+             engine: str = "auto", voice: str = "en") -> Dict:
+    """Write the clips and a manifest describing them; the same arguments give the same corpus"""
+    root = Path(output)
+    root.mkdir(parents=True, exist_ok=True)
+    binary = espeak_binary() if engine in ("auto", "espeak") else None
+    if engine == "espeak" and not binary:
+        raise SystemExit("espeak-ng is not installed; use --engine formant")
+
+    rng = np.random.default_rng(seed)
+    clips = []
+    for seconds in lengths:
+        for index in range(per_length):
+            for kind, snr in KINDS.items():
+                name = f"{kind}-{seconds:g}s-{index}"
+                phrase = PHRASES[(len(clips) + index) % len(PHRASES)]
+                reference = None
+                used = "noise"
+                if kind == "noise":
+                    audio = 0.3 * colored_noise(rng, int(seconds * SAMPLE_RATE))
+                else:
+                    audio = espeak_speech(binary, phrase, seconds, voice) if binary else None
+                    used = "espeak" if audio is not None else "formant"
+                    if audio is None:
+                        audio = formant_speech(rng, phrase, seconds)
+                    if snr is not None:
+                        audio = mix_at_snr(audio, colored_noise(rng, len(audio)), snr)
+                    # Only espeak says the words; formant clips have no usable reference
+                    if used == "espeak":
+                        reference = phrase
+                path = root / f"{name}.wav"
+                write_wav(path, audio)
+                if reference:
+                    path.with_suffix(".txt").write_text(reference + "\n")
+                clips.append({
+                    "name": path.name,
+                    "kind": kind,
+                    "engine": used,
+                    "seconds": round(len(audio) / SAMPLE_RATE, 3),
+                    "reference": reference,
+                    "sha256": hashlib.sha256(path.read_bytes()).hexdigest(),
+                })
+
+    manifest = {
+        "sample_rate": SAMPLE_RATE,
+        "seed": seed,
+        "lengths": lengths,
+        "per_length": per_length,
+        "clips": clips,
+    }
+    manifest["corpus_id"] = corpus_id(manifest)
+    (root / MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def corpus_id(manifest: Dict) -> str:
+    """Short digest of the clip contents; reports from different corpora are not comparable"""
+    digest = hashlib.sha256("".join(c["sha256"] for c in manifest["clips"]).encode())
+    return digest.hexdigest()[:16]
+
+
+def load(corpus_dir: str) -> Dict:
+    """Read the manifest and attach each clip's WAV bytes and float samples"""
+    root = Path(corpus_dir)
+    manifest_path = root / MANIFEST
+    if not manifest_path.exists():
+        raise SystemExit(f"No {MANIFEST} in {corpus_dir}; generate one with corpus.py")
+    manifest = json.loads(manifest_path.read_text())
+    for clip in manifest["clips"]:
+        clip["wav"] = (root / clip["name"]).read_bytes()
+        clip["audio"], _ = read_wav_bytes(clip["wav"])
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the synthetic STT load-test corpus")
+    parser.add_argument("--output", default="corpus")
+    parser.add_argument("--lengths", default="2,5,10,30", help="Clip lengths in seconds")
+    parser.add_argument("--per-length", type=int, default=3, help="Clips of each kind per length")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=["auto", "espeak", "formant"], default="auto",
+                        help="auto uses a local espeak-ng when installed, else formant synthesis")
+    parser.add_argument("--voice", default="en")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    lengths = [float(x) for x in args.lengths.split(",")]
+    manifest = generate(args.output, lengths, args.per_length, args.seed, args.engine, args.voice)
+    seconds = sum(c["seconds"] for c in manifest["clips"])
+    print(f"Wrote {len(manifest['clips'])} clips ({seconds:.0f} s of audio) to {args.output}, "
+          f"corpus {manifest['corpus_id']}")
+
+
+if __name__ == "__main__":
+    main()
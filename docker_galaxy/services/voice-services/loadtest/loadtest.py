@@ -0,0 +1,566 @@
+#!/usr/bin/env python3
+"""
+Load test and benchmark harness for the STT services
+Drives /transcribe, /transcribe/text and /ws/stream with a local corpus, reports latency, throughput,
+RTF, CPU and RSS, and compares JSON reports against a baseline
+
+Usage:
+    python corpus.py --output ./corpus
+    python loadtest.py run --url http://localhost:8001 --service whisper-stt --corpus ./corpus \\
+        --concurrency 4 --duration 60 --output report.json --baseline baseline.json
+    python loadtest.py run --url http://localhost:8002 --service stt --rate 2 --requests 200
+    python loadtest.py compare report.json baseline.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+import websockets
+
+import corpus as corpus_module
+
+logger = logging.getLogger(__name__)
+
+# What each service exposes, and the multipart field its /transcribe expects
+SERVICES = {
+    "whisper-stt": {"upload_field": "file", "endpoints": ["/transcribe", "/transcribe/text", "/ws/stream"]},
+    "stt": {"upload_field": "audio", "endpoints": ["/transcribe"]},
+}
+
+# (metric path, direction): +1 means higher is worse
+CHECKS = [
+    ("latency_ms.p50", 1),
+    ("latency_ms.p95", 1),
+    ("latency_ms.p99", 1),
+    ("throughput_rps", -1),
+    ("rtf.p50", 1),
+    ("resources.cpu_seconds_per_request", 1),
+    ("resources.rss_mb_max", 1),
+]
+ERROR_RATE_TOLERANCE = 0.01  # absolute, since baselines usually have no errors at all
+
+
+@dataclass
+class Sample:
+    clip: str
+    audio_seconds: float
+    latency: Optional[float]  # seconds; for streams, flush to final transcript
+    status: str  # HTTP status, "ok", "error", "timeout" or "client_overload"
+    server_seconds: Optional[float] = None
+    first_message: Optional[float] = None  # streams only: start of audio to first message
+
+
+@dataclass
+class Phase:
+    endpoint: str
+    samples: List[Sample] = field(default_factory=list)
+    wall_seconds: float = 0.0
+    resources: Dict[str, Any] = field(default_factory=dict)
+
+
+def percentiles(values: List[float], scale: float = 1.0) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    arr = np.asarray(values) * scale
+    return {
+        "p50": round(float(np.percentile(arr, 50)), 3),
+        "p95": round(float(np.percentile(arr, 95)), 3),
+        "p99": round(float(np.percentile(arr, 99)), 3),
+        "mean": round(float(arr.mean()), 3),
+        "max": round(float(arr.max()), 3),
+    }
+
+
+def pcm_offset(wav: bytes) -> int:
+    """Offset of the PCM samples in a WAV file"""
+    index = wav.find(b"data")
+    return index + 8 if index >= 0 else 44
+
+
+def unique_wav(wav: bytes, counter: int) -> bytes:
+    """Stamp the counter into the last four samples at inaudible amplitude.
+
+    Every request then has distinct bytes, so the service's result cache
+    never answers in place of the model.
+    """
+    if len(wav) - pcm_offset(wav) < 8:
+        return wav
+    stamp = struct.pack("<4h", *[(counter >> (4 * i)) & 0xF for i in range(4)])
+    return wav[:-8] + stamp
+
+
+class ResourceSampler:
+    """Samples the server's CPU time and resident memory while a phase runs.
+
+    With ``pid`` it reads /proc for that process and its children (prefork
+    workers included), using PSS when available so copy-on-write weights are
+    not counted once per worker. Otherwise it reads the process_* gauges
+    from the service's /metrics, which cover the main process only.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str, pid: Optional[int], interval: float):
+        self.client = client
+        self.url = url.rstrip("/") + "/metrics"
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[Tuple[float, float, float]] = []  # (time, cpu seconds, memory MB)
+        self.source = f"/proc/{pid}" if pid else "metrics"
+        self._task: Optional[asyncio.Task] = None
+
+    def _proc_tree(self) -> List[int]:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        tree, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            tree.append(pid)
+            stack.extend(children.get(pid, []))
+        return tree
+
+    def _read_proc(self) -> Optional[Tuple[float, float]]:
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = memory = 0.0
+        for pid in self._proc_tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                cpu += (int(fields[11]) + int(fields[12])) / ticks
+                memory += self._memory_kb(pid) / 1024.0
+            except (OSError, IndexError, ValueError):
+                continue
+        return cpu, memory
+
+    @staticmethod
+    def _memory_kb(pid: int) -> float:
+        for path, key in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+            try:
+                with open(path) as f:
+                    for line in f:
+                        if line.startswith(key):
+                            return float(line.split()[1])
+            except OSError:
+                continue
+        return 0.0
+
+    async def _read_metrics(self) -> Optional[Tuple[float, float]]:
+        try:
+            response = await self.client.get(self.url, timeout=5.0)
+        except httpx.HTTPError:
+            return None
+        values = {}
+        for line in response.text.splitlines():
+            if line.startswith(("process_cpu_seconds_total ", "process_resident_memory_bytes ")):
+                name, value = line.split()
+                values[name] = float(value)
+        if len(values) < 2:
+            return None
+        return values["process_cpu_seconds_total"], values["process_resident_memory_bytes"] / 2 ** 20
+
+    async def sample(self):
+        reading = self._read_proc() if self.pid else await self._read_metrics()
+        if reading:
+            self.samples.append((time.perf_counter(),) + reading)
+
+    async def _loop(self):
+        while True:
+            await self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self, requests: int) -> Dict[str, Any]:
+        self._task.cancel()
+        await self.sample()
+        if len(self.samples) < 2:
+            return {"source": self.source, "available": False}
+        times, cpu, memory = (np.asarray(x) for x in zip(*self.samples))
+        rates = np.diff(cpu) / np.maximum(np.diff(times), 1e-6) * 100
+        cpu_seconds = float(cpu[-1] - cpu[0])
+        return {
+            "source": self.source,
+            "available": True,
+            "cpu_seconds": round(cpu_seconds, 3),
+            "cpu_percent_mean": round(cpu_seconds / max(times[-1] - times[0], 1e-6) * 100, 1),
+            "cpu_percent_max": round(float(rates.max()), 1),
+            "cpu_seconds_per_request": round(cpu_seconds / requests, 4) if requests else None,
+            "rss_mb_max": round(float(memory.max()), 1),
+            "rss_mb_mean": round(float(memory.mean()), 1),
+        }
+
+
+class LoadTest:
+    def __init__(self, args, manifest: Dict):
+        self.args = args
+        self.base_url = args.url.rstrip("/")
+        self.service = SERVICES[args.service]
+        self.clips = [c for c in manifest["clips"]
+                      if c["kind"] in args.kinds and (args.max_seconds is None or c["seconds"] <= args.max_seconds)]
+        if not self.clips:
+            raise SystemExit("No clips left after --kinds/--max-seconds filtering")
+        self.params = dict(p.split("=", 1) for p in args.param)
+        self.rng = random.Random(args.seed)
+        self.counter = 0
+
+    def next_clip(self) -> Dict:
+        return self.rng.choice(self.clips)
+
+    def next_wav(self, clip: Dict) -> bytes:
+        self.counter += 1
+        return clip["wav"] if self.args.allow_cache else unique_wav(clip["wav"], self.counter)
+
+    async def post_upload(self, client: httpx.AsyncClient, clip: Dict) -> Sample:
+        files = {self.service["upload_field"]: (clip["name"], self.next_wav(clip), "audio/wav")}
+        start = time.perf_counter()
+        response = await client.post(f"{self.base_url}/transcribe", files=files, params=self.params)
+        return self.http_sample(clip, response, time.perf_counter() - start)
+
+    async def post_text(self, client: httpx.AsyncClient, clip: Dict) -> Sample:
+        body = {"audio_data": base64.b64encode(self.next_wav(clip)).decode("ascii"), **self.params}
+        start = time.perf_counter()
+        response = await client.post(f"{self.base_url}/transcribe/text", json=body)
+        return self.http_sample(clip, response, time.perf_counter() - start)
+
+    @staticmethod
+    def http_sample(clip: Dict, response: httpx.Response, latency: float) -> Sample:
+        server_seconds = None
+        if response.status_code == 200:
+            try:
+                server_seconds = response.json().get("processing_time")
+            except ValueError:
+                pass
+        return Sample(clip["name"], clip["seconds"], latency, str(response.status_code), server_seconds)
+
+    async def stream(self, client: httpx.AsyncClient, clip: Dict) -> Sample:
+        """Send the clip as paced 16 kHz int16 chunks, flush, and time the final transcript"""
+        url = self.base_url.replace("http", "ws", 1) + "/ws/stream"
+        if self.params:
+            url += "?" + "&".join(f"{k}={v}" for k, v in self.params.items())
+        pcm = clip["wav"][pcm_offset(clip["wav"]):]
+        chunk = int(corpus_module.SAMPLE_RATE * self.args.ws_chunk_ms / 1000) * 2
+        received: List[Tuple[float, Dict]] = []
+        errors: List[str] = []
+
+        async with websockets.connect(url, max_size=None) as ws:
+            async def reader():
+                async for message in ws:
+                    data = json.loads(message)
+                    received.append((time.perf_counter(), data))
+                    if "error" in data:
+                        errors.append(data["error"])
+
+            reading = asyncio.create_task(reader())
+            start = time.perf_counter()
+            for i, offset in enumerate(range(0, len(pcm), chunk)):
+                await ws.send(pcm[offset:offset + chunk])
+                if self.args.ws_speed > 0:
+                    # Pace against the clock so slow sends do not stretch the stream
+                    due = start + (i + 1) * self.args.ws_chunk_ms / 1000 / self.args.ws_speed
+                    await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            flushed = time.perf_counter()
+            await ws.send(json.dumps({"type": "flush"}))
+            # The service sends nothing when the window held no words, so there
+            # is no end marker: stop once it has answered the flush and gone
+            # quiet, or after --ws-final-timeout without an answer
+            while True:
+                seen = len(received)
+                await asyncio.sleep(self.args.ws_idle)
+                answered = any(t >= flushed for t, _ in received)
+                if len(received) == seen and (answered or time.perf_counter() - flushed > self.args.ws_final_timeout):
+                    break
+            reading.cancel()
+
+        after_flush = [t for t, data in received if t >= flushed and "error" not in data]
+        return Sample(
+            clip["name"],
+            clip["seconds"],
+            after_flush[-1] - flushed if after_flush else None,
+            "error" if errors else "ok",
+            first_message=received[0][0] - start if received else None
+        )
+
+    async def request(self, client: httpx.AsyncClient, endpoint: str) -> Sample:
+        clip = self.next_clip()
+        call = {"/transcribe": self.post_upload, "/transcribe/text": self.post_text, "/ws/stream": self.stream}[endpoint]
+        try:
+            return await asyncio.wait_for(call(client, clip), self.args.timeout)
+        except asyncio.TimeoutError:
+            return Sample(clip["name"], clip["seconds"], None, "timeout")
+        except (httpx.HTTPError, websockets.WebSocketException, OSError) as e:
+            logger.warning(f"{endpoint} request failed: {e}")
+            return Sample(clip["name"], clip["seconds"], None, "error")
+
+    async def closed_loop(self, client: httpx.AsyncClient, endpoint: str, phase: Phase, deadline: float, budget: List[int]):
+        """Each worker sends its next request as soon as the previous one finishes"""
+        async def worker():
+            while time.perf_counter() < deadline and budget[0] > 0:
+                budget[0] -= 1
+                phase.samples.append(await self.request(client, endpoint))
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, client: httpx.AsyncClient, endpoint: str, phase: Phase, deadline: float, budget: List[int]):
+        """Poisson arrivals at --rate; latency counts from the scheduled send time, so a
+        stalled server is not hidden by the client slowing down with it"""
+        outstanding = set()
+        arrivals = random.Random(self.args.seed)
+        due = time.perf_counter()
+
+        async def timed(scheduled: float):
+            sample = await self.request(client, endpoint)
+            if sample.latency is not None and endpoint != "/ws/stream":
+                sample.latency = time.perf_counter() - scheduled
+            phase.samples.append(sample)
+
+        while due < deadline and budget[0] > 0:
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            budget[0] -= 1
+            if len(outstanding) >= self.args.max_outstanding:
+                clip = self.next_clip()
+                phase.samples.append(Sample(clip["name"], clip["seconds"], None, "client_overload"))
+            else:
+                task = asyncio.create_task(timed(due))
+                outstanding.add(task)
+                task.add_done_callback(outstanding.discard)
+            due += arrivals.expovariate(self.args.rate)
+        if outstanding:
+            await asyncio.gather(*outstanding)
+
+    async def run_phase(self, client: httpx.AsyncClient, endpoint: str) -> Phase:
+        for _ in range(self.args.warmup):
+            await self.request(client, endpoint)
+
+        phase = Phase(endpoint)
+        sampler = ResourceSampler(client, self.base_url, self.args.pid, self.args.sample_interval)
+        sampler.start()
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        budget = [self.args.requests or sys.maxsize]
+        if self.args.rate:
+            await self.open_loop(client, endpoint, phase, deadline, budget)
+        else:
+            await self.closed_loop(client, endpoint, phase, deadline, budget)
+        phase.wall_seconds = time.perf_counter() - start
+        phase.resources = await sampler.stop(len(phase.samples))
+        return phase
+
+    async def run(self) -> List[Phase]:
+        endpoints = self.args.endpoints or self.service["endpoints"]
+        unsupported = set(endpoints) - set(self.service["endpoints"])
+        if unsupported:
+            raise SystemExit(f"{self.args.service} does not serve {sorted(unsupported)}")
+        limits = httpx.Limits(max_connections=max(self.args.concurrency, self.args.max_outstanding))
+        async with httpx.AsyncClient(timeout=self.args.timeout, limits=limits) as client:
+            phases = []
+            for endpoint in endpoints:
+                logger.info(f"Running {endpoint}")
+                phases.append(await self.run_phase(client, endpoint))
+            return phases
+
+
+def summarize(phase: Phase) -> Dict[str, Any]:
+    ok = [s for s in phase.samples if s.status in ("200", "ok") and s.latency is not None]
+    statuses: Dict[str, int] = {}
+    for s in phase.samples:
+        statuses[s.status] = statuses.get(s.status, 0) + 1
+    errors = sum(1 for s in phase.samples if s.status not in ("200", "ok"))
+    audio_seconds = sum(s.audio_seconds for s in ok)
+    summary = {
+        "requests": len(phase.samples),
+        "completed": len(ok),
+        "statuses": statuses,
+        "error_rate": round(errors / len(phase.samples), 4) if phase.samples else 0.0,
+        "wall_seconds": round(phase.wall_seconds, 3),
+        "throughput_rps": round(len(ok) / phase.wall_seconds, 3) if phase.wall_seconds else 0.0,
+        "audio_seconds": round(audio_seconds, 3),
+        "audio_seconds_per_second": round(audio_seconds / phase.wall_seconds, 3) if phase.wall_seconds else 0.0,
+        "latency_ms": percentiles([s.latency for s in ok], 1000),
+        "resources": phase.resources,
+    }
+    if phase.endpoint == "/ws/stream":
+        # Flush-to-final latency; RTF does not apply to audio sent in real time
+        summary["first_message_ms"] = percentiles([s.first_message for s in ok if s.first_message is not None], 1000)
+        summary["no_final"] = sum(1 for s in phase.samples if s.status == "ok" and s.latency is None)
+    else:
+        # Same convention as quantize.py: seconds of compute per second of audio
+        summary["rtf"] = percentiles([s.latency / s.audio_seconds for s in ok if s.audio_seconds])
+        summary["server_ms"] = percentiles([s.server_seconds for s in ok if s.server_seconds is not None], 1000)
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True,
+                              capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+async def fetch_health(url: str) -> Optional[Dict]:
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            return (await client.get(url.rstrip("/") + "/health")).json()
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+def lookup(report: Dict, path: str):
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict) or value.get(key) is None:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[Dict[str, Any]]:
+    """Per endpoint and metric, the relative change and whether it exceeds ``tolerance``"""
+    if report["meta"].get("corpus_id") != baseline["meta"].get("corpus_id"):
+        logger.warning("Reports were made with different corpora; the comparison is only indicative")
+    load = ("concurrency", "rate", "kinds", "max_seconds", "param")
+    if any(report["meta"]["config"].get(k) != baseline["meta"]["config"].get(k) for k in load):
+        logger.warning("Reports were made under different load settings; throughput is not comparable")
+    rows = []
+    for endpoint, current in report["endpoints"].items():
+        before = baseline["endpoints"].get(endpoint)
+        if not before:
+            continue
+        for path, direction in CHECKS:
+            new, old = lookup(current, path), lookup(before, path)
+            if new is None or not old:
+                continue
+            change = (new - old) / old
+            rows.append({"endpoint": endpoint, "metric": path, "baseline": old, "current": new,
+                         "change": round(change, 4), "regression": change * direction > tolerance})
+        new, old = current["error_rate"], before["error_rate"]
+        rows.append({"endpoint": endpoint, "metric": "error_rate", "baseline": old, "current": new,
+                     "change": round(new - old, 4), "regression": new - old > ERROR_RATE_TOLERANCE})
+    return rows
+
+
+def print_report(report: Dict):
+    header = f"{'endpoint':<18}{'reqs':>6}{'err%':>7}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'RTF':>7}{'CPU%':>7}{'RSS MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, s in report["endpoints"].items():
+        lat = s["latency_ms"] or {}
+        rtf = lookup(s, "rtf.p50")
+        res = s["resources"]
+        print(f"{endpoint:<18}{s['requests']:>6}{s['error_rate'] * 100:>7.1f}{s['throughput_rps']:>8.2f}"
+              f"{lat.get('p50', 0):>9.0f}{lat.get('p95', 0):>9.0f}{lat.get('p99', 0):>9.0f}"
+              f"{rtf if rtf is not None else '-':>7}{res.get('cpu_percent_mean', '-'):>7}{res.get('rss_mb_max', '-'):>8}")
+
+
+def print_comparison(rows: List[Dict[str, Any]]):
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"{row['endpoint']:<18}{row['metric']:<36}{row['baseline']:>10}{row['current']:>10}"
+              f"{row['change'] * 100:>+8.1f}%  {flag}")
+
+
+def run(args) -> Dict:
+    manifest = corpus_module.load(args.corpus)
+    test = LoadTest(args, manifest)
+    phases = asyncio.run(test.run())
+    report = {
+        "meta": {
+            "service": args.service,
+            "url": args.url,
+            "corpus_id": manifest["corpus_id"],
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "client_host": platform.node(),
+            "client_cpus": os.cpu_count(),
+            "server": asyncio.run(fetch_health(args.url)),
+            "config": {k: v for k, v in vars(args).items() if k not in ("command", "func")},
+        },
+        "endpoints": {phase.endpoint: summarize(phase) for phase in phases},
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="STT load tests and benchmark comparison")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Drive a service and write a JSON report")
+    run_parser.add_argument("--url", default="http://localhost:8001")
+    run_parser.add_argument("--service", choices=sorted(SERVICES), default="whisper-stt")
+    run_parser.add_argument("--corpus", default="corpus", help="Directory written by corpus.py")
+    run_parser.add_argument("--endpoints", type=lambda s: s.split(","), default=None,
+                            help="Comma-separated; defaults to everything the service serves")
+    run_parser.add_argument("--kinds", type=lambda s: s.split(","), default=list(corpus_module.KINDS))
+    run_parser.add_argument("--max-seconds", type=float, default=None, help="Skip longer clips")
+    run_parser.add_argument("--concurrency", type=int, default=4, help="Closed-loop workers")
+    run_parser.add_argument("--rate", type=float, default=None, help="Open-loop arrivals per second instead")
+    run_parser.add_argument("--max-outstanding", type=int, default=64, help="Open-loop cap on requests in flight")
+    run_parser.add_argument("--duration", type=float, default=60.0, help="Seconds per endpoint")
+    run_parser.add_argument("--requests", type=int, default=None, help="Stop each endpoint after this many")
+    run_parser.add_argument("--warmup", type=int, default=2, help="Unrecorded requests before each endpoint")
+    run_parser.add_argument("--timeout", type=float, default=120.0)
+    run_parser.add_argument("--param", action="append", default=[], help="key=value sent with every request")
+    run_parser.add_argument("--allow-cache", action="store_true", help="Send identical bytes for repeated clips")
+    run_parser.add_argument("--ws-chunk-ms", type=int, default=100)
+    run_parser.add_argument("--ws-speed", type=float, default=1.0, help="1 is real time, 0 as fast as possible")
+    run_parser.add_argument("--ws-idle", type=float, default=1.0, help="Quiet seconds that end a stream")
+    run_parser.add_argument("--ws-final-timeout", type=float, default=10.0,
+                            help="Give up waiting for a final transcript after this long")
+    run_parser.add_argument("--pid", type=int, default=None, help="Server PID to sample; else its /metrics")
+    run_parser.add_argument("--sample-interval", type=float, default=0.5)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", default="loadtest-report.json")
+    run_parser.add_argument("--baseline", help="Report to compare against")
+    run_parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown")
+
+    cmp_parser = sub.add_parser("compare", help="Compare a report against a baseline")
+    cmp_parser.add_argument("report")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("--tolerance", type=float, default=0.10)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.command == "run":
+        report = run(args)
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print_report(report)
+        baseline_path = args.baseline
+    else:
+        report = json.loads(Path(args.report).read_text())
+        baseline_path = args.baseline
+
+    if baseline_path:
+        rows = compare(report, json.loads(Path(baseline_path).read_text()), args.tolerance)
+        print()
+        print_comparison(rows)
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
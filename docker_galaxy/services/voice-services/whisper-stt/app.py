@@ -5,22 +5,38 @@ Provides speech-to-text transcription using OpenAI Whisper
 """
 
 import os
-import io
 import json
 import asyncio
 import logging
-from typing import Optional, Dict, Any
+import tempfile
+from typing import Optional, Dict, Any, Tuple
 from pathlib import Path
 
 import whisper
 import torch
 import numpy as np
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, File, UploadFile, HTTPException, Query, Request, Header
 from pydantic import BaseModel
 import uvicorn
 import redis.asyncio as redis
 
+from cache import TranscriptionCache, cache_key
+from grammar import CommandGrammar
+from responses import ProjectionError, json_response, project
+from scheduler import BULK, INTERACTIVE, SHORT, PriorityClass, PriorityScheduler
+from streaming import StreamingTranscriber, words_confidence, words_text
+from vad import VoiceActivityDetector
+
+from voice_common.audio import PCM_CONTENT_TYPES, PCM_FORMATS, WAV_CONTENT_TYPES, AudioFormatError, decode_audio, parse_content_type
+from voice_common.inference import InferenceExecutor, InferenceQueueFull, ModelReplicas, cpu_limit
+from voice_common.metrics import ServiceMetrics, instrument
+from voice_common.prefork import PreforkPool
+from voice_common.quantize import load_whisper
+from voice_common.readiness import Readiness, install_probes
+from voice_common.registry import ModelRegistry, UnknownModel, model_memory_bytes
+from voice_common.shortcontext import audio_context, embed_audio, log_mel, transcribe_short
+from voice_common.singleflight import SingleFlight
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,25 +46,160 @@ MODEL_SIZE = os.getenv("MODEL_SIZE", "base")
 DEVICE = os.getenv("DEVICE", "cpu")
 LANGUAGE = os.getenv("LANGUAGE", "en")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+MODELS_DIR = os.getenv("MODELS_DIR", "/app/models")
+# "int8" applies dynamic quantization to the Linear layers (CPU only)
+WHISPER_QUANTIZE = os.getenv("WHISPER_QUANTIZE", "none").lower()
+QUANTIZED = WHISPER_QUANTIZE == "int8" and DEVICE == "cpu"
+MODEL_VARIANT = f"{MODEL_SIZE}-int8" if QUANTIZED else MODEL_SIZE
+
+# Checkpoints come from the MODELS_DIR volume (populate it with
+# python -m voice_common.modelstore prepare) and are checksummed before loading; downloading a missing one is a
+# development fallback. Loading runs in the background behind /readyz.
+MODEL_ALLOW_DOWNLOAD = os.getenv("MODEL_ALLOW_DOWNLOAD", "true").lower() == "true"
+MODEL_VERIFY = os.getenv("MODEL_VERIFY", "true").lower() == "true"
+# Transcribe a second of silence before reporting ready
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+
+# Other sizes load on first request and are evicted least-recently-used to
+# stay within the budget; MODEL_SIZE is loaded at startup and never evicted.
+# Every thread worker's replica counts against the budget. Prefork mode only
+# offers MODEL_SIZE: the workers share the copy loaded before forking, and any
+# other size would be loaded again inside each of them. A size that cannot fit
+# beside MODEL_SIZE is refused with 400 (fp32 medium needs about 3 GB).
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "3072"))
+AVAILABLE_MODELS = [m.strip() for m in os.getenv("AVAILABLE_MODELS", "tiny,base,small").split(",") if m.strip()]
+
+# Inference pool. "thread": workers share a process and each extra worker
+# holds its own model replica. "prefork": workers are processes forked after
+# the model loads, sharing its weights copy-on-write.
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "8"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "2"))
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(max(1, cpu_limit() // max(1, INFERENCE_WORKERS)))))
+
+# Priority classes: stream windows ("interactive"), uploads up to
+# PRIORITY_SHORT_MAX_SECONDS ("short") and longer uploads ("bulk") share the
+# workers by weight, each capped in running and waiting calls. While stream
+# windows wait longer than INTERACTIVE_SLO_MS, bulk calls are held back and new
+# ones get 503. With it on, the per-class queues replace INFERENCE_MAX_QUEUE.
+PRIORITY_ENABLED = os.getenv("PRIORITY_ENABLED", "true").lower() == "true"
+PRIORITY_SHORT_MAX_SECONDS = float(os.getenv("PRIORITY_SHORT_MAX_SECONDS", "30"))
+PRIORITY_CLASSES = {
+    INTERACTIVE: PriorityClass(
+        weight=float(os.getenv("PRIORITY_INTERACTIVE_WEIGHT", "8")),
+        max_running=int(os.getenv("PRIORITY_INTERACTIVE_MAX_RUNNING", str(INFERENCE_WORKERS))),
+        max_queue=int(os.getenv("PRIORITY_INTERACTIVE_MAX_QUEUE", "16"))
+    ),
+    SHORT: PriorityClass(
+        weight=float(os.getenv("PRIORITY_SHORT_WEIGHT", "3")),
+        max_running=int(os.getenv("PRIORITY_SHORT_MAX_RUNNING", str(INFERENCE_WORKERS))),
+        max_queue=int(os.getenv("PRIORITY_SHORT_MAX_QUEUE", str(INFERENCE_MAX_QUEUE)))
+    ),
+    BULK: PriorityClass(
+        weight=float(os.getenv("PRIORITY_BULK_WEIGHT", "1")),
+        # Leave a worker free for the other classes when there is more than one
+        max_running=int(os.getenv("PRIORITY_BULK_MAX_RUNNING", str(max(1, INFERENCE_WORKERS - 1)))),
+        max_queue=int(os.getenv("PRIORITY_BULK_MAX_QUEUE", "4"))
+    ),
+}
+INTERACTIVE_SLO_MS = float(os.getenv("INTERACTIVE_SLO_MS", "250"))
+INTERACTIVE_SLO_WINDOW_SECONDS = float(os.getenv("INTERACTIVE_SLO_WINDOW_SECONDS", "10"))
+
+# Opt-in fast path: encode clips up to SHORT_CONTEXT_MAX_SECONDS on a context
+# sized to the clip rather than 30 s, falling back to the full context when the
+# result's average log-probability drops below SHORT_CONTEXT_MIN_LOGPROB
+SHORT_CONTEXT_ENABLED = os.getenv("SHORT_CONTEXT_ENABLED", "false").lower() == "true"
+SHORT_CONTEXT_MAX_SECONDS = float(os.getenv("SHORT_CONTEXT_MAX_SECONDS", "8"))
+SHORT_CONTEXT_MARGIN_SECONDS = float(os.getenv("SHORT_CONTEXT_MARGIN_SECONDS", "1.0"))
+SHORT_CONTEXT_MIN_LOGPROB = float(os.getenv("SHORT_CONTEXT_MIN_LOGPROB", "-0.7"))
+
+# Command mode (mode=command): short utterances are decoded against a grammar
+# compiled from the content packs and return the matched command id
+CONTENT_PACKS_DIR = os.getenv("CONTENT_PACKS_DIR", "/app/content/packs")
+COMMAND_MAX_SECONDS = float(os.getenv("COMMAND_MAX_SECONDS", "6"))
+COMMAND_MIN_SCORE = float(os.getenv("COMMAND_MIN_SCORE", "-0.5"))
+
+# Drop silence and room noise before it reaches the model
+VAD_ENABLED = os.getenv("VAD_ENABLED", "true").lower() == "true"
+
+# Result cache keyed by audio hash; memory tier sits in front of Redis
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_MEMORY_ITEMS = int(os.getenv("CACHE_MEMORY_ITEMS", "512"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))
+
+# Identical requests already being transcribed share the running result
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+
+# Raw uploads (/transcribe/raw) are read straight into one preallocated buffer
+RAW_MAX_BYTES = int(os.getenv("RAW_MAX_BYTES", str(50 << 20)))
+RAW_CONTENT_TYPES = {"application/octet-stream"} | PCM_CONTENT_TYPES | WAV_CONTENT_TYPES
+
+# Streaming: re-transcribe a rolling window every step and commit agreed words
+STREAM_WINDOW_SECONDS = float(os.getenv("STREAM_WINDOW_SECONDS", "15"))
+STREAM_STEP_SECONDS = float(os.getenv("STREAM_STEP_SECONDS", "1.0"))
+STREAM_OVERLAP_SECONDS = float(os.getenv("STREAM_OVERLAP_SECONDS", "1.0"))
+STREAM_PROMPT_CHARS = int(os.getenv("STREAM_PROMPT_CHARS", "200"))
 
 # Initialize FastAPI app
 app = FastAPI(title="Whisper STT Service", version="1.0.0")
 
 # Global variables
 whisper_model = None
+model_registry = ModelRegistry(
+    loader=lambda size: ModelReplicas(
+        load_whisper(size, DEVICE, QUANTIZED, MODELS_DIR, MODEL_VERIFY, MODEL_ALLOW_DOWNLOAD)
+    ),
+    memory_of=lambda replicas: model_memory_bytes(replicas.model) * replicas.count,
+    budget_bytes=MODEL_MEMORY_BUDGET_MB << 20,
+    available=[MODEL_SIZE] if INFERENCE_MODE == "prefork" else sorted(set(AVAILABLE_MODELS) | {MODEL_SIZE}),
+    quantized=QUANTIZED
+)
 redis_client = None
+inference_executor = InferenceExecutor(INFERENCE_WORKERS, INFERENCE_MAX_QUEUE, INFERENCE_RETRY_AFTER, "whisper-inference")
+scheduler = PriorityScheduler(
+    inference_executor,
+    PRIORITY_CLASSES,
+    interactive_slo=INTERACTIVE_SLO_MS / 1000,
+    slo_window=INTERACTIVE_SLO_WINDOW_SECONDS
+) if PRIORITY_ENABLED else None
+vad = VoiceActivityDetector() if VAD_ENABLED else None
+transcription_cache = TranscriptionCache(CACHE_MEMORY_ITEMS, CACHE_TTL_SECONDS) if CACHE_ENABLED else None
+in_flight = SingleFlight() if COALESCE_ENABLED else None
+command_grammar = None
+readiness = Readiness()
+install_probes(app, readiness)
+metrics = ServiceMetrics("whisper-stt", optional=("coalescing",))
+instrument(app, metrics)
+
+@metrics.on_scrape
+def refresh_gauges(m: ServiceMetrics):
+    stats = inference_executor.stats()
+    m.set_queue(stats["running"], stats["queued"] + (scheduler.queued if scheduler else 0))
+    m.set_model_memory({
+        r["model"]: r["memory_mb"] * 2**20 for r in model_registry.stats()["resident_models"]
+    })
 
 class TranscriptionRequest(BaseModel):
     audio_data: str  # Base64 encoded audio
     language: Optional[str] = "en"
+    sample_rate: Optional[int] = None  # Set for headerless int16 PCM
+    model: Optional[str] = None  # Whisper size, defaults to MODEL_SIZE
+    mode: Optional[str] = None  # "command" to match against the game-command grammar
     task: str = "transcribe"  # or "translate"
+    detail: Optional[str] = None  # "text", "segments" or "full" (default)
+    fields: Optional[str] = None  # Comma-separated top-level fields to return
 
 class TranscriptionResponse(BaseModel):
+    """Documents the detail=full body; responses are encoded by responses.project"""
     text: str
     language: str
-    confidence: float
-    segments: list
+    confidence: Optional[float] = None
+    segments: Optional[list] = None  # Omitted for detail=text
     processing_time: float
+    model: Optional[str] = None
+    command: Optional[Dict[str, Any]] = None  # Set in command mode when a command matched
+    cache: Optional[str] = None  # "memory", "redis", "coalesced" or "miss"
 
 class StreamingMessage(BaseModel):
     type: str  # "partial" or "final"
@@ -59,12 +210,57 @@ class StreamingMessage(BaseModel):
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize services on startup"""
-    global whisper_model, redis_client
+    """Start loading in the background; /livez answers at once, /readyz once loaded"""
+    # Keep parallel workers from oversubscribing the CPU limit. A prefork
+    # parent stays on one thread so torch never starts the OpenMP pool that
+    # would hang its forked workers; each worker sets its own count.
+    torch.set_num_threads(1 if INFERENCE_MODE == "prefork" else TORCH_THREADS)
+    readiness.start(load_service())
+
+def warm_up(model):
+    """Run the model once so the first request does not pay for lazy setup"""
+    model.transcribe(np.zeros(whisper.audio.SAMPLE_RATE, dtype=np.float32), language=LANGUAGE, fp16=False)
+
+def init_worker():
+    """Set up a forked worker: its thread count, then warm-up"""
+    torch.set_num_threads(TORCH_THREADS)
+    if MODEL_WARMUP:
+        warm_up(whisper_model)
+
+async def load_service():
+    """Load the model and everything that depends on it, in startup order"""
+    global whisper_model, redis_client, inference_executor, command_grammar
     
-    logger.info(f"Loading Whisper model: {MODEL_SIZE}")
-    whisper_model = whisper.load_model(MODEL_SIZE, device=DEVICE)
-    logger.info(f"Whisper model loaded on device: {DEVICE}")
+    with readiness.step("loading_model"):
+        logger.info(f"Loading Whisper model: {MODEL_VARIANT}")
+        whisper_model = (await asyncio.to_thread(model_registry.acquire, MODEL_SIZE, pin=True)).model
+        logger.info(f"Whisper model loaded on device: {DEVICE}")
+    
+    if Path(CONTENT_PACKS_DIR).is_dir():
+        with readiness.step("compiling_grammar"):
+            command_grammar = CommandGrammar.from_packs(CONTENT_PACKS_DIR)
+            logger.info(f"Compiled {len(command_grammar)} command phrases from {CONTENT_PACKS_DIR}")
+    else:
+        logger.warning(f"Content packs not found at {CONTENT_PACKS_DIR}, command mode disabled")
+    
+    if INFERENCE_MODE == "prefork":
+        # Fork before the parent runs the model or opens any other connection;
+        # each worker warms itself up
+        with readiness.step("forking_workers"):
+            inference_executor.shutdown()
+            inference_executor = PreforkPool(
+                INFERENCE_WORKERS,
+                INFERENCE_MAX_QUEUE,
+                INFERENCE_RETRY_AFTER,
+                full_error=InferenceQueueFull,
+                initializer=init_worker
+            )
+            await asyncio.to_thread(inference_executor.start)
+            if scheduler:
+                scheduler.executor = inference_executor
+    elif MODEL_WARMUP:
+        with readiness.step("warming_up"):
+            await asyncio.to_thread(warm_up, whisper_model)
     
     # Initialize Redis connection
     try:
@@ -74,11 +270,16 @@ async def startup_event():
     except Exception as e:
         logger.warning(f"Redis connection failed: {e}")
         redis_client = None
+    
+    if transcription_cache:
+        transcription_cache.redis = redis_client
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     global redis_client
+    await readiness.cancel()
+    inference_executor.shutdown()
     if redis_client:
         await redis_client.close()
 
@@ -86,27 +287,233 @@ async def shutdown_event():
 async def health_check():
     """Health check endpoint"""
     return {
-        "status": "healthy",
-        "model": MODEL_SIZE,
+        "status": "healthy" if readiness.ready else readiness.state,
+        "readiness": readiness.stats(),
+        "model": MODEL_VARIANT,
         "device": DEVICE,
         "language": LANGUAGE,
-        "redis_connected": redis_client is not None
+        "redis_connected": redis_client is not None,
+        "inference": inference_executor.stats(),
+        "scheduler": scheduler.stats() if scheduler else None,
+        "vad": vad.stats() if vad else None,
+        "cache": transcription_cache.stats() if transcription_cache else None,
+        "coalescing": in_flight.stats() if in_flight else None,
+        "command_phrases": len(command_grammar) if command_grammar else 0
     }
 
 @app.get("/models")
 async def get_models():
-    """Get available models"""
+    """Get available models and the ones currently resident"""
     return {
         "current_model": MODEL_SIZE,
-        "available_models": ["tiny", "base", "small", "medium", "large"],
-        "device": DEVICE
+        "available_models": model_registry.available,
+        "device": DEVICE,
+        "quantized": QUANTIZED,
+        **model_registry.stats()
     }
 
+def resolve_model(name: Optional[str]) -> str:
+    """Validate a requested model size, defaulting to MODEL_SIZE"""
+    try:
+        return model_registry.validate(name, MODEL_SIZE)
+    except UnknownModel as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def resolve_mode(mode: Optional[str]) -> bool:
+    """True for command mode; rejects unknown modes"""
+    if mode in (None, "", "transcribe"):
+        return False
+    if mode != "command":
+        raise HTTPException(status_code=400, detail=f"Unknown mode '{mode}', use 'transcribe' or 'command'")
+    if not command_grammar:
+        raise HTTPException(status_code=503, detail="Command grammar not loaded")
+    return True
+
+def model_variant(size: str) -> str:
+    return f"{size}-int8" if QUANTIZED else size
+
+def match_command(model, audio, language: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Decode a short utterance against the command grammar; None below COMMAND_MIN_SCORE"""
+    if SHORT_CONTEXT_ENABLED:
+        n_ctx = audio_context(len(audio), SHORT_CONTEXT_MARGIN_SECONDS, model.dims.n_audio_ctx)
+        features = embed_audio(model, log_mel(model, audio, n_ctx).unsqueeze(0))
+    else:
+        with torch.no_grad():
+            mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=model.dims.n_mels, device=model.device)
+            features = model.embed_audio(mel.unsqueeze(0))
+    
+    match = command_grammar.match(model, features, language or LANGUAGE)
+    if match is None or match.score < COMMAND_MIN_SCORE:
+        return None
+    return {
+        "text": match.phrase,
+        "language": language or LANGUAGE,
+        "segments": [{"start": 0.0, "end": len(audio) / whisper.audio.SAMPLE_RATE, "text": match.phrase}],
+        "command": {"id": match.id, "score": match.score, "decode_steps": match.steps, "source": "grammar"}
+    }
+
+def run_transcription(model_size: str, audio, short_context: bool = False, command: bool = False,
+                      **options) -> Dict[str, Any]:
+    """Transcribe on the calling worker's model replica (thread or forked process)"""
+    # A size seen for the first time is loaded here, on the worker
+    model = model_registry.acquire(model_size).get()
+    if command and len(audio) <= COMMAND_MAX_SECONDS * whisper.audio.SAMPLE_RATE:
+        result = match_command(model, audio, options.get("language"))
+        if result is not None:
+            return result
+    
+    result = transcribe_audio_array(model, audio, short_context, **options)
+    if command:
+        # No confident grammar match: the free transcription may still be a command
+        matched = command_grammar.lookup(result["text"])
+        result["command"] = {"id": matched.id, "source": "text"} if matched else None
+    return result
+
+def transcribe_audio_array(model, audio, short_context: bool, **options) -> Dict[str, Any]:
+    """Reduced-context fast path for short clips when enabled, full transcribe otherwise"""
+    if short_context and len(audio) <= SHORT_CONTEXT_MAX_SECONDS * whisper.audio.SAMPLE_RATE:
+        result = transcribe_short(
+            model,
+            audio,
+            language=options.get("language"),
+            task=options.get("task", "transcribe"),
+            margin_seconds=SHORT_CONTEXT_MARGIN_SECONDS,
+            min_logprob=SHORT_CONTEXT_MIN_LOGPROB
+        )
+        if result is not None:
+            return result
+    return model.transcribe(audio, **options)
+
+def overloaded_error(exc: InferenceQueueFull) -> HTTPException:
+    """Build the 503 returned when the inference queue is full"""
+    return HTTPException(
+        status_code=503,
+        detail="Transcription queue is full, retry later",
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+def load_audio_file(data: bytes, suffix: str = "") -> np.ndarray:
+    """Decode a compressed upload through Whisper's ffmpeg loader"""
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+        temp_file.write(data)
+        temp_path = temp_file.name
+    try:
+        return whisper.load_audio(temp_path)
+    finally:
+        os.unlink(temp_path)
+
+async def load_audio(data: bytes, content_type: Optional[str] = None,
+                     sample_rate: Optional[int] = None, filename: Optional[str] = None,
+                     channels: Optional[int] = None, sample_format: Optional[str] = None) -> np.ndarray:
+    """Decode request bytes to 16 kHz mono float32, in memory for WAV/PCM"""
+    with metrics.stage("decode"):
+        try:
+            audio = await asyncio.to_thread(decode_audio, data, content_type, sample_rate, channels, sample_format)
+        except AudioFormatError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid audio: {e}")
+        if audio is not None:
+            return audio
+        return await asyncio.to_thread(load_audio_file, data, Path(filename or "").suffix)
+
+async def trim_silence(audio: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Cut leading/trailing silence; returns the audio and its offset in seconds"""
+    if not vad:
+        return audio, 0.0
+    return await asyncio.to_thread(vad.trim, audio)
+
+def shift_segments(segments: list, offset: float) -> list:
+    """Move segment and word timestamps back onto the untrimmed timeline"""
+    if not offset:
+        return segments
+    for segment in segments:
+        segment["start"] += offset
+        segment["end"] += offset
+        for word in segment.get("words", []):
+            word["start"] += offset
+            word["end"] += offset
+    return segments
+
+async def run_inference(priority: str, model_size: str, audio: np.ndarray, **options) -> Tuple[Dict[str, Any], float, float]:
+    """Queue a transcription in its priority class; returns (result, queue wait, inference seconds)"""
+    if not scheduler:
+        return await inference_executor.run_timed(run_transcription, model_size, audio, **options)
+    cost = len(audio) / whisper.audio.SAMPLE_RATE
+    return await scheduler.run_timed(priority, cost, run_transcription, model_size, audio, **options)
+
+async def transcribe_clip(audio: np.ndarray, model_size: str, **options) -> Dict[str, Any]:
+    """Trim silence, transcribe, and map timestamps back onto the original clip"""
+    duration = len(audio) / whisper.audio.SAMPLE_RATE
+    audio, offset = await trim_silence(audio)
+    if len(audio) == 0:
+        return {"text": "", "segments": [], "language": options.get("language") or LANGUAGE}
+    priority = SHORT if len(audio) <= PRIORITY_SHORT_MAX_SECONDS * whisper.audio.SAMPLE_RATE else BULK
+    result, queue_wait, seconds = await run_inference(priority, model_size, audio, **options)
+    metrics.observe_inference(queue_wait, seconds)
+    metrics.observe_audio(duration, seconds)
+    result["segments"] = shift_segments(result.get("segments", []), offset)
+    return result
+
+async def transcribe_bytes(audio_data: bytes, language: str, task: str, model_size: str = MODEL_SIZE,
+                           command: bool = False, content_type: Optional[str] = None, sample_rate: Optional[int] = None,
+                           filename: Optional[str] = None, channels: Optional[int] = None,
+                           sample_format: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+    """Serve a transcription from cache, or decode and transcribe and remember it
+
+    Identical requests that arrive while the first is still running wait for
+    its result rather than transcribing again; their source is "coalesced".
+    """
+    key = None
+    if transcription_cache or in_flight:
+        key_args = (audio_data, model_variant(model_size), language, task)
+        key_options = {"content_type": content_type, "sample_rate": sample_rate, "channels": channels,
+                       "sample_format": sample_format, "vad": VAD_ENABLED,
+                       "short_context": SHORT_CONTEXT_ENABLED, "command": command}
+        if len(audio_data) > 1 << 20:
+            key = await asyncio.to_thread(cache_key, *key_args, **key_options)
+        else:
+            key = cache_key(*key_args, **key_options)
+    if transcription_cache:
+        cached, source = await transcription_cache.get(key)
+        if cached is not None:
+            return cached, source
+
+    async def transcribe():
+        audio = await load_audio(audio_data, content_type, sample_rate, filename, channels, sample_format)
+        result = await transcribe_clip(
+            audio, model_size, short_context=SHORT_CONTEXT_ENABLED, command=command,
+            language=language, task=task, fp16=False, verbose=False
+        )
+        result = {
+            "text": result["text"],
+            "language": result.get("language") or language,
+            "segments": result.get("segments", []),
+            "command": result.get("command")
+        }
+        if transcription_cache:
+            await transcription_cache.set(key, result)
+        return result
+
+    if not in_flight:
+        return await transcribe(), "miss"
+    result, shared = await in_flight.run(key, transcribe)
+    if shared:
+        metrics.observe_coalesced()
+        return result, "coalesced"
+    return result, "miss"
+
 @app.post("/transcribe", response_model=TranscriptionResponse)
-async def transcribe_audio(file: UploadFile = File(...)):
-    """Transcribe uploaded audio file"""
-    if not whisper_model:
-        raise HTTPException(status_code=503, detail="Whisper model not loaded")
+async def transcribe_audio(file: UploadFile = File(...), model: Optional[str] = Query(None),
+                           mode: Optional[str] = Query(None), detail: Optional[str] = Query(None),
+                           fields: Optional[str] = Query(None)):
+    """Transcribe uploaded audio file, optionally with a specific model size or in command mode
+    
+    ``detail`` picks the body: "text" (transcript only), "segments" (id, start,
+    end and text per segment) or "full" (Whisper's segments verbatim, default).
+    ``fields`` further limits it to a comma-separated list of top-level keys.
+    """
+    readiness.require()
+    model_size = resolve_model(model)
+    command = resolve_mode(mode)
     
     try:
         import time
@@ -115,111 +522,280 @@ async def transcribe_audio(file: UploadFile = File(...)):
         # Read audio file
         audio_data = await file.read()
         
-        # Save to temporary file
-        temp_path = f"/tmp/{file.filename}"
-        with open(temp_path, "wb") as f:
-            f.write(audio_data)
-        
-        # Transcribe
-        result = whisper_model.transcribe(
-            temp_path,
+        # Transcribe, or reuse a cached result for identical audio
+        result, cache_source = await transcribe_bytes(
+            audio_data,
             language=LANGUAGE,
             task="transcribe",
-            fp16=False,
-            verbose=False
+            model_size=model_size,
+            command=command,
+            content_type=file.content_type,
+            filename=file.filename
         )
         
-        # Clean up temp file
-        os.unlink(temp_path)
-        
         processing_time = time.time() - start_time
         
-        # Calculate average confidence
-        avg_confidence = 0.0
-        if "segments" in result and result["segments"]:
-            confidences = [seg.get("confidence", 0.0) for seg in result["segments"]]
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        with metrics.stage("encode"):
+            return json_response(project(
+                result,
+                detail,
+                fields,
+                language=LANGUAGE,
+                processing_time=processing_time,
+                model=model_size,
+                cache=cache_source if transcription_cache or in_flight else None
+            ))
+        
+    except HTTPException:
+        raise
+    except ProjectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InferenceQueueFull as e:
+        raise overloaded_error(e)
+    except Exception as e:
+        logger.error(f"Transcription error: {e}")
+        raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
+
+async def read_body(request: Request, limit: int) -> memoryview:
+    """Read the request body chunk by chunk into one preallocated buffer"""
+    declared = request.headers.get("content-length")
+    if declared is not None:
+        try:
+            declared = int(declared)
+        except ValueError:
+            declared = -1
+        if declared < 0:
+            raise HTTPException(status_code=400, detail="Content-Length must be a non-negative integer")
+        if declared > limit:
+            raise HTTPException(status_code=413, detail=f"Audio exceeds the {limit} byte limit")
+        buffer = np.empty(declared, dtype=np.uint8)
+    else:
+        # Chunked upload: grow geometrically, never past the limit
+        buffer = np.empty(min(limit, 1 << 20), dtype=np.uint8)
+    
+    length = 0
+    async for chunk in request.stream():
+        end = length + len(chunk)
+        if end > limit:
+            raise HTTPException(status_code=413, detail=f"Audio exceeds the {limit} byte limit")
+        if end > len(buffer):
+            if declared is not None:
+                raise HTTPException(status_code=400, detail="Body is longer than Content-Length")
+            grown = np.empty(min(limit, max(end, 2 * len(buffer))), dtype=np.uint8)
+            grown[:length] = buffer[:length]
+            buffer = grown
+        buffer[length:end] = np.frombuffer(chunk, dtype=np.uint8)
+        length = end
+    return memoryview(buffer[:length])
+
+@app.post("/transcribe/raw", response_model=TranscriptionResponse)
+async def transcribe_raw(
+    request: Request,
+    model: Optional[str] = Query(None),
+    mode: Optional[str] = Query(None),
+    language: Optional[str] = Query(None),
+    detail: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    sample_rate: Optional[int] = Header(None, alias="X-Sample-Rate"),
+    channels: Optional[int] = Header(None, alias="X-Channels"),
+    sample_format: Optional[str] = Header(None, alias="X-Sample-Format")
+):
+    """Transcribe a raw request body: a WAV file, or headerless PCM described by headers
+    
+    Send ``Content-Type: application/octet-stream`` (or audio/wav, audio/L16) and,
+    for headerless PCM, ``X-Sample-Rate``, optionally ``X-Channels`` (default 1) and
+    ``X-Sample-Format`` (s16le or f32le, default s16le). ``detail`` and ``fields``
+    shape the body as for /transcribe.
+    """
+    readiness.require()
+    
+    content_type = request.headers.get("content-type")
+    if parse_content_type(content_type)[0] not in RAW_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Send application/octet-stream, audio/wav or audio/L16")
+    if sample_format is not None and sample_format not in PCM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"X-Sample-Format must be one of {sorted(PCM_FORMATS)}")
+    model_size = resolve_model(model)
+    command = resolve_mode(mode)
+    
+    try:
+        import time
+        start_time = time.time()
+        
+        audio_data = await read_body(request, RAW_MAX_BYTES)
+        if not audio_data:
+            raise HTTPException(status_code=400, detail="Empty request body")
         
-        return TranscriptionResponse(
-            text=result["text"].strip(),
-            language=result.get("language", LANGUAGE),
-            confidence=avg_confidence,
-            segments=result.get("segments", []),
-            processing_time=processing_time
+        result, cache_source = await transcribe_bytes(
+            audio_data,
+            language=language or LANGUAGE,
+            task="transcribe",
+            model_size=model_size,
+            command=command,
+            content_type=content_type,
+            sample_rate=sample_rate,
+            channels=channels,
+            sample_format=sample_format
         )
         
+        with metrics.stage("encode"):
+            return json_response(project(
+                result,
+                detail,
+                fields,
+                language=language or LANGUAGE,
+                processing_time=time.time() - start_time,
+                model=model_size,
+                cache=cache_source if transcription_cache or in_flight else None
+            ))
+    
+    except HTTPException:
+        raise
+    except ProjectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InferenceQueueFull as e:
+        raise overloaded_error(e)
     except Exception as e:
-        logger.error(f"Transcription error: {e}")
+        logger.error(f"Raw transcription error: {e}")
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
 
 @app.websocket("/ws/stream")
-async def websocket_stream(websocket: WebSocket):
+async def websocket_stream(websocket: WebSocket, model: Optional[str] = Query(None)):
     """WebSocket endpoint for real-time streaming transcription"""
     await websocket.accept()
     
-    if not whisper_model:
-        await websocket.send_json({"error": "Whisper model not loaded"})
+    if not readiness.ready:
+        await websocket.send_json({"error": f"Service is {readiness.state}", "retry_after": readiness.retry_after})
+        await websocket.close()
+        return
+    
+    try:
+        model_size = model_registry.validate(model, MODEL_SIZE)
+    except UnknownModel as e:
+        await websocket.send_json({"error": str(e)})
         await websocket.close()
         return
     
     logger.info("WebSocket connection established for streaming")
     
+    stream = StreamingTranscriber(
+        window_seconds=STREAM_WINDOW_SECONDS,
+        step_seconds=STREAM_STEP_SECONDS,
+        overlap_seconds=STREAM_OVERLAP_SECONDS,
+        prompt_chars=STREAM_PROMPT_CHARS
+    )
+    audio_ready = asyncio.Event()
+    stream_lock = asyncio.Lock()
+    
+    async def send_words(message_type: str, words):
+        if not words:
+            return
+        response = StreamingMessage(
+            type=message_type,
+            text=words_text(words),
+            confidence=words_confidence(words),
+            timestamp=asyncio.get_event_loop().time(),
+            speaker_id="default"
+        )
+        await websocket.send_json(response.dict())
+    
+    async def transcribe_window(final: bool = False):
+        """Transcribe the rolling window and emit committed and tentative text"""
+        async with stream_lock:
+            new_seconds = stream.pending_seconds
+            audio, offset = stream.snapshot()
+            if len(audio) == 0:
+                return
+            duration = len(audio) / whisper.audio.SAMPLE_RATE
+            if vad and not vad.has_speech(audio, new_seconds):
+                # Nothing but silence or noise in the window: skip the model
+                if final:
+                    await send_words("final", stream.flush())
+                else:
+                    stream.skip()
+                return
+            result, queue_wait, seconds = await run_inference(
+                INTERACTIVE,
+                model_size,
+                audio,
+                language=LANGUAGE,
+                task="transcribe",
+                fp16=False,
+                verbose=False,
+                initial_prompt=stream.prompt,
+                condition_on_previous_text=False,
+                word_timestamps=True
+            )
+            metrics.observe_inference(queue_wait, seconds)
+            metrics.observe_audio(duration, seconds)
+            committed, tentative = stream.apply(result, offset, offset + len(audio))
+            if final:
+                committed = committed + stream.flush()
+                tentative = []
+            await send_words("final", committed)
+            await send_words("partial", tentative)
+    
+    async def send_error(detail: str, **extra):
+        await websocket.send_json({"type": "error", "error": detail, **extra})
+    
+    async def run_window(final: bool = False):
+        """Transcribe a window, reporting a failure on the socket instead of closing it"""
+        try:
+            async with metrics.track("/ws/stream"):
+                await transcribe_window(final)
+        except WebSocketDisconnect:
+            raise
+        except InferenceQueueFull as e:
+            logger.warning("Skipping stream window, inference queue is full")
+            await send_error("Transcription queue is full", retry_after=e.retry_after)
+        except Exception as e:
+            logger.error(f"Streaming transcription error: {e}")
+            await send_error(f"Transcription error: {str(e)}")
+    
+    async def process_windows():
+        while True:
+            await audio_ready.wait()
+            audio_ready.clear()
+            await run_window()
+    
+    worker = asyncio.create_task(process_windows())
     try:
-        audio_buffer = bytearray()
-        chunk_size = 16000 * 2  # 1 second of 16kHz 16-bit audio
-        
         while True:
-            # Receive audio data
-            data = await websocket.receive_bytes()
-            audio_buffer.extend(data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
-            # Process when we have enough data
-            if len(audio_buffer) >= chunk_size:
-                # Extract chunk
-                chunk = bytes(audio_buffer[:chunk_size])
-                audio_buffer = audio_buffer[chunk_size:]
-                
-                # Convert to numpy array
-                audio_np = np.frombuffer(chunk, dtype=np.int16).astype(np.float32) / 32768.0
-                
-                # Transcribe chunk
+            if message.get("bytes"):
+                # Raw 16 kHz mono int16 PCM
+                stream.append(message["bytes"])
+                if stream.ready:
+                    audio_ready.set()
+            elif message.get("text"):
+                # {"type": "flush"} commits everything heard so far
                 try:
-                    result = whisper_model.transcribe(
-                        audio_np,
-                        language=LANGUAGE,
-                        task="transcribe",
-                        fp16=False,
-                        verbose=False
-                    )
-                    
-                    # Send partial result
-                    response = StreamingMessage(
-                        type="partial",
-                        text=result["text"].strip(),
-                        confidence=0.8,  # Placeholder confidence
-                        timestamp=asyncio.get_event_loop().time(),
-                        speaker_id="default"
-                    )
-                    
-                    await websocket.send_json(response.dict())
-                    
-                except Exception as e:
-                    logger.error(f"Streaming transcription error: {e}")
-                    await websocket.send_json({
-                        "error": f"Transcription error: {str(e)}"
-                    })
+                    control = json.loads(message["text"])
+                except ValueError:
+                    control = None
+                if not isinstance(control, dict):
+                    await send_error('Text frames must be JSON control messages such as {"type": "flush"}')
+                    continue
+                if control.get("type") == "flush":
+                    await run_window(final=True)
     
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
         await websocket.close()
+    finally:
+        worker.cancel()
 
 @app.post("/transcribe/text")
 async def transcribe_text_data(request: TranscriptionRequest):
     """Transcribe base64 encoded audio data"""
-    if not whisper_model:
-        raise HTTPException(status_code=503, detail="Whisper model not loaded")
+    readiness.require()
+    model_size = resolve_model(request.model)
+    command = resolve_mode(request.mode)
+    detail, fields = request.detail, request.fields
     
     try:
         import base64
@@ -230,39 +806,35 @@ async def transcribe_text_data(request: TranscriptionRequest):
         # Decode base64 audio data
         audio_data = base64.b64decode(request.audio_data)
         
-        # Save to temporary file
-        temp_path = f"/tmp/audio_{int(time.time())}.wav"
-        with open(temp_path, "wb") as f:
-            f.write(audio_data)
-        
-        # Transcribe
-        result = whisper_model.transcribe(
-            temp_path,
+        # Transcribe, or reuse a cached result for identical audio
+        result, cache_source = await transcribe_bytes(
+            audio_data,
             language=request.language or LANGUAGE,
             task=request.task,
-            fp16=False,
-            verbose=False
+            model_size=model_size,
+            command=command,
+            sample_rate=request.sample_rate
         )
         
-        # Clean up
-        os.unlink(temp_path)
-        
         processing_time = time.time() - start_time
         
-        # Calculate confidence
-        avg_confidence = 0.0
-        if "segments" in result and result["segments"]:
-            confidences = [seg.get("confidence", 0.0) for seg in result["segments"]]
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
-        
-        return TranscriptionResponse(
-            text=result["text"].strip(),
-            language=result.get("language", request.language or LANGUAGE),
-            confidence=avg_confidence,
-            segments=result.get("segments", []),
-            processing_time=processing_time
-        )
+        with metrics.stage("encode"):
+            return json_response(project(
+                result,
+                detail,
+                fields,
+                language=request.language or LANGUAGE,
+                processing_time=processing_time,
+                model=model_size,
+                cache=cache_source if transcription_cache or in_flight else None
+            ))
         
+    except HTTPException:
+        raise
+    except ProjectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InferenceQueueFull as e:
+        raise overloaded_error(e)
     except Exception as e:
         logger.error(f"Text transcription error: {e}")
         raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
@@ -0,0 +1,107 @@
+"""
+Transcription result cache
+Content-addressed, two tiers: an in-process LRU in front of Redis
+"""
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "whisper-stt:transcript:"
+
+
+def cache_key(audio: bytes, model: str, language: Optional[str], task: str, **options) -> str:
+    """Hash the raw audio bytes together with everything that changes the output"""
+    digest = hashlib.blake2b(audio, digest_size=20)
+    params = {"model": model, "language": language or "", "task": task, **options}
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return KEY_PREFIX + digest.hexdigest()
+
+
+class LRUCache:
+    """Small ordered-dict LRU with per-entry expiry"""
+
+    def __init__(self, max_items: int, ttl: float):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+
+class TranscriptionCache:
+    """Looks results up in memory first, then Redis; Redis failures count as misses"""
+
+    def __init__(self, max_items: int = 512, ttl: int = 86400):
+        self.memory = LRUCache(max_items, ttl)
+        self.ttl = ttl
+        self.redis = None
+        self.hits = {"memory": 0, "redis": 0}
+        self.misses = 0
+
+    async def get(self, key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Return ``(result, source)`` where source is memory, redis or miss"""
+        result = self.memory.get(key)
+        if result is not None:
+            self.hits["memory"] += 1
+            return result, "memory"
+
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(key)
+            except Exception as e:
+                logger.warning(f"Redis cache read failed: {e}")
+                raw = None
+            if raw is not None:
+                result = json.loads(raw)
+                self.memory.set(key, result)
+                self.hits["redis"] += 1
+                return result, "redis"
+
+        self.misses += 1
+        return None, "miss"
+
+    async def set(self, key: str, result: Dict[str, Any]):
+        self.memory.set(key, result)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(key, json.dumps(result, default=float), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Redis cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits["memory"] + self.hits["redis"] + self.misses
+        return {
+            "memory_items": len(self.memory),
+            "memory_evictions": self.memory.evictions,
+            "hits_memory": self.hits["memory"],
+            "hits_redis": self.hits["redis"],
+            "misses": self.misses,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,191 @@
+"""
+Game-command grammar for the Whisper STT service
+Compiles commands and proper nouns from the content packs and matches short utterances against them
+"""
+
+import json
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import whisper
+
+logger = logging.getLogger(__name__)
+
+# Interface commands that are not tied to any pack entry
+UI_COMMANDS = {
+    "ui:open_treasury": ["open treasury"],
+    "ui:open_inventory": ["open inventory"],
+    "ui:open_map": ["open map", "show map"],
+    "ui:open_missions": ["open missions", "show missions"],
+    "ui:open_diplomacy": ["open diplomacy"],
+    "ui:close": ["close", "close panel"],
+    "ui:pause": ["pause game"],
+    "ui:resume": ["resume game"],
+    "ui:confirm": ["confirm"],
+    "ui:cancel": ["cancel"],
+}
+
+# Phrasings per pack entry kind; the bare name is always included too
+TEMPLATES = {
+    "world": ["travel to {}", "go to {}", "set course for {}"],
+    "faction": ["hail {}", "contact {}"],
+    "mission": ["start {}", "start mission {}", "launch {}"],
+    "item": ["use {}", "equip {}"],
+}
+
+ACTIONS = {"world": "travel", "faction": "hail", "mission": "start", "item": "use"}
+
+# Marks a trie node where a complete command ends
+END = -1
+
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+def slug(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+
+
+@dataclass
+class Command:
+    id: str
+    phrase: str
+
+
+@dataclass
+class CommandMatch:
+    id: str
+    phrase: str
+    score: float  # mean token log-probability, end of utterance included
+    steps: int  # decoder steps spent
+
+
+def load_pack_commands(packs_dir: str) -> List[Command]:
+    """Expand the pack entries into (command id, phrase) pairs"""
+    root = Path(packs_dir)
+    entries: List[Tuple[str, str, str]] = []  # (kind, id, name)
+
+    def read(pattern: str):
+        for path in sorted(root.glob(pattern)):
+            try:
+                yield json.loads(path.read_text())
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable content pack {path}: {e}")
+
+    for world in read("worlds/*.json"):
+        entries.append(("world", slug(world["name"]), world["name"]))
+        for faction in world.get("factions", []):
+            entries.append(("faction", faction.get("id") or slug(faction["name"]), faction["name"]))
+    for mission in read("missions/*.json"):
+        entries.append(("mission", slug(mission["name"]), mission["name"]))
+    for items in read("items/*.json"):
+        for item in items:
+            entries.append(("item", item.get("id") or slug(item["name"]), item["name"]))
+
+    commands = [Command(cid, phrase) for cid, phrases in UI_COMMANDS.items() for phrase in phrases]
+    # Optional packs of extra commands: [{"id": "...", "phrases": ["..."]}]
+    for pack in read("commands/*.json"):
+        for entry in pack:
+            commands.extend(Command(entry["id"], phrase) for phrase in entry["phrases"])
+
+    for kind, entry_id, name in entries:
+        names = {name}
+        if name.lower().startswith("the "):
+            names.update({name[4:], "the " + name[4:]})
+        for variant in names:
+            commands.append(Command(f"{kind}:{entry_id}", variant))
+            commands.extend(Command(f"{ACTIONS[kind]}:{entry_id}", t.format(variant)) for t in TEMPLATES[kind])
+    return commands
+
+
+class CommandGrammar:
+    """Closed set of commands, indexed by normalized text and by token prefix.
+
+    ``match`` runs Whisper's decoder constrained to the token trie: at each
+    step only tokens that continue some command are considered, so decoding
+    stops as soon as a command is complete instead of running to end of
+    text. It gives up early when even the best allowed token is unlikely.
+    The score uses the unconstrained log-probabilities, so audio that is not
+    a command scores low even though the constrained path always ends in one.
+    """
+
+    def __init__(self, commands: List[Command], min_token_logprob: float = -6.0):
+        self.commands = commands
+        self.min_token_logprob = min_token_logprob
+        self.index: Dict[str, Command] = {}
+        for command in commands:
+            self.index.setdefault(normalize(command.phrase), command)
+        self._tries: Dict[Tuple, dict] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_packs(cls, packs_dir: str, **kwargs) -> "CommandGrammar":
+        return cls(load_pack_commands(packs_dir), **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def lookup(self, text: str) -> Optional[Command]:
+        """Exact match of free-form transcription text against the grammar"""
+        return self.index.get(normalize(text))
+
+    def _trie(self, tokenizer) -> dict:
+        key = (tokenizer.encoding.name, tokenizer.language)
+        with self._lock:
+            trie = self._tries.get(key)
+            if trie is None:
+                trie = {}
+                for command in self.commands:
+                    # Whisper writes sentences capitalized, but may not
+                    for surface in {command.phrase, command.phrase[:1].upper() + command.phrase[1:]}:
+                        node = trie
+                        for token in tokenizer.encode(" " + surface):
+                            node = node.setdefault(token, {})
+                        node.setdefault(END, command)
+                self._tries[key] = trie
+        return trie
+
+    @torch.no_grad()
+    def match(self, model, audio_features: torch.Tensor, language: Optional[str]) -> Optional[CommandMatch]:
+        """Constrained greedy decode over the grammar; None when nothing fits"""
+        tokenizer = whisper.tokenizer.get_tokenizer(
+            model.is_multilingual,
+            num_languages=model.num_languages,
+            language=language or "en",
+            task="transcribe"
+        )
+        node = self._trie(tokenizer)
+        # Ending on punctuation counts the same as ending on end-of-text
+        end_tokens = [tokenizer.eot] + [tokenizer.encode(p)[0] for p in (".", "!", "?")]
+
+        cache, hooks = model.install_kv_cache_hooks()
+        try:
+            tokens = torch.tensor([list(tokenizer.sot_sequence_including_notimestamps)], device=model.device)
+            chosen: List[float] = []
+            while True:
+                logits = model.decoder(tokens, audio_features, kv_cache=cache)[0, -1]
+                logprobs = torch.log_softmax(logits.float(), dim=-1)
+                allowed = [t for t in node if t != END]
+                best = max(allowed, key=lambda t: logprobs[t].item()) if allowed else None
+
+                if END in node:
+                    end_logprob = torch.logsumexp(logprobs[end_tokens], dim=0).item()
+                    if best is None or end_logprob >= logprobs[best].item():
+                        command = node[END]
+                        steps = len(chosen) + 1
+                        return CommandMatch(command.id, command.phrase, (sum(chosen) + end_logprob) / steps, steps)
+                if best is None or logprobs[best].item() < self.min_token_logprob:
+                    return None
+
+                chosen.append(logprobs[best].item())
+                node = node[best]
+                tokens = torch.tensor([[best]], device=model.device)
+        finally:
+            for hook in hooks:
+                hook.remove()
@@ -0,0 +1,105 @@
+"""
+Transcription response shaping
+Projects results down to what the caller asked for and encodes them without pydantic
+"""
+
+import json
+import math
+from typing import Any, Dict, Optional
+
+import numpy as np
+from fastapi.responses import Response
+
+# text: transcript only; segments: timings and text per segment; full: Whisper's segments verbatim
+DETAIL_LEVELS = ("text", "segments", "full")
+
+TEXT_FIELDS = ("text", "language", "processing_time", "command")
+LITE_SEGMENT_FIELDS = ("id", "start", "end", "text")
+LITE_WORD_FIELDS = ("word", "start", "end", "probability")
+
+
+class ProjectionError(ValueError):
+    """Raised for an unknown detail level or field name"""
+
+
+def average_confidence(segments: list) -> float:
+    if not segments:
+        return 0.0
+    return sum(seg.get("confidence", 0.0) for seg in segments) / len(segments)
+
+
+def lite_segment(segment: Dict[str, Any]) -> Dict[str, Any]:
+    lite = {k: segment[k] for k in LITE_SEGMENT_FIELDS if k in segment}
+    lite["text"] = lite.get("text", "").strip()
+    if "words" in segment:
+        lite["words"] = [{k: w[k] for k in LITE_WORD_FIELDS if k in w} for w in segment["words"]]
+    return lite
+
+
+def parse_fields(fields: Optional[str]) -> Optional[set]:
+    if not fields:
+        return None
+    return {f.strip() for f in fields.split(",") if f.strip()}
+
+
+def project(result: Dict[str, Any], detail: Optional[str] = None, fields: Optional[str] = None,
+            **meta) -> Dict[str, Any]:
+    """Build the response body for ``detail``, then keep only ``fields`` if given.
+
+    ``meta`` carries the per-request values (processing_time, model, cache,
+    language fallback) that are not part of the cached result.
+    """
+    detail = detail or "full"
+    if detail not in DETAIL_LEVELS:
+        raise ProjectionError(f"Unknown detail '{detail}', use one of {list(DETAIL_LEVELS)}")
+
+    segments = result.get("segments", [])
+    body = {
+        "text": result["text"].strip(),
+        "language": result.get("language") or meta.get("language"),
+        "confidence": average_confidence(segments),
+        "processing_time": meta.get("processing_time"),
+        "model": meta.get("model"),
+        "command": result.get("command"),
+        "cache": meta.get("cache"),
+    }
+    if detail == "text":
+        body = {k: body[k] for k in TEXT_FIELDS}
+    elif detail == "segments":
+        body["segments"] = [lite_segment(seg) for seg in segments]
+    else:
+        body["segments"] = segments
+
+    wanted = parse_fields(fields)
+    if wanted:
+        unknown = wanted - body.keys()
+        if unknown:
+            raise ProjectionError(f"Unknown fields {sorted(unknown)} for detail '{detail}'")
+        body = {k: v for k, v in body.items() if k in wanted}
+    return body
+
+
+def jsonable(value: Any) -> Any:
+    """Convert numpy scalars and arrays to Python values and non-finite floats to None.
+
+    Whisper reports some segment statistics as numpy types, and an empty or
+    silent window can give NaN or -inf log probabilities, none of which
+    strict JSON can encode.
+    """
+    if isinstance(value, dict):
+        return {k: jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return jsonable(value.tolist())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def json_response(body: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Encode straight to JSON bytes, skipping response_model validation"""
+    content = json.dumps(jsonable(body), separators=(",", ":"), ensure_ascii=False, allow_nan=False).encode("utf-8")
+    return Response(content=content, status_code=status_code, headers=headers, media_type="application/json")
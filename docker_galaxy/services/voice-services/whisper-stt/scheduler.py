@@ -0,0 +1,186 @@
+"""
+Priority scheduler for the Whisper STT service
+Orders model calls by class with weighted fair queuing so bulk uploads cannot starve live streams
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from voice_common.inference import InferenceQueueFull
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+SHORT = "short"
+BULK = "bulk"
+
+
+@dataclass
+class PriorityClass:
+    """Share of the workers (``weight``), most concurrent calls and most waiting calls for one class"""
+    weight: float
+    max_running: int
+    max_queue: int
+
+
+@dataclass
+class _Entry:
+    start: float
+    finish: float
+    submitted: float
+    future: asyncio.Future
+
+
+class PriorityScheduler:
+    """Admits model calls to the executor one free worker at a time, choosing by class.
+
+    Each call is tagged with a virtual finish time, ``max(virtual clock,
+    class's last finish) + cost / weight``, where cost is the audio seconds to
+    transcribe.
+    The waiting call with the smallest tag runs next (self-clocked weighted
+    fair queuing), so a class gets workers in proportion to its weight and a
+    long upload costs more of its class's share than a short one. A class at
+    its ``max_running`` is skipped until one of its calls finishes.
+
+    Running calls cannot be preempted, so interactive latency is protected by
+    admission instead: while an interactive call has waited longer than
+    ``interactive_slo`` within the last ``slo_window`` seconds, queued bulk
+    calls are held back and new ones are rejected with ``InferenceQueueFull``.
+    """
+
+    def __init__(self, executor, classes: Dict[str, PriorityClass], interactive_slo: float = 0.25,
+                 slo_window: float = 10.0):
+        self.executor = executor
+        self.classes = classes
+        self.interactive_slo = interactive_slo
+        self.slo_window = slo_window
+        self._queues: Dict[str, Deque[_Entry]] = {name: deque() for name in classes}
+        self._running: Dict[str, int] = {name: 0 for name in classes}
+        self._last_finish: Dict[str, float] = {name: 0.0 for name in classes}
+        self._virtual_time = 0.0
+        # (when, seconds) of recent interactive waits over the SLO
+        self._slo_misses: Deque[Tuple[float, float]] = deque()
+        self._wake: Optional[asyncio.TimerHandle] = None
+        self.completed = {name: 0 for name in classes}
+        self.rejected = {name: 0 for name in classes}
+        self.shed = 0
+
+    @property
+    def workers(self) -> int:
+        return self.executor.workers
+
+    @property
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def at_risk(self) -> bool:
+        """Whether interactive calls are, or recently were, waiting past their SLO"""
+        now = time.perf_counter()
+        while self._slo_misses and self._slo_misses[0][0] < now - self.slo_window:
+            self._slo_misses.popleft()
+        waiting = self._queues.get(INTERACTIVE)
+        head_wait = now - waiting[0].submitted if waiting else 0.0
+        return bool(self._slo_misses) or head_wait > self.interactive_slo
+
+    async def run_timed(self, priority: str, cost: float, fn: Callable[..., Any],
+                        *args, **kwargs) -> Tuple[Any, float, float]:
+        """Wait for this call's turn, then run it on the executor; like the executor's ``run_timed``"""
+        limits = self.classes[priority]
+        queue = self._queues[priority]
+        if len(queue) >= limits.max_queue:
+            self.rejected[priority] += 1
+            raise InferenceQueueFull(self.executor.retry_after)
+        if priority == BULK and self.at_risk:
+            self.shed += 1
+            raise InferenceQueueFull(self.executor.retry_after)
+
+        start = max(self._virtual_time, self._last_finish[priority])
+        finish = start + max(cost, 0.01) / limits.weight
+        self._last_finish[priority] = finish
+        entry = _Entry(start, finish, time.perf_counter(), asyncio.get_running_loop().create_future())
+        queue.append(entry)
+        self._dispatch()
+        try:
+            await entry.future
+        except asyncio.CancelledError:
+            # Still queued: _dispatch drops entries whose future is done.
+            # Already admitted: the slot is ours to hand back.
+            if entry.future.done() and not entry.future.cancelled():
+                self._release(priority)
+            raise
+        waited = time.perf_counter() - entry.submitted
+
+        # The slot is freed when the call finishes, not when the caller stops waiting
+        call = asyncio.ensure_future(self.executor.run_timed(fn, *args, **kwargs))
+        call.add_done_callback(lambda _: self._release(priority))
+        result, queue_wait, seconds = await asyncio.shield(call)
+        return result, waited + queue_wait, seconds
+
+    def _dispatch(self):
+        """Admit waiting calls, smallest finish tag first, while workers are free"""
+        hold_bulk = False
+        while self.running < self.workers:
+            best = None
+            for name, queue in self._queues.items():
+                while queue and queue[0].future.done():
+                    queue.popleft()
+                if not queue or self._running[name] >= self.classes[name].max_running:
+                    continue
+                if name == BULK and self.at_risk:
+                    hold_bulk = True
+                    continue
+                if best is None or queue[0].finish < self._queues[best][0].finish:
+                    best = name
+            if best is None:
+                break
+            entry = self._queues[best].popleft()
+            self._running[best] += 1
+            # The clock follows the start tag of the call entering service, so
+            # a class that sat idle cannot bank credit for the time it skipped
+            self._virtual_time = max(self._virtual_time, entry.start)
+            if best == INTERACTIVE:
+                waited = time.perf_counter() - entry.submitted
+                if waited > self.interactive_slo:
+                    self._slo_misses.append((time.perf_counter(), waited))
+            entry.future.set_result(None)
+
+        if hold_bulk and self._wake is None:
+            # Nothing else may arrive to re-run dispatch once the risk window passes
+            self._wake = asyncio.get_running_loop().call_later(self.slo_window, self._rewake)
+
+    def _rewake(self):
+        self._wake = None
+        self._dispatch()
+
+    def _release(self, priority: str):
+        self._running[priority] -= 1
+        self.completed[priority] += 1
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "at_risk": self.at_risk,
+            "interactive_slo_ms": round(self.interactive_slo * 1000),
+            "shed": self.shed,
+            "classes": {
+                name: {
+                    "weight": limits.weight,
+                    "max_running": limits.max_running,
+                    "max_queue": limits.max_queue,
+                    "running": self._running[name],
+                    "queued": len(self._queues[name]),
+                    "completed": self.completed[name],
+                    "rejected": self.rejected[name],
+                }
+                for name, limits in self.classes.items()
+            },
+        }
@@ -0,0 +1,219 @@
+"""
+Incremental streaming transcription
+Rolling audio window with prompt carry-over and a local-agreement commit policy
+"""
+
+import itertools
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+# Drop re-heard words that start this long before the last committed word ended
+COMMIT_TOLERANCE = 0.1
+# Longest committed n-gram checked for repetition at the start of a hypothesis
+MAX_NGRAM_OVERLAP = 5
+# Committed words kept for the prompt and echo detection
+MAX_COMMITTED_WORDS = 256
+
+
+@dataclass
+class Word:
+    text: str
+    start: float
+    end: float
+    probability: float = 1.0
+
+    @property
+    def key(self) -> str:
+        return normalize_word(self.text)
+
+
+def normalize_word(text: str) -> str:
+    return re.sub(r"[^\w']", "", text.lower())
+
+
+class RingBuffer:
+    """Fixed-capacity float32 audio buffer addressed by absolute sample index.
+
+    Appends overwrite the oldest audio once the capacity is reached, so memory
+    never grows with stream length and nothing is re-sliced on every message.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=np.float32)
+        self.start = 0  # absolute index of the oldest retained sample
+        self.end = 0  # absolute index one past the newest sample
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def append(self, samples: np.ndarray):
+        if len(samples) > self.capacity:
+            self.end += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+
+        pos = self.end % self.capacity
+        first = min(len(samples), self.capacity - pos)
+        self._data[pos:pos + first] = samples[:first]
+        self._data[:len(samples) - first] = samples[first:]
+        self.end += len(samples)
+        self.start = max(self.start, self.end - self.capacity)
+
+    def discard_until(self, index: int):
+        """Forget everything before absolute sample ``index``"""
+        self.start = min(max(self.start, index), self.end)
+
+    def read(self) -> np.ndarray:
+        """Copy out the retained window in order"""
+        pos_start = self.start % self.capacity
+        pos_end = self.end % self.capacity
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.float32)
+        if pos_start < pos_end:
+            return self._data[pos_start:pos_end].copy()
+        return np.concatenate((self._data[pos_start:], self._data[:pos_end]))
+
+
+class LocalAgreement:
+    """Commits the prefix two consecutive hypotheses agree on (LocalAgreement-2)"""
+
+    def __init__(self):
+        self.committed: List[Word] = []
+        self.tentative: List[Word] = []
+
+    @property
+    def committed_end(self) -> float:
+        return self.committed[-1].end if self.committed else 0.0
+
+    def _new_words(self, words: List[Word]) -> List[Word]:
+        words = [w for w in words if w.start > self.committed_end - COMMIT_TOLERANCE]
+        if not words or not self.committed:
+            return words
+        # Whisper often repeats the tail of the prompt; drop that echo
+        for n in range(min(MAX_NGRAM_OVERLAP, len(self.committed), len(words)), 0, -1):
+            tail = [w.key for w in self.committed[-n:]]
+            head = [w.key for w in words[:n]]
+            if tail == head:
+                return words[n:]
+        return words
+
+    def update(self, words: List[Word]) -> List[Word]:
+        """Feed a new hypothesis and return the newly committed words"""
+        words = self._new_words(words)
+        agreed = 0
+        for previous, current in zip(self.tentative, words):
+            if previous.key != current.key:
+                break
+            agreed += 1
+        newly = words[:agreed]
+        self.committed.extend(newly)
+        del self.committed[:-MAX_COMMITTED_WORDS]
+        self.tentative = words[agreed:]
+        return newly
+
+    def flush(self) -> List[Word]:
+        """Commit whatever is still tentative"""
+        newly = self.tentative
+        self.committed.extend(newly)
+        self.tentative = []
+        return newly
+
+
+class StreamingTranscriber:
+    """Per-connection streaming state.
+
+    ``append`` runs on the event loop as audio arrives. ``snapshot`` copies the
+    current window for a worker thread, and ``apply`` folds the worker's result
+    back in, so the buffer is never touched from two threads at once.
+    """
+
+    def __init__(self, window_seconds: float = 15.0, step_seconds: float = 1.0,
+                 overlap_seconds: float = 1.0, prompt_chars: int = 200, sample_rate: int = SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.window = int(window_seconds * sample_rate)
+        self.step = int(step_seconds * sample_rate)
+        self.overlap = int(overlap_seconds * sample_rate)
+        self.prompt_chars = prompt_chars
+        # Headroom so audio arriving during a slow inference is not overwritten
+        self.buffer = RingBuffer(self.window * 2)
+        self.agreement = LocalAgreement()
+        self._carry = b""
+        self._processed_end = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.buffer.end - self._processed_end >= self.step
+
+    @property
+    def pending_seconds(self) -> float:
+        """Audio received since the last snapshot"""
+        return (self.buffer.end - self._processed_end) / self.sample_rate
+
+    @property
+    def prompt(self) -> Optional[str]:
+        text = "".join(w.text for w in self.agreement.committed)[-self.prompt_chars:]
+        return text.strip() or None
+
+    def append(self, data: bytes):
+        """Append little-endian int16 PCM, carrying an odd trailing byte"""
+        data = self._carry + data
+        usable = len(data) - len(data) % 2
+        self._carry = data[usable:]
+        if usable:
+            samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768.0
+            self.buffer.append(samples)
+
+    def snapshot(self) -> Tuple[np.ndarray, int]:
+        """Return the window to transcribe and its absolute start sample"""
+        self._processed_end = self.buffer.end
+        return self.buffer.read(), self.buffer.start
+
+    def apply(self, result: Dict[str, Any], offset: int, end: int) -> Tuple[List[Word], List[Word]]:
+        """Fold a transcription of ``[offset, end)`` in; returns (committed, tentative)"""
+        base = offset / self.sample_rate
+        words = [
+            Word(w["word"], base + w["start"], base + w["end"], w.get("probability", 1.0))
+            for segment in result.get("segments", [])
+            for w in segment.get("words", [])
+        ]
+        committed = self.agreement.update(words)
+
+        if len(self.buffer) > self.window:
+            # No agreement inside a full window: commit what ends before the
+            # overlap region and roll the window forward regardless
+            cutoff = (end - self.overlap) / self.sample_rate
+            forced = list(itertools.takewhile(lambda w: w.end <= cutoff, self.agreement.tentative))
+            if forced:
+                self.agreement.committed.extend(forced)
+                self.agreement.tentative = self.agreement.tentative[len(forced):]
+                committed = committed + forced
+            self.buffer.discard_until(max(int(self.agreement.committed_end * self.sample_rate), end - self.overlap))
+        elif committed:
+            self.buffer.discard_until(int(self.agreement.committed_end * self.sample_rate))
+
+        return committed, self.agreement.tentative
+
+    def skip(self):
+        """Drop a window that held no speech, keeping only the overlap tail"""
+        self.agreement.tentative = []
+        self.buffer.discard_until(self.buffer.end - self.overlap)
+
+    def flush(self) -> List[Word]:
+        committed = self.agreement.flush()
+        self.buffer.discard_until(self.buffer.end)
+        return committed
+
+
+def words_text(words: List[Word]) -> str:
+    return "".join(w.text for w in words).strip()
+
+
+def words_confidence(words: List[Word]) -> float:
+    if not words:
+        return 0.0
+    return float(sum(w.probability for w in words) / len(words))
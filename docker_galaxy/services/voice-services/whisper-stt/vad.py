@@ -0,0 +1,114 @@
+"""
+Voice activity detection
+Cheap energy + spectral-flatness gate that keeps silence and room noise away from Whisper
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+@dataclass
+class VADConfig:
+    frame_ms: float = 30.0
+    # Frames must be this far above the clip's noise floor...
+    margin_db: float = 12.0
+    # ...and never below this absolute level (dBFS)
+    floor_db: float = -50.0
+    # Speech is harmonic; broadband noise has a flat spectrum close to 1.0
+    max_flatness: float = 0.45
+    # Keep this much audio around detected speech so onsets aren't clipped
+    padding_ms: float = 200.0
+    # Ignore isolated clicks shorter than this
+    min_speech_ms: float = 150.0
+
+
+class VoiceActivityDetector:
+    """Vectorized frame classifier with running skip counters"""
+
+    def __init__(self, config: VADConfig = None, sample_rate: int = SAMPLE_RATE):
+        self.config = config or VADConfig()
+        self.sample_rate = sample_rate
+        self.frame = int(sample_rate * self.config.frame_ms / 1000)
+        self._window = np.hanning(self.frame).astype(np.float32)
+        self._lock = threading.Lock()
+        self.seconds_total = 0.0
+        self.seconds_skipped = 0.0
+        self.inferences_skipped = 0
+
+    def _count(self, total: float, skipped: float, inference_skipped: bool = False):
+        with self._lock:
+            self.seconds_total += total
+            self.seconds_skipped += skipped
+            self.inferences_skipped += int(inference_skipped)
+
+    def speech_mask(self, audio: np.ndarray) -> np.ndarray:
+        """Return one boolean per ``frame_ms`` frame, True where speech is likely"""
+        n_frames = len(audio) // self.frame
+        if n_frames == 0:
+            return np.zeros(0, dtype=bool)
+        frames = audio[:n_frames * self.frame].reshape(n_frames, self.frame)
+
+        power = np.mean(frames ** 2, axis=1) + 1e-12
+        energy_db = 10.0 * np.log10(power)
+        noise_floor = np.percentile(energy_db, 10)
+        loud = energy_db > max(noise_floor + self.config.margin_db, self.config.floor_db)
+        # A clip that is speech end to end has no quiet frames to estimate the
+        # floor from, so fall back to the absolute level alone
+        if noise_floor > self.config.floor_db + self.config.margin_db:
+            loud = energy_db > self.config.floor_db
+
+        spectrum = np.abs(np.fft.rfft(frames * self._window, axis=1)) ** 2 + 1e-12
+        flatness = np.exp(np.mean(np.log(spectrum), axis=1)) / np.mean(spectrum, axis=1)
+
+        mask = loud & (flatness < self.config.max_flatness)
+        return self._smooth(mask)
+
+    def _smooth(self, mask: np.ndarray) -> np.ndarray:
+        # Drop runs shorter than min_speech, then pad the survivors
+        min_frames = max(1, int(self.config.min_speech_ms / self.config.frame_ms))
+        if min_frames > 1 and mask.any():
+            runs = np.convolve(mask.astype(np.int32), np.ones(min_frames, dtype=np.int32), mode="same")
+            core = runs >= min_frames
+            mask = np.convolve(core.astype(np.int32), np.ones(min_frames, dtype=np.int32), mode="same") > 0
+        pad = int(self.config.padding_ms / self.config.frame_ms)
+        if pad and mask.any():
+            mask = np.convolve(mask.astype(np.int32), np.ones(2 * pad + 1, dtype=np.int32), mode="same") > 0
+        return mask
+
+    def trim(self, audio: np.ndarray) -> Tuple[np.ndarray, float]:
+        """Cut leading and trailing non-speech; returns (audio, start offset in seconds).
+
+        An empty array means the clip held no speech at all.
+        """
+        duration = len(audio) / self.sample_rate
+        mask = self.speech_mask(audio)
+        voiced = np.flatnonzero(mask)
+        if len(voiced) == 0:
+            self._count(duration, duration, inference_skipped=True)
+            return audio[:0], 0.0
+
+        start = int(voiced[0]) * self.frame
+        end = len(audio) if voiced[-1] == len(mask) - 1 else (int(voiced[-1]) + 1) * self.frame
+        self._count(duration, (len(audio) - (end - start)) / self.sample_rate)
+        return audio[start:end], start / self.sample_rate
+
+    def has_speech(self, audio: np.ndarray, new_seconds: float = None) -> bool:
+        """Gate a streaming window; ``new_seconds`` is the audio not yet counted"""
+        counted = len(audio) / self.sample_rate if new_seconds is None else new_seconds
+        if self.speech_mask(audio).any():
+            self._count(counted, 0.0)
+            return True
+        self._count(counted, counted, inference_skipped=True)
+        return False
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "seconds_total": round(self.seconds_total, 3),
+            "seconds_skipped": round(self.seconds_skipped, 3),
+            "inferences_skipped": self.inferences_skipped,
+        }
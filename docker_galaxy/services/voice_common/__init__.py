@@ -0,0 +1,7 @@
+"""
+Shared code for the voice services
+Metrics, readiness, inference pools, audio decoding and model stores used by stt, tts, whisper-stt and coqui-tts
+
+Each service image copies this package next to its app.py. To run a service
+from a checkout, put docker_galaxy/services on PYTHONPATH.
+"""
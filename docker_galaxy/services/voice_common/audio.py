@@ -0,0 +1,239 @@
+"""
+In-memory audio decoding
+Turns WAV and raw PCM request bodies into 16 kHz mono float32 without touching disk or ffmpeg
+"""
+
+import math
+import struct
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+SAMPLE_RATE = 16000
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# MIME types that carry headerless little-endian int16 PCM
+PCM_CONTENT_TYPES = {"audio/l16", "audio/pcm", "audio/x-pcm", "audio/raw"}
+WAV_CONTENT_TYPES = {"audio/wav", "audio/wave", "audio/x-wav", "audio/vnd.wave"}
+
+# Headerless sample formats, named as in ffmpeg
+PCM_FORMATS = {"s16le": "<i2", "f32le": "<f4"}
+
+# Sample widths _to_float32 can decode
+WAV_BITS = (8, 16, 24, 32, 64)
+
+# Output samples resampled per block; bounds the working set however long the recording
+RESAMPLE_BLOCK = 1 << 18
+# Anti-aliasing filter: zero crossings of the sinc on each side, and the Kaiser window's beta
+RESAMPLE_ZERO_CROSSINGS = 16
+RESAMPLE_BETA = 8.0
+
+
+class AudioFormatError(ValueError):
+    """Raised when a WAV or PCM payload is malformed or unsupported"""
+
+
+def parse_content_type(content_type: Optional[str]) -> Tuple[str, dict]:
+    """Split ``audio/L16; rate=16000; channels=1`` into a media type and params"""
+    if not content_type:
+        return "", {}
+    parts = [p.strip() for p in content_type.split(";")]
+    params = {}
+    for part in parts[1:]:
+        if "=" in part:
+            key, value = part.split("=", 1)
+            params[key.strip().lower()] = value.strip().strip('"')
+    return parts[0].lower(), params
+
+
+def is_wav(data: bytes) -> bool:
+    return len(data) >= 12 and data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def parse_wav(data: bytes) -> Tuple[np.ndarray, int]:
+    """Parse a RIFF/WAVE payload into float32 samples (frames x channels) and its rate"""
+    if not is_wav(data):
+        raise AudioFormatError("Not a RIFF/WAVE payload")
+
+    fmt = None
+    samples = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack_from("<I", data, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            if chunk_size < 16 or body + 16 > len(data):
+                raise AudioFormatError("Truncated fmt chunk")
+            format_tag, channels, rate, _, block_align, bits = struct.unpack_from("<HHIIHH", data, body)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40 and body + 26 <= len(data):
+                # The real format tag is the first two bytes of the SubFormat GUID
+                format_tag = struct.unpack_from("<H", data, body + 24)[0]
+            fmt = (format_tag, channels, rate, block_align, bits)
+        elif chunk_id == b"data":
+            # Streaming writers leave the size at 0 or 0xFFFFFFFF, so clamp to what arrived
+            end = min(body + chunk_size, len(data)) if chunk_size else len(data)
+            samples = memoryview(data)[body:end]
+            break
+        # Chunks are word aligned
+        offset = body + chunk_size + (chunk_size & 1)
+
+    if fmt is None or samples is None:
+        raise AudioFormatError("WAV payload is missing a fmt or data chunk")
+
+    format_tag, channels, rate, block_align, bits = fmt
+    if channels < 1 or rate < 1:
+        raise AudioFormatError("WAV header declares no channels or sample rate")
+    if bits not in WAV_BITS:
+        raise AudioFormatError(f"Unsupported WAV sample width ({bits}-bit)")
+    if block_align != channels * bits // 8:
+        raise AudioFormatError(f"WAV block align {block_align} does not match {channels} x {bits}-bit samples")
+
+    usable = len(samples) - len(samples) % block_align
+    samples = samples[:usable]
+    audio = _to_float32(samples, format_tag, bits)
+    return audio.reshape(-1, channels), rate
+
+
+def _to_float32(samples, format_tag: int, bits: int) -> np.ndarray:
+    if format_tag == WAVE_FORMAT_PCM:
+        if bits == 16:
+            return np.frombuffer(samples, dtype="<i2").astype(np.float32) / 32768.0
+        if bits == 8:
+            # 8-bit WAV is unsigned with a 128 midpoint
+            return (np.frombuffer(samples, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+        if bits == 24:
+            raw = np.frombuffer(samples, dtype=np.uint8).reshape(-1, 3)
+            packed = (raw[:, 0].astype(np.int32)
+                      | (raw[:, 1].astype(np.int32) << 8)
+                      | (raw[:, 2].astype(np.int32) << 16))
+            packed = np.where(packed & 0x800000, packed - 0x1000000, packed)
+            return packed.astype(np.float32) / 8388608.0
+        if bits == 32:
+            return np.frombuffer(samples, dtype="<i4").astype(np.float32) / 2147483648.0
+    elif format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if bits == 32:
+            return np.frombuffer(samples, dtype="<f4").astype(np.float32)
+        if bits == 64:
+            return np.frombuffer(samples, dtype="<f8").astype(np.float32)
+    raise AudioFormatError(f"Unsupported WAV encoding (format {format_tag:#06x}, {bits}-bit)")
+
+
+def pcm16_to_float32(data: bytes, channels: int = 1) -> np.ndarray:
+    """Interpret headerless little-endian int16 PCM as float32 (frames x channels)"""
+    usable = len(data) - len(data) % (2 * channels)
+    audio = np.frombuffer(memoryview(data)[:usable], dtype="<i2").astype(np.float32) / 32768.0
+    return audio.reshape(-1, channels)
+
+
+def pcm_to_float32(data: bytes, channels: int = 1, sample_format: str = "s16le") -> np.ndarray:
+    """Interpret headerless little-endian PCM in ``PCM_FORMATS`` as float32 (frames x channels)"""
+    if sample_format == "s16le":
+        return pcm16_to_float32(data, channels)
+    if sample_format not in PCM_FORMATS:
+        raise AudioFormatError(f"Unsupported PCM format '{sample_format}', use one of {sorted(PCM_FORMATS)}")
+    width = np.dtype(PCM_FORMATS[sample_format]).itemsize
+    usable = len(data) - len(data) % (width * channels)
+    audio = np.frombuffer(memoryview(data)[:usable], dtype=PCM_FORMATS[sample_format]).astype(np.float32)
+    return audio.reshape(-1, channels)
+
+
+def to_mono(audio: np.ndarray) -> np.ndarray:
+    if audio.ndim == 1:
+        return audio
+    if audio.shape[1] == 1:
+        return audio[:, 0]
+    return audio.mean(axis=1, dtype=np.float32)
+
+
+@lru_cache(maxsize=16)
+def _polyphase_filter(up: int, down: int) -> Tuple[np.ndarray, int]:
+    """Kaiser-windowed sinc low-pass for ``up``/``down`` resampling, split into its ``up`` phases.
+
+    Row r holds taps r, r + up, r + 2*up, ... reversed, so it multiplies
+    a window of input samples in ascending order. Returns (phases, delay).
+    """
+    cutoff = 1.0 / max(up, down)
+    half = RESAMPLE_ZERO_CROSSINGS * max(up, down)
+    k = np.arange(-half, half + 1)
+    taps = cutoff * np.sinc(cutoff * k) * np.kaiser(len(k), RESAMPLE_BETA) * up
+    per_phase = -(-len(taps) // up)
+    taps = np.pad(taps, (0, per_phase * up - len(taps)))
+    phases = taps.reshape(per_phase, up).T[:, ::-1]
+    return np.ascontiguousarray(phases, dtype=np.float32), half
+
+
+def resample(audio: np.ndarray, source_rate: int, target_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Polyphase windowed-sinc resampling of a mono signal.
+
+    Works through the output RESAMPLE_BLOCK samples at a time, so memory
+    beyond the result stays constant: an hour-long upload needs no
+    spectrum or upsampled copy of the whole signal. Every phase of a block
+    is one strided matrix-vector product over a view of the input.
+    """
+    if source_rate == target_rate or len(audio) == 0:
+        return audio.astype(np.float32, copy=False)
+    gcd = math.gcd(source_rate, target_rate)
+    up, down = target_rate // gcd, source_rate // gcd
+    phases, delay = _polyphase_filter(up, down)
+    width = phases.shape[1]
+    audio = np.asarray(audio, dtype=np.float32)
+    itemsize = audio.itemsize
+
+    target_length = int(round(len(audio) * target_rate / source_rate))
+    resampled = np.empty(target_length, dtype=np.float32)
+    # Whole periods of the phase pattern per block
+    step = up * max(1, RESAMPLE_BLOCK // up)
+    for start in range(0, target_length, step):
+        stop = min(start + step, target_length)
+        # Input this block reads, zero-padded past either end of the signal
+        low = (start * down + delay) // up - (width - 1)
+        high = ((stop - 1) * down + delay) // up + 1
+        segment = np.zeros(high - low, dtype=np.float32)
+        first, last = max(low, 0), min(high, len(audio))
+        if first < last:
+            segment[first - low:last - low] = audio[first:last]
+        for first_out in range(start, min(start + up, stop)):
+            # Outputs up apart share a phase and read inputs down apart
+            count = (stop - first_out + up - 1) // up
+            position = first_out * down + delay
+            window_start = position // up - (width - 1) - low
+            windows = as_strided(segment[window_start:], shape=(count, width), strides=(down * itemsize, itemsize))
+            resampled[first_out:stop:up] = windows @ phases[position % up]
+    return resampled
+
+
+def decode_audio(data: bytes, content_type: Optional[str] = None,
+                 sample_rate: Optional[int] = None, channels: Optional[int] = None,
+                 sample_format: Optional[str] = None) -> Optional[np.ndarray]:
+    """Decode WAV or raw PCM straight from request bytes.
+
+    Returns 16 kHz mono float32, or ``None`` when the payload is some other
+    (compressed) format that still needs the ffmpeg path. Raw PCM is only
+    assumed when the caller says so via the content type or an explicit
+    ``sample_rate`` or ``sample_format``; it defaults to int16.
+    """
+    media_type, params = parse_content_type(content_type)
+
+    if is_wav(data):
+        audio, rate = parse_wav(data)
+    elif media_type in PCM_CONTENT_TYPES or sample_rate is not None or sample_format is not None:
+        try:
+            rate = int(sample_rate or params.get("rate", SAMPLE_RATE))
+            channels = int(channels or params.get("channels", 1))
+        except ValueError:
+            raise AudioFormatError("PCM rate and channels must be integers")
+        if rate < 1 or channels < 1:
+            raise AudioFormatError("PCM rate and channels must be positive")
+        audio = pcm_to_float32(data, channels, sample_format or "s16le")
+    elif media_type in WAV_CONTENT_TYPES:
+        raise AudioFormatError("Content type says WAV but the payload has no RIFF header")
+    else:
+        return None
+
+    return resample(to_mono(audio), rate)
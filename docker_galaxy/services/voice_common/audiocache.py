@@ -0,0 +1,321 @@
+"""
+Synthesized audio cache
+Three tiers: an in-process LRU with a byte budget, a memory-mapped store on the models volume, and Redis
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "tts:audio:"
+
+Audio = Union[bytes, memoryview]
+
+
+def normalize_text(text: str) -> str:
+    """Fold the differences that never change the spoken result: Unicode form and whitespace"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def audio_key(text: str, model: str, speaker: Optional[str] = None, speed: Optional[float] = None,
+              language: Optional[str] = None, fmt: str = "wav") -> str:
+    """Hash the normalized text together with everything that changes the audio"""
+    digest = hashlib.blake2b(normalize_text(text).encode(), digest_size=20)
+    params = {"model": model, "speaker": speaker or "", "speed": speed or 1.0, "language": language or "", "format": fmt}
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return KEY_PREFIX + digest.hexdigest()
+
+
+def wav_info(data: Audio) -> Tuple[int, int, int]:
+    """(sample_rate, data offset, data bytes) of a 16-bit PCM WAV, read from its chunks"""
+    view = memoryview(data)
+    if bytes(view[:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        raise ValueError("Not a WAV file")
+    offset, sample_rate = 12, None
+    while offset + 8 <= len(view):
+        chunk, size = bytes(view[offset:offset + 4]), struct.unpack("<I", view[offset + 4:offset + 8])[0]
+        if chunk == b"fmt ":
+            sample_rate = struct.unpack("<I", view[offset + 12:offset + 16])[0]
+        elif chunk == b"data":
+            if sample_rate is None:
+                break
+            start = offset + 8
+            return sample_rate, start, min(size, len(view) - start)
+        offset += 8 + size + (size & 1)
+    raise ValueError("WAV has no fmt or data chunk")
+
+
+def wav_duration(data: Audio) -> Tuple[int, float]:
+    """(sample_rate, seconds) of a mono 16-bit PCM WAV"""
+    sample_rate, _, size = wav_info(data)
+    return sample_rate, size / (2 * sample_rate)
+
+
+class ByteLRU:
+    """Ordered-dict LRU bounded by total bytes, with per-entry expiry"""
+
+    def __init__(self, budget_bytes: int, ttl: float):
+        self.budget_bytes = budget_bytes
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.budget_bytes:
+            return
+        if key in self._items:
+            self._remove(key)
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self.bytes += len(value)
+        while self.bytes > self.budget_bytes:
+            evicted = self._remove(next(iter(self._items)))
+            self.evictions += 1
+            self.evicted_bytes += evicted
+
+    def _remove(self, key: str) -> int:
+        _, value = self._items.pop(key)
+        self.bytes -= len(value)
+        return len(value)
+
+
+class DiskStore:
+    """Audio files on the models volume, named by their cache key and read through mmap.
+
+    Hits are served straight from the mapping, so repeated lines come out of
+    the page cache shared by every process on the node and survive restarts.
+    Files are written whole and renamed into place. Like the Redis entries,
+    a file expires ``ttl`` seconds after it was written, and past
+    ``budget_bytes`` the oldest files are deleted. Every process sharing the
+    directory rebuilds its index from the files' mtimes and sizes at least
+    every ``rescan_seconds``, so the budget covers what the others wrote too.
+    """
+
+    def __init__(self, directory: str, budget_bytes: int, ttl: float, rescan_seconds: float = 60.0):
+        self.directory = Path(directory)
+        self.budget_bytes = budget_bytes
+        self.ttl = ttl
+        self.rescan_seconds = rescan_seconds
+        # digest -> (mtime, size), oldest first
+        self._index: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._scanned_at = 0.0
+        self.bytes = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.expirations = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._rescan()
+            self._evict(time.time())
+        logger.info(f"Audio cache on disk: {len(self._index)} files, {self.bytes >> 20} MB in {self.directory}")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / digest[:2] / f"{digest}.wav"
+
+    def _expired(self, mtime: float, now: float) -> bool:
+        return mtime + self.ttl < now
+
+    def get(self, key: str) -> Optional[memoryview]:
+        digest = key[len(KEY_PREFIX):]
+        try:
+            with open(self._path(digest), "rb") as f:
+                if self._expired(os.fstat(f.fileno()).st_mtime, time.time()):
+                    mapped = None
+                else:
+                    # The mapping outlives the file handle and is released with the view
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: an empty file cannot be mapped
+            return None
+        if mapped is None:
+            with self._lock:
+                self._delete(digest)
+                self.expirations += 1
+            return None
+        return memoryview(mapped)
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.budget_bytes:
+            return
+        digest = key[len(KEY_PREFIX):]
+        path = self._path(digest)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(value)
+        os.replace(tmp, path)
+        now = time.time()
+        with self._lock:
+            if time.monotonic() - self._scanned_at >= self.rescan_seconds:
+                self._rescan()
+            self.bytes -= self._index.pop(digest, (0.0, 0))[1]
+            self._index[digest] = (now, len(value))
+            self.bytes += len(value)
+            self._evict(now)
+
+    def _rescan(self):
+        """Rebuild the index from the directory, including files other processes wrote"""
+        entries = []
+        for path in self.directory.glob("*/*.wav"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((digest, (mtime, size)) for mtime, digest, size in entries)
+        self.bytes = sum(size for _, _, size in entries)
+        self._scanned_at = time.monotonic()
+
+    def _evict(self, now: float):
+        """Delete expired files, then the oldest until the rest fit the budget"""
+        while self._index:
+            digest, (mtime, size) = next(iter(self._index.items()))
+            if self._expired(mtime, now):
+                self.expirations += 1
+            elif self.bytes > self.budget_bytes:
+                self.evictions += 1
+                self.evicted_bytes += size
+            else:
+                break
+            self._delete(digest)
+
+    def _delete(self, digest: str):
+        self.bytes -= self._index.pop(digest, (0.0, 0))[1]
+        try:
+            self._path(digest).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class AudioCache:
+    """Looks audio up in memory, then on disk, then in Redis; tier failures count as misses.
+
+    A disk hit is served from its mapping and not copied into memory, since
+    the page cache already holds it. A Redis hit (another replica made it)
+    is copied into memory and onto disk. ``set`` writes every tier.
+    """
+
+    def __init__(self, memory_bytes: int = 64 << 20, ttl: int = 7 * 86400,
+                 disk_dir: Optional[str] = None, disk_bytes: int = 1 << 30):
+        self.memory = ByteLRU(memory_bytes, ttl)
+        self.ttl = ttl
+        self.redis = None
+        self.disk: Optional[DiskStore] = None
+        if disk_dir:
+            try:
+                self.disk = DiskStore(disk_dir, disk_bytes, ttl)
+            except OSError as e:
+                logger.warning(f"Audio cache disk tier disabled, {disk_dir} is not writable: {e}")
+        self.hits = {"memory": 0, "disk": 0, "redis": 0}
+        self.bytes_served = {"memory": 0, "disk": 0, "redis": 0}
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Tuple[Optional[Audio], str]:
+        """Return ``(audio, source)`` where source is memory, disk, redis or miss"""
+        audio: Optional[Audio] = self.memory.get(key)
+        source = "memory"
+
+        if audio is None and self.disk is not None:
+            try:
+                audio = self.disk.get(key)
+                source = "disk"
+            except OSError as e:
+                logger.warning(f"Disk audio cache read failed: {e}")
+                self.errors += 1
+
+        if audio is None and self.redis is not None:
+            try:
+                audio = await self.redis.get(key)
+                source = "redis"
+            except Exception as e:
+                logger.warning(f"Redis audio cache read failed: {e}")
+                self.errors += 1
+            if audio is not None:
+                self.memory.set(key, audio)
+                await self._write_disk(key, audio)
+
+        if audio is None:
+            self.misses += 1
+            return None, "miss"
+        self.hits[source] += 1
+        self.bytes_served[source] += len(audio)
+        return audio, source
+
+    async def set(self, key: str, audio: bytes):
+        self.memory.set(key, audio)
+        await self._write_disk(key, audio)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(key, audio, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Redis audio cache write failed: {e}")
+            self.errors += 1
+
+    async def _write_disk(self, key: str, audio: bytes):
+        if self.disk is None:
+            return
+        try:
+            await asyncio.to_thread(self.disk.set, key, audio)
+        except OSError as e:
+            logger.warning(f"Disk audio cache write failed: {e}")
+            self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(self.hits.values())
+        lookups = hits + self.misses
+        return {
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "bytes_served": dict(self.bytes_served),
+            "errors": self.errors,
+            "memory": {
+                "items": len(self.memory),
+                "bytes": self.memory.bytes,
+                "budget_bytes": self.memory.budget_bytes,
+                "evictions": self.memory.evictions,
+                "evicted_bytes": self.memory.evicted_bytes,
+            },
+            "redis_connected": self.redis is not None,
+            "disk": {
+                "files": len(self.disk),
+                "bytes": self.disk.bytes,
+                "budget_bytes": self.disk.budget_bytes,
+                "evictions": self.disk.evictions,
+                "evicted_bytes": self.disk.evicted_bytes,
+                "expirations": self.disk.expirations,
+            } if self.disk else None,
+        }
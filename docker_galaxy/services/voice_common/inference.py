@@ -0,0 +1,160 @@
+"""
+Inference executor for the voice services
+Runs blocking model calls on a bounded worker pool so the event loop stays responsive
+"""
+
+import asyncio
+import copy
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the executor has no free worker or queue slot"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+def cpu_limit() -> int:
+    """CPUs this process may use: the container's CPU quota if set, else its affinity mask"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota: Optional[float] = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        limit, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()[:2]
+        if limit != "max":
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            limit = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+            period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        # Round down: a fractional CPU is throttled, not an extra thread's worth
+        cpus = min(cpus, max(1, int(quota)))
+    return cpus
+
+
+class ModelReplicas:
+    """Hands each worker thread its own copy of a model.
+
+    Models keep per-call state on their modules (Whisper installs key/value
+    cache hooks on the decoder, Tacotron stores its attention and decoder
+    states), so two threads must never run the same instance. The first
+    thread reuses the loaded model; every other worker deep-copies it once.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._claimed = False
+        self.count = 1
+
+    def get(self):
+        replica = getattr(self._local, "model", None)
+        if replica is None:
+            with self._lock:
+                if not self._claimed:
+                    self._claimed = True
+                    replica = self.model
+                else:
+                    replica = copy.deepcopy(self.model)
+                    self.count += 1
+                    logger.info(f"Created model replica {self.count} for {threading.current_thread().name}")
+            self._local.model = replica
+        return replica
+
+
+class InferenceExecutor:
+    """Bounded thread pool for model calls.
+
+    At most ``workers`` calls run at once and at most ``max_queue`` more wait
+    for a worker. Anything beyond that is rejected immediately with
+    ``InferenceQueueFull`` instead of piling up behind the model.
+    """
+
+    def __init__(self, workers: int = 1, max_queue: int = 8, retry_after: int = 1, name: str = "inference"):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        # Only touched from the event loop thread, so no lock is needed
+        self._in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    @property
+    def running(self) -> int:
+        return min(self._in_flight, self.workers)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self._in_flight - self.workers)
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run ``fn`` on a worker thread, or raise if the queue is full"""
+        result, _, _ = await self.run_timed(fn, *args, **kwargs)
+        return result
+
+    async def run_timed(self, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, float, float]:
+        """Like ``run``, also returning seconds spent queued and running"""
+        if self._in_flight >= self.capacity:
+            self.rejected += 1
+            raise InferenceQueueFull(self.retry_after)
+
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+        submitted = time.perf_counter()
+        timing = {}
+
+        def call():
+            timing["started"] = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timing["finished"] = time.perf_counter()
+
+        future = self._pool.submit(call)
+        # Release the slot when the worker finishes, not when the caller stops
+        # waiting, so a disconnected client cannot free capacity it still uses
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        result = await asyncio.wrap_future(future)
+        return result, timing["started"] - submitted, timing["finished"] - timing["started"]
+
+    def _release(self):
+        self._in_flight -= 1
+        self.completed += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "mode": "thread",
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,237 @@
+"""
+Prometheus metrics for the voice services
+Per-stage latency histograms, real-time factor, queue depth and model memory, served at /metrics
+"""
+
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# queue_wait: waiting for a worker; decode: request bytes to samples (or text
+# ingest for TTS); inference: the model call; encode: response serialization
+STAGES = ("queue_wait", "decode", "inference", "encode", "total")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 180.0)
+SPEED_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 128.0)
+CHARS_BUCKETS = (10, 25, 50, 100, 200, 400, 800, 1600)
+
+STAGE_SECONDS = Histogram(
+    "voice_stage_seconds", "Time spent per request stage",
+    ["service", "endpoint", "stage"], buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter("voice_requests_total", "Requests by outcome", ["service", "endpoint", "status"])
+IN_FLIGHT = Gauge("voice_in_flight_requests", "Requests currently being handled", ["service"])
+QUEUED = Gauge("voice_queued_requests", "Requests waiting for an inference worker", ["service"])
+RUNNING = Gauge("voice_running_inferences", "Model calls currently executing", ["service"])
+REALTIME_FACTOR = Histogram(
+    "voice_realtime_factor", "Audio seconds processed or produced per second of inference",
+    ["service", "endpoint"], buckets=SPEED_BUCKETS
+)
+AUDIO_SECONDS = Counter("voice_audio_seconds_total", "Audio seconds processed or produced", ["service", "endpoint"])
+INFERENCE_SECONDS = Counter("voice_inference_seconds_total", "Seconds spent in model calls", ["service", "endpoint"])
+MODEL_MEMORY = Gauge("voice_model_memory_bytes", "Memory held by resident models", ["service", "model"])
+
+# Families only some services emit, registered when a service asks for their group
+OPTIONAL_METRICS: Dict[str, Callable[[], Dict[str, Any]]] = {
+    "text": lambda: {
+        "characters": Counter("tts_characters_total", "Input characters synthesized", ["service", "endpoint"]),
+        "characters_per_second": Histogram(
+            "tts_characters_per_second", "Input characters synthesized per second of inference",
+            ["service", "endpoint"], buckets=CHARS_BUCKETS
+        ),
+    },
+    "first_audio": lambda: {
+        "time_to_first_audio": Histogram(
+            "tts_time_to_first_audio_seconds", "Time from a streaming request to its first audio bytes",
+            ["service", "endpoint"], buckets=LATENCY_BUCKETS
+        ),
+    },
+    "coalescing": lambda: {
+        "coalesced": Counter(
+            "voice_coalesced_requests_total", "Requests answered by an identical request already in flight",
+            ["service", "endpoint"]
+        ),
+    },
+}
+_optional_families: Dict[str, Dict[str, Any]] = {}
+
+
+def optional_metrics(group: str) -> Dict[str, Any]:
+    """The families of ``group``, registered on first use"""
+    if group not in _optional_families:
+        _optional_families[group] = OPTIONAL_METRICS[group]()
+    return _optional_families[group]
+
+
+# Endpoint of the request being handled; tasks and to_thread calls inherit it
+_endpoint: ContextVar[str] = ContextVar("endpoint", default="background")
+
+
+class ServiceMetrics:
+    """Metric helpers bound to one service label.
+
+    Observations are a histogram bucket increment each, cheap enough to
+    leave on. ``track`` records the endpoint in a context variable, so code
+    deeper in the call chain observes stages without passing it along.
+    Gauges that mirror executor or registry state are refreshed by callbacks
+    registered with ``on_scrape``, so nothing is polled between scrapes.
+    Families only some services emit are registered for the ``optional``
+    groups the service names, so /metrics lists nothing it never reports.
+    """
+
+    def __init__(self, service: str, optional: Iterable[str] = ()):
+        self.service = service
+        self._optional: Dict[str, Any] = {}
+        for group in optional:
+            self._optional.update(optional_metrics(group))
+        self._scrape_hooks: List[Callable[["ServiceMetrics"], None]] = []
+        self._models: set = set()
+
+    def observe(self, stage: str, seconds: float, endpoint: Optional[str] = None):
+        STAGE_SECONDS.labels(self.service, endpoint or _endpoint.get(), stage).observe(seconds)
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def track(self, endpoint: str):
+        """Count the request, hold it in the in-flight gauge and time it end to end.
+
+        Yields a dict whose "status" the caller may set, e.g. to the HTTP status.
+        """
+        in_flight = IN_FLIGHT.labels(self.service)
+        in_flight.inc()
+        token = _endpoint.set(endpoint)
+        start = time.perf_counter()
+        outcome = {"status": "ok"}
+        try:
+            yield outcome
+        except BaseException as e:
+            outcome["status"] = str(getattr(e, "status_code", "") or "error")
+            raise
+        finally:
+            in_flight.dec()
+            self.observe("total", time.perf_counter() - start, endpoint)
+            REQUESTS.labels(self.service, endpoint, str(outcome["status"])).inc()
+            _endpoint.reset(token)
+
+    def observe_inference(self, queue_wait: float, inference_seconds: float):
+        self.observe("queue_wait", queue_wait)
+        self.observe("inference", inference_seconds)
+
+    def observe_audio(self, audio_seconds: float, inference_seconds: float):
+        endpoint = _endpoint.get()
+        AUDIO_SECONDS.labels(self.service, endpoint).inc(audio_seconds)
+        INFERENCE_SECONDS.labels(self.service, endpoint).inc(inference_seconds)
+        if inference_seconds > 0 and audio_seconds > 0:
+            REALTIME_FACTOR.labels(self.service, endpoint).observe(audio_seconds / inference_seconds)
+
+    def observe_text(self, characters: int, inference_seconds: float):
+        endpoint = _endpoint.get()
+        self._optional["characters"].labels(self.service, endpoint).inc(characters)
+        if inference_seconds > 0:
+            self._optional["characters_per_second"].labels(self.service, endpoint).observe(characters / inference_seconds)
+
+    def observe_first_audio(self, seconds: float, endpoint: Optional[str] = None):
+        self._optional["time_to_first_audio"].labels(self.service, endpoint or _endpoint.get()).observe(seconds)
+
+    def observe_coalesced(self):
+        self._optional["coalesced"].labels(self.service, _endpoint.get()).inc()
+
+    def set_queue(self, running: int, queued: int):
+        RUNNING.labels(self.service).set(running)
+        QUEUED.labels(self.service).set(queued)
+
+    def set_model_memory(self, memory: Dict[str, float]):
+        """Replace the per-model memory gauges, dropping evicted models"""
+        for model in self._models - memory.keys():
+            MODEL_MEMORY.remove(self.service, model)
+        for model, size in memory.items():
+            MODEL_MEMORY.labels(self.service, model).set(size)
+        self._models = set(memory)
+
+    def on_scrape(self, hook: Callable[["ServiceMetrics"], None]):
+        """Register ``hook`` to refresh gauges before each scrape; usable as a decorator"""
+        self._scrape_hooks.append(hook)
+        return hook
+
+    def render(self) -> bytes:
+        for hook in self._scrape_hooks:
+            hook(self)
+        return generate_latest()
+
+
+class RequestTimer:
+    """Pure ASGI middleware that counts and times every HTTP request.
+
+    The "total" stage ends when the last body message is sent, not when the
+    handler returns, so a StreamingResponse is timed until its final chunk.
+    Being plain ASGI, it adds no task or body queue per request the way
+    BaseHTTPMiddleware does.
+    """
+
+    def __init__(self, app, metrics: "ServiceMetrics", routes_app: FastAPI, skip: Iterable[str]):
+        self.app = app
+        self.metrics = metrics
+        self.routes_app = routes_app
+        self.skip = set(skip)
+        self.paths: set = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip:
+            await self.app(scope, receive, send)
+            return
+        if not self.paths:
+            # Label by route; parameterized paths collapse into "other"
+            self.paths.update(r.path for r in self.routes_app.routes if "{" not in getattr(r, "path", "{"))
+        endpoint = scope["path"] if scope["path"] in self.paths else "other"
+        service = self.metrics.service
+        in_flight = IN_FLIGHT.labels(service)
+        in_flight.inc()
+        token = _endpoint.set(endpoint)
+        start = time.perf_counter()
+        state = {"status": None, "done": False}
+
+        def finish(status):
+            if state["done"]:
+                return
+            state["done"] = True
+            in_flight.dec()
+            self.metrics.observe("total", time.perf_counter() - start, endpoint)
+            REQUESTS.labels(service, endpoint, str(status)).inc()
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish(state["status"])
+
+        try:
+            await self.app(scope, receive, send_timed)
+        except BaseException as e:
+            finish(state["status"] or str(getattr(e, "status_code", "") or "error"))
+            raise
+        finally:
+            # Still open if the client left before the last chunk
+            finish(state["status"] or "error")
+            _endpoint.reset(token)
+
+
+def instrument(app: FastAPI, metrics: ServiceMetrics, skip=("/metrics", "/health", "/livez", "/readyz")):
+    """Time every HTTP request and serve the registry at /metrics"""
+    app.add_middleware(RequestTimer, metrics=metrics, routes_app=app, skip=skip)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        return Response(metrics.render(), media_type=CONTENT_TYPE_LATEST)
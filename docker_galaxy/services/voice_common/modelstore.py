@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Local Whisper checkpoint store
+Loads checkpoints from a pre-populated models volume, verifies their checksums and memory-maps the weights
+
+Usage:
+    python -m voice_common.modelstore prepare --sizes base,small --models-dir /app/models
+    python -m voice_common.modelstore verify --models-dir /app/models
+"""
+
+import argparse
+import hashlib
+import logging
+import mmap
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import torch
+import whisper
+from whisper.model import AudioEncoder, ModelDimensions, TextDecoder, Whisper
+
+logger = logging.getLogger(__name__)
+
+# sha256sum-format list of the files on the volume, written by "prepare"
+CHECKSUMS_FILE = "SHA256SUMS"
+# Published checkpoints are fp16; CPU inference needs fp32, so "prepare"
+# stores an fp32 copy that can be mapped and used without conversion
+FP32_SUFFIX = "-fp32.pt"
+HASH_CHUNK = 1 << 24
+
+# Files already hashed by this process, keyed by path -> (size, mtime)
+_verified: Dict[Path, Tuple[int, int]] = {}
+_verified_lock = threading.Lock()
+
+
+class ModelUnavailable(RuntimeError):
+    """Raised when a checkpoint is not on the volume and downloads are off"""
+
+
+class ChecksumMismatch(RuntimeError):
+    """Raised when a checkpoint does not hash to its recorded checksum"""
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(view), HASH_CHUNK):
+                    digest.update(view[offset:offset + HASH_CHUNK])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def read_checksums(models_dir: str) -> Dict[str, str]:
+    path = Path(models_dir) / CHECKSUMS_FILE
+    sums = {}
+    if path.exists():
+        for line in path.read_text().splitlines():
+            parts = line.split(maxsplit=1)
+            if len(parts) == 2:
+                sums[parts[1].strip().lstrip("*")] = parts[0].lower()
+    return sums
+
+
+def write_checksums(models_dir: str) -> Dict[str, str]:
+    root = Path(models_dir)
+    sums = {path.name: sha256_file(path) for path in sorted(root.glob("*.pt"))}
+    tmp = root / (CHECKSUMS_FILE + ".tmp")
+    tmp.write_text("".join(f"{digest}  {name}\n" for name, digest in sums.items()))
+    os.replace(tmp, root / CHECKSUMS_FILE)
+    return sums
+
+
+def published_sha256(size: str) -> Optional[str]:
+    """Whisper's download URLs embed the checkpoint's sha256"""
+    url = whisper._MODELS.get(size)
+    return url.split("/")[-2] if url else None
+
+
+def verify(path: Path, expected: Optional[str]):
+    """Hash ``path`` and compare; each unchanged file is hashed once per process"""
+    stat = path.stat()
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _verified_lock:
+        if _verified.get(path) == key:
+            return
+    if expected is None:
+        logger.warning(f"No checksum recorded for {path.name}; run 'python -m voice_common.modelstore prepare' to add one")
+        return
+    start = time.perf_counter()
+    actual = sha256_file(path)
+    if actual != expected:
+        raise ChecksumMismatch(f"{path} has sha256 {actual}, expected {expected}")
+    with _verified_lock:
+        _verified[path] = key
+    logger.info(f"Verified {path.name} in {time.perf_counter() - start:.1f}s")
+
+
+def original_path(models_dir: str, size: str) -> Path:
+    url = whisper._MODELS.get(size)
+    return Path(models_dir) / (os.path.basename(url) if url else f"{size}.pt")
+
+
+def fp32_path(models_dir: str, size: str) -> Path:
+    return Path(models_dir) / f"{size}{FP32_SUFFIX}"
+
+
+def read_checkpoint(path: Path) -> dict:
+    try:
+        # Tensors stay backed by the file's pages until something writes them
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except RuntimeError as e:
+        # Only zipfile-format checkpoints can be mapped
+        logger.warning(f"Cannot memory-map {path.name}, reading it instead: {e}")
+        return torch.load(path, map_location="cpu", weights_only=True)
+
+
+def build_model(checkpoint: dict, size: str, assign: bool) -> Whisper:
+    """Whisper from a checkpoint; with ``assign`` the checkpoint's tensors become the weights"""
+    dims = ModelDimensions(**checkpoint["dims"])
+    if assign:
+        # Build the encoder and decoder on the meta device so no weights are
+        # allocated or initialized only to be replaced by the mapped ones.
+        # Whisper.__init__ itself cannot run there (it builds a sparse buffer).
+        model = Whisper.__new__(Whisper)
+        torch.nn.Module.__init__(model)
+        model.dims = dims
+        with torch.device("meta"):
+            model.encoder = AudioEncoder(
+                dims.n_mels, dims.n_audio_ctx, dims.n_audio_state, dims.n_audio_head, dims.n_audio_layer
+            )
+            model.decoder = TextDecoder(
+                dims.n_vocab, dims.n_text_ctx, dims.n_text_state, dims.n_text_head, dims.n_text_layer
+            )
+        model.load_state_dict(checkpoint["model_state_dict"], assign=True)
+        # Non-persistent buffers are not in the checkpoint: rebuild them as Whisper does
+        model.decoder.register_buffer(
+            "mask", torch.empty(dims.n_text_ctx, dims.n_text_ctx).fill_(-float("inf")).triu_(1), persistent=False
+        )
+        heads = torch.zeros(dims.n_text_layer, dims.n_text_head, dtype=torch.bool)
+        heads[dims.n_text_layer // 2:] = True
+        model.register_buffer("alignment_heads", heads.to_sparse(), persistent=False)
+        if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+            logger.warning("Checkpoint did not cover every tensor, loading by copy")
+            return build_model(checkpoint, size, assign=False)
+    else:
+        model = Whisper(dims)
+        model.load_state_dict(checkpoint["model_state_dict"])
+
+    if size in whisper._ALIGNMENT_HEADS:
+        model.set_alignment_heads(whisper._ALIGNMENT_HEADS[size])
+    return model
+
+
+def load(size: str, device: str = "cpu", models_dir: Optional[str] = None,
+         verify_checksums: bool = True, allow_download: bool = True) -> Whisper:
+    """Load ``size`` from the models volume, preferring the prepared fp32 copy on CPU.
+
+    Checkpoints are verified against SHA256SUMS, or for published ones the
+    hash in Whisper's download URL. Missing checkpoints are downloaded only
+    when ``allow_download`` is set.
+    """
+    root = Path(models_dir or os.path.join(os.path.expanduser("~"), ".cache", "whisper"))
+    prepared = fp32_path(root, size)
+    if device == "cpu" and prepared.exists():
+        path, assign = prepared, True
+    else:
+        path, assign = original_path(root, size), False
+        if not path.exists():
+            if not allow_download:
+                raise ModelUnavailable(f"{path} is not on the models volume and downloads are disabled")
+            logger.warning(f"{path.name} is not on the models volume, downloading it")
+            return whisper.load_model(size, device=device, download_root=str(root))
+
+    if verify_checksums:
+        expected = read_checksums(root).get(path.name)
+        verify(path, expected or (None if assign else published_sha256(size)))
+
+    start = time.perf_counter()
+    model = build_model(read_checkpoint(path), size, assign)
+    logger.info(f"Loaded {path.name} in {time.perf_counter() - start:.2f}s{' (mapped)' if assign else ''}")
+    return model.to(device)
+
+
+def prepare(size: str, models_dir: str):
+    """Fetch the published checkpoint if needed and write its fp32 copy next to it"""
+    original = original_path(models_dir, size)
+    if not original.exists():
+        whisper.load_model(size, device="cpu", download_root=models_dir)
+    checkpoint = torch.load(original, map_location="cpu", weights_only=True)
+    state = {k: v.float() if v.is_floating_point() else v for k, v in checkpoint["model_state_dict"].items()}
+    target = fp32_path(models_dir, size)
+    # Write then rename so a crash never leaves a truncated checkpoint behind
+    tmp = target.with_suffix(".tmp")
+    torch.save({"dims": checkpoint["dims"], "model_state_dict": state}, tmp)
+    os.replace(tmp, target)
+    logger.info(f"Wrote {target}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Whisper models volume tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    prep = sub.add_parser("prepare", help="Download, convert to fp32 and checksum checkpoints for the volume")
+    prep.add_argument("--sizes", default=os.getenv("MODEL_SIZE", "base"))
+    prep.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "/app/models"))
+
+    check = sub.add_parser("verify", help="Check every file listed in SHA256SUMS")
+    check.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "/app/models"))
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    if args.command == "prepare":
+        for size in args.sizes.split(","):
+            prepare(size.strip(), args.models_dir)
+        for name, digest in write_checksums(args.models_dir).items():
+            print(f"{digest}  {name}")
+    else:
+        sums = read_checksums(args.models_dir)
+        if not sums:
+            sys.exit(f"No {CHECKSUMS_FILE} in {args.models_dir}")
+        failed = False
+        for name, digest in sums.items():
+            try:
+                verify(Path(args.models_dir) / name, digest)
+                print(f"{name}: OK")
+            except (ChecksumMismatch, OSError) as e:
+                print(f"{name}: FAILED ({e})")
+                failed = True
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Pre-forked inference workers
+The parent loads the model once and forks N processes that share its weights copy-on-write
+"""
+
+import asyncio
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PoolFull(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Worker pool is full")
+        self.retry_after = retry_after
+
+
+class WorkerDied(RuntimeError):
+    """Raised when a worker process exits in the middle of a call"""
+
+
+def _detach_signals():
+    # The parent owns shutdown; uvicorn's signal wakeup fd must not be shared
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _zygote_main(control, initializer: Optional[Callable[[], None]]):
+    """Fork a worker for every index the parent sends and hand back (pid, pipe)"""
+    _detach_signals()
+    # Workers are reaped as soon as they exit; the parent only talks to them over pipes
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            index = control.recv()
+        except EOFError:
+            break
+        if index is None:
+            break
+        parent_conn, child_conn = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            parent_conn.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                _worker_main(child_conn, initializer)
+            except BaseException:
+                logger.exception(f"Inference worker {index} crashed")
+                os._exit(1)
+            os._exit(0)
+        child_conn.close()
+        control.send(pid)
+        reduction.send_handle(control, parent_conn.fileno(), os.getppid())
+        parent_conn.close()
+    control.close()
+
+
+def _worker_main(conn, initializer: Optional[Callable[[], None]]):
+    if initializer:
+        initializer()
+    # Tells the parent the worker is set up and warm
+    conn.send(None)
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        fn, args, kwargs = message
+        try:
+            conn.send((True, fn(*args, **kwargs)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+class _Worker:
+    def __init__(self, index: int, pid: int, conn: Connection):
+        self.index = index
+        self.pid = pid
+        self.conn = conn
+
+    def call(self, payload: Tuple[Callable, tuple, dict]) -> Any:
+        try:
+            self.conn.send(payload)
+            ok, value = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerDied(f"Worker {self.index} (pid {self.pid}) died") from e
+        if not ok:
+            raise RuntimeError(value)
+        return value
+
+    def wait_ready(self):
+        """Block until the worker's initializer has finished"""
+        try:
+            self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerDied(f"Worker {self.index} (pid {self.pid}) failed to start") from e
+
+    def stop(self, timeout: float = 5.0):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        # A child of the zygote, not of this process, so it cannot be joined
+        deadline = time.monotonic() + timeout
+        while _alive(self.pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if _alive(self.pid):
+            os.kill(self.pid, signal.SIGTERM)
+        self.conn.close()
+
+
+class PreforkPool:
+    """Dispatches calls to forked worker processes over pipes.
+
+    Call ``start`` after the model is loaded. It forks a zygote process from
+    that state, and the zygote forks every worker, so the weights are shared
+    copy-on-write rather than loaded N times. A worker that dies is replaced
+    from the zygote too: the replacement starts from the same clean state
+    instead of inheriting the server's later threads, locks and connections.
+    The callable and its arguments are pickled by reference, so ``fn`` must be
+    a module-level function that reads the model from a module global.
+
+    The parent must not run any torch op before ``start``: once torch's
+    OpenMP threads exist, a forked child hangs on its first parallel op. Keep
+    the parent at one thread until then and warm the model up in
+    ``initializer``, which every worker runs before taking calls. ``start``
+    blocks until all of them are ready, so call it from a thread.
+
+    Admission matches the thread executor: ``workers`` calls run at once, up to
+    ``max_queue`` more wait, and the rest get ``full_error`` immediately.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 8, retry_after: int = 1,
+                 full_error: Callable[[int], Exception] = PoolFull,
+                 initializer: Optional[Callable[[], None]] = None):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.retry_after = retry_after
+        self.full_error = full_error
+        self.initializer = initializer
+        self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefork-dispatch")
+        self._zygote: Optional[multiprocessing.Process] = None
+        self._control: Optional[Connection] = None
+        self._control_lock = threading.Lock()
+        self._pool: List[_Worker] = []
+        # Indices into _pool, so a replaced worker takes over its slot
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+        self.restarts = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    def start(self):
+        # Move existing objects out of the collector's reach so collections in
+        # the children don't write to their headers and unshare those pages
+        gc.freeze()
+        self._control, zygote_conn = multiprocessing.Pipe()
+        self._zygote = multiprocessing.get_context("fork").Process(
+            target=_zygote_main,
+            args=(zygote_conn, self.initializer),
+            name="inference-zygote",
+            daemon=True
+        )
+        self._zygote.start()
+        zygote_conn.close()
+        self._pool = [self._spawn(index) for index in range(self.workers)]
+        # The workers run their initializers in parallel
+        for worker in self._pool:
+            worker.wait_ready()
+            self._idle.put_nowait(worker.index)
+        logger.info(f"Forked {self.workers} inference workers: {[w.pid for w in self._pool]}")
+
+    def _spawn(self, index: int) -> _Worker:
+        """Have the zygote fork a worker; blocks for the fork and the pipe hand-off"""
+        with self._control_lock:
+            try:
+                self._control.send(index)
+                pid = self._control.recv()
+                fd = reduction.recv_handle(self._control)
+            except (EOFError, OSError) as e:
+                raise WorkerDied(f"Inference zygote (pid {self._zygote.pid}) died") from e
+        return _Worker(index, pid, Connection(fd))
+
+    def _call(self, index: int, payload: Tuple[Callable, tuple, dict]) -> Any:
+        worker = self._pool[index]
+        try:
+            return worker.call(payload)
+        except WorkerDied:
+            logger.error(f"Inference worker {index} (pid {worker.pid}) died, forking a replacement")
+            worker.stop(timeout=0)
+            replacement = self._spawn(index)
+            replacement.wait_ready()
+            self._pool[index] = replacement
+            self.restarts += 1
+            raise
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run ``fn`` in a worker process, or raise if the queue is full"""
+        result, _, _ = await self.run_timed(fn, *args, **kwargs)
+        return result
+
+    async def run_timed(self, fn: Callable[..., Any], *args, **kwargs) -> Tuple[Any, float, float]:
+        """Like ``run``, also returning seconds spent waiting for a worker and running"""
+        if self._in_flight >= self.capacity:
+            self.rejected += 1
+            raise self.full_error(self.retry_after)
+
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+        submitted = time.perf_counter()
+        try:
+            index = await self._idle.get()
+        except BaseException:
+            self._in_flight -= 1
+            raise
+
+        started = time.perf_counter()
+        future = self._threads.submit(self._call, index, (fn, args, kwargs))
+        # Hand the worker back only once its reply has been read, even if the
+        # caller gave up, so two requests never share one pipe
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._release, index))
+        result = await asyncio.wrap_future(future)
+        # Includes pickling the arguments and result over the pipe
+        return result, started - submitted, time.perf_counter() - started
+
+    def _release(self, index: int):
+        self._in_flight -= 1
+        self.completed += 1
+        self._idle.put_nowait(index)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": "prefork",
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": min(self._in_flight, self.workers),
+            "queued": max(0, self._in_flight - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+            "pids": [w.pid for w in self._pool],
+            "zygote_pid": self._zygote.pid if self._zygote else None,
+        }
+
+    def shutdown(self):
+        for worker in self._pool:
+            worker.stop()
+        self._pool = []
+        if self._zygote:
+            try:
+                self._control.send(None)
+            except OSError:
+                pass
+            self._zygote.join(timeout=5)
+            if self._zygote.is_alive():
+                self._zygote.terminate()
+            self._control.close()
+            self._zygote = None
+        self._threads.shutdown(wait=False, cancel_futures=True)
+
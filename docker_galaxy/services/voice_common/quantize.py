@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Int8 dynamic quantization for Whisper on CPU
+Loads (and caches) quantized checkpoints, and compares them against fp32 on a local corpus
+
+Usage:
+    python -m voice_common.quantize compare --corpus /app/models/corpus --sizes tiny,base,small
+    python -m voice_common.quantize build --sizes base
+"""
+
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+import whisper
+from whisper.model import ModelDimensions, Whisper
+from whisper.normalizers import EnglishTextNormalizer
+
+from . import modelstore
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_SUFFIX = "-int8-dynamic.pt"
+
+
+def quantized_path(models_dir: str, size: str) -> Path:
+    # Tie the cache file to the torch version: packed int8 weights are not portable
+    return Path(models_dir) / f"{size}-torch{torch.__version__.split('+')[0]}{QUANTIZED_SUFFIX}"
+
+
+def quantize_model(model: "whisper.Whisper") -> "whisper.Whisper":
+    """Apply dynamic int8 quantization to every Linear layer"""
+    # Whisper subclasses nn.Linear only to cast weights to the input dtype,
+    # and quantize_dynamic matches exact types, so demote them to plain Linear
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear) and type(module) is not torch.nn.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_quantized(path: Path, size: str) -> "whisper.Whisper":
+    """Rebuild a quantized model from its cached state_dict, without unpickling arbitrary objects"""
+    checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+    model = quantize_model(Whisper(ModelDimensions(**checkpoint["dims"])))
+    model.load_state_dict(checkpoint["model_state_dict"])
+    if size in whisper._ALIGNMENT_HEADS:
+        model.set_alignment_heads(whisper._ALIGNMENT_HEADS[size])
+    return model
+
+
+def load_whisper(size: str, device: str = "cpu", quantize: bool = False,
+                 models_dir: Optional[str] = None, verify: bool = True,
+                 allow_download: bool = True) -> "whisper.Whisper":
+    """Load a Whisper model from the models volume, optionally int8-quantized from the on-disk cache"""
+    def load_fp32(device: str) -> "whisper.Whisper":
+        return modelstore.load(size, device, models_dir, verify, allow_download)
+
+    if not quantize:
+        return load_fp32(device)
+    if device != "cpu":
+        logger.warning(f"Int8 quantization is CPU-only; loading fp32 {size} on {device}")
+        return load_fp32(device)
+
+    cached = quantized_path(models_dir, size) if models_dir else None
+    if cached and cached.exists():
+        try:
+            expected = modelstore.read_checksums(models_dir).get(cached.name)
+            if verify and expected:
+                modelstore.verify(cached, expected)
+            model = load_quantized(cached, size)
+            model.eval()
+            logger.info(f"Loaded cached int8 model from {cached}")
+            return model
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable quantized checkpoint {cached}: {e}")
+
+    start = time.perf_counter()
+    model = quantize_model(load_fp32("cpu"))
+    model.eval()
+    logger.info(f"Quantized {size} to int8 in {time.perf_counter() - start:.1f}s")
+
+    if cached:
+        try:
+            # Write then rename so a crash never leaves a truncated checkpoint behind
+            tmp = cached.with_suffix(".tmp")
+            torch.save({"dims": dataclasses.asdict(model.dims), "model_state_dict": model.state_dict()}, tmp)
+            os.replace(tmp, cached)
+            logger.info(f"Cached int8 model at {cached}")
+        except OSError as e:
+            logger.warning(f"Could not cache quantized model: {e}")
+    return model
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Levenshtein distance over normalized words, divided by reference length"""
+    normalizer = EnglishTextNormalizer()
+    ref = normalizer(reference).split()
+    hyp = normalizer(hypothesis).split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word)
+            )
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def resident_memory_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def load_corpus(corpus_dir: str) -> List[Dict]:
+    """Audio files with optional same-named .txt reference transcripts"""
+    from .audio import decode_audio
+
+    clips = []
+    for path in sorted(Path(corpus_dir).iterdir()):
+        if path.suffix.lower() not in {".wav", ".flac", ".mp3", ".ogg", ".m4a"}:
+            continue
+        data = path.read_bytes()
+        audio = decode_audio(data) if path.suffix.lower() == ".wav" else None
+        if audio is None:
+            audio = whisper.load_audio(str(path))
+        reference = path.with_suffix(".txt")
+        clips.append({
+            "name": path.name,
+            "audio": audio,
+            "reference": reference.read_text().strip() if reference.exists() else None
+        })
+    return clips
+
+
+def measure(size: str, quantize: bool, corpus_dir: str, models_dir: str, language: str) -> Dict:
+    """Run the corpus through one model variant; meant to run in its own process"""
+    baseline_rss = resident_memory_mb()
+    load_start = time.perf_counter()
+    model = load_whisper(size, "cpu", quantize, models_dir)
+    load_time = time.perf_counter() - load_start
+    model_rss = resident_memory_mb() - baseline_rss
+
+    clips = load_corpus(corpus_dir)
+    hypotheses = {}
+    audio_seconds = 0.0
+    compute_seconds = 0.0
+    for clip in clips:
+        start = time.perf_counter()
+        result = model.transcribe(clip["audio"], language=language, fp16=False)
+        compute_seconds += time.perf_counter() - start
+        audio_seconds += len(clip["audio"]) / whisper.audio.SAMPLE_RATE
+        hypotheses[clip["name"]] = result["text"].strip()
+
+    scored = [c for c in clips if c["reference"]]
+    wer = (sum(word_error_rate(c["reference"], hypotheses[c["name"]]) for c in scored) / len(scored)) if scored else None
+    return {
+        "size": size,
+        "variant": "int8" if quantize else "fp32",
+        "load_seconds": round(load_time, 3),
+        "rss_mb": round(model_rss, 1),
+        "peak_rss_mb": round(resident_memory_mb(), 1),
+        "audio_seconds": round(audio_seconds, 3),
+        "compute_seconds": round(compute_seconds, 3),
+        "rtf": round(compute_seconds / audio_seconds, 4) if audio_seconds else None,
+        "wer": round(wer, 4) if wer is not None else None,
+        "hypotheses": hypotheses,
+    }
+
+
+def compare(sizes: List[str], corpus_dir: str, models_dir: str, language: str, threads: Optional[int]) -> List[Dict]:
+    rows = []
+    for size in sizes:
+        variants = {}
+        for variant in ("fp32", "int8"):
+            # Separate processes so each variant's resident memory is measured cleanly
+            cmd = [sys.executable, "-m", __spec__.name, "_measure", "--size", size, "--variant", variant,
+                   "--corpus", corpus_dir, "--models-dir", models_dir, "--language", language]
+            if threads:
+                cmd += ["--threads", str(threads)]
+            output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            variants[variant] = json.loads(output.strip().splitlines()[-1])
+
+        fp32, int8 = variants["fp32"], variants["int8"]
+        # How far int8 output drifts from fp32 output; needs no reference transcripts
+        agreement = [word_error_rate(fp32["hypotheses"][name], int8["hypotheses"][name]) for name in fp32["hypotheses"]]
+        rows.append({
+            "size": size,
+            "fp32": {k: v for k, v in fp32.items() if k != "hypotheses"},
+            "int8": {k: v for k, v in int8.items() if k != "hypotheses"},
+            "wer_delta": round(int8["wer"] - fp32["wer"], 4) if fp32["wer"] is not None else None,
+            "int8_vs_fp32_wer": round(sum(agreement) / len(agreement), 4) if agreement else None,
+            "speedup": round(fp32["rtf"] / int8["rtf"], 2) if fp32["rtf"] and int8["rtf"] else None,
+        })
+    return rows
+
+
+def print_table(rows: List[Dict]):
+    header = f"{'size':<10}{'variant':<9}{'load s':>8}{'RSS MB':>9}{'RTF':>9}{'WER':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        for variant in ("fp32", "int8"):
+            r = row[variant]
+            wer = f"{r['wer']:.3f}" if r["wer"] is not None else "-"
+            print(f"{row['size']:<10}{variant:<9}{r['load_seconds']:>8.2f}{r['rss_mb']:>9.0f}{r['rtf']:>9.3f}{wer:>8}")
+        delta = f"{row['wer_delta']:+.3f}" if row["wer_delta"] is not None else "n/a"
+        print(f"{'':<10}speedup x{row['speedup']}, WER delta {delta}, int8 vs fp32 WER {row['int8_vs_fp32_wer']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Whisper int8 quantization tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Quantize and cache checkpoints ahead of deployment")
+    build.add_argument("--sizes", default=os.getenv("MODEL_SIZE", "base"))
+    build.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "/app/models"))
+
+    cmp_parser = sub.add_parser("compare", help="Report WER delta, RTF and RSS of fp32 vs int8")
+    cmp_parser.add_argument("--corpus", required=True, help="Directory of audio files with optional .txt references")
+    cmp_parser.add_argument("--sizes", default="tiny,base,small")
+    cmp_parser.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "/app/models"))
+    cmp_parser.add_argument("--language", default=os.getenv("LANGUAGE", "en"))
+    cmp_parser.add_argument("--threads", type=int, default=None)
+    cmp_parser.add_argument("--output", help="Write the JSON report here")
+
+    measure_parser = sub.add_parser("_measure")
+    measure_parser.add_argument("--size", required=True)
+    measure_parser.add_argument("--variant", choices=["fp32", "int8"], required=True)
+    measure_parser.add_argument("--corpus", required=True)
+    measure_parser.add_argument("--models-dir", required=True)
+    measure_parser.add_argument("--language", default="en")
+    measure_parser.add_argument("--threads", type=int, default=None)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    if args.command == "build":
+        for size in args.sizes.split(","):
+            load_whisper(size.strip(), "cpu", True, args.models_dir)
+    elif args.command == "_measure":
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        result = measure(args.size, args.variant == "int8", args.corpus, args.models_dir, args.language)
+        print(json.dumps(result))
+    else:
+        rows = compare([s.strip() for s in args.sizes.split(",")], args.corpus, args.models_dir, args.language, args.threads)
+        print_table(rows)
+        if args.output:
+            Path(args.output).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Startup state for the voice services
+Runs model loading in the background and serves /livez and /readyz from its progress
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """Tracks background startup: starting -> <step>... -> ready, or failed.
+
+    The server accepts connections as soon as the process is up, so liveness
+    and readiness are separate: /livez answers while models load and fails
+    only if startup failed, /readyz and ``require`` only pass once every
+    startup step has finished.
+    """
+
+    def __init__(self, retry_after: int = 5):
+        self.retry_after = retry_after
+        self.state = "starting"
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self.steps: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @contextmanager
+    def step(self, name: str):
+        """Report ``name`` as the current state and record how long it took"""
+        self.state = name
+        start = time.perf_counter()
+        yield
+        self.steps[name] = round(time.perf_counter() - start, 3)
+
+    def start(self, startup: Awaitable) -> asyncio.Task:
+        """Run ``startup`` as a task; the service is ready when it returns"""
+        async def run():
+            try:
+                await startup
+            except Exception as e:
+                self.state, self.error = "failed", f"{self.state}: {e}"
+                logger.exception(f"Startup failed while {self.error}")
+                return
+            self.state, self.ready_at = "ready", time.time()
+            logger.info(f"Ready after {self.ready_at - self.started_at:.1f}s {self.steps}")
+
+        self._task = asyncio.create_task(run())
+        return self._task
+
+    async def cancel(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def require(self):
+        """Raise 503 with Retry-After until startup has finished"""
+        if not self.ready:
+            detail = f"Service is {self.state}" + (f" ({self.error})" if self.error else "")
+            raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(self.retry_after)})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "startup_seconds": round(self.ready_at - self.started_at, 3) if self.ready_at else None,
+            "steps": self.steps,
+        }
+
+
+def install_probes(app: FastAPI, readiness: Readiness):
+    """Serve /livez (the process is up and startup has not failed) and /readyz (models loaded, safe to route traffic)"""
+
+    @app.get("/livez", include_in_schema=False)
+    async def livez():
+        if readiness.state == "failed":
+            # Loading will not be retried in this process; let the orchestrator restart it
+            return JSONResponse({"status": "failed", "error": readiness.error}, status_code=503)
+        return {"status": "alive"}
+
+    @app.get("/readyz", include_in_schema=False)
+    async def readyz():
+        if readiness.ready:
+            return {"status": "ready", **readiness.stats()}
+        return JSONResponse(
+            {"status": readiness.state, **readiness.stats()},
+            status_code=503,
+            headers={"Retry-After": str(readiness.retry_after)}
+        )
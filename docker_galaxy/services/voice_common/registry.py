@@ -0,0 +1,193 @@
+"""
+Whisper model registry
+Loads model sizes on first use and keeps them inside a memory budget with LRU eviction
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Approximate parameter counts, used to make room before a model is loaded
+PARAMETER_COUNTS = {
+    "tiny": 39e6, "base": 74e6, "small": 244e6, "medium": 769e6,
+    "large": 1550e6, "large-v1": 1550e6, "large-v2": 1550e6, "large-v3": 1550e6,
+}
+
+
+class UnknownModel(ValueError):
+    """Raised when a request names a model size that is not offered"""
+
+
+class ModelTooLarge(UnknownModel):
+    """Raised for a size that cannot fit in the memory budget beside the pinned models"""
+
+
+def model_memory_bytes(model: torch.nn.Module) -> int:
+    """Bytes held by parameters, buffers and packed int8 weights"""
+    total = 0
+    for module in model.modules():
+        for tensor in list(module.parameters(recurse=False)) + list(module.buffers(recurse=False)):
+            if not tensor.is_sparse:
+                total += tensor.numel() * tensor.element_size()
+        if hasattr(module, "_weight_bias"):
+            # Dynamically quantized Linear keeps its weights packed, outside parameters()
+            weight, bias = module._weight_bias()
+            total += weight.numel() * weight.element_size()
+            if bias is not None:
+                total += bias.numel() * bias.element_size()
+    return total
+
+
+def estimate_bytes(size: str, quantized: bool) -> int:
+    params = PARAMETER_COUNTS.get(size.replace(".en", ""), 0)
+    # Most weights are Linear layers, which int8 shrinks to a quarter
+    return int(params * (1.3 if quantized else 4))
+
+
+@dataclass
+class ModelEntry:
+    size: str
+    value: Any
+    memory_bytes: int
+    load_seconds: float
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    uses: int = 0
+    pinned: bool = False
+
+
+class ModelRegistry:
+    """Thread-safe lazy model cache.
+
+    ``acquire`` returns the loaded value for a size, loading it on first use
+    while holding a per-size lock so concurrent first requests load it once.
+    Before a load, least-recently-used unpinned models are dropped until the
+    estimated footprint fits ``budget_bytes``. The model being returned is
+    never the one evicted, and a size that cannot fit beside the pinned models
+    is refused with ``ModelTooLarge``. A request still running on an evicted
+    model keeps its own reference, so memory can briefly exceed the budget
+    until it finishes. Footprints are measured again before every
+    eviction pass and in ``stats``, since a value such as a replica set can
+    grow after it loads.
+    """
+
+    def __init__(self, loader: Callable[[str], Any], memory_of: Callable[[Any], int],
+                 budget_bytes: int, available: Iterable[str], quantized: bool = False):
+        self.loader = loader
+        self.memory_of = memory_of
+        self.budget_bytes = budget_bytes
+        self.available = list(available)
+        self.quantized = quantized
+        self._entries: "OrderedDict[str, ModelEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self.evictions = 0
+
+    def validate(self, size: Optional[str], default: str) -> str:
+        size = size or default
+        if size not in self.available:
+            raise UnknownModel(f"Unknown model '{size}', choose one of {self.available}")
+        with self._lock:
+            self._check_fits(size)
+        return size
+
+    def acquire(self, size: str, pin: bool = False) -> Any:
+        with self._lock:
+            entry = self._touch(size)
+            if entry is not None:
+                entry.pinned = entry.pinned or pin
+                return entry.value
+            load_lock = self._load_locks.setdefault(size, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._touch(size)
+                if entry is not None:
+                    return entry.value
+                if not pin:
+                    self._check_fits(size)
+                self._make_room(estimate_bytes(size, self.quantized))
+
+            logger.info(f"Loading model '{size}'")
+            start = time.perf_counter()
+            value = self.loader(size)
+            entry = ModelEntry(
+                size=size,
+                value=value,
+                memory_bytes=self.memory_of(value),
+                load_seconds=time.perf_counter() - start,
+                uses=1,
+                pinned=pin
+            )
+            logger.info(f"Loaded model '{size}' in {entry.load_seconds:.1f}s ({entry.memory_bytes / 2**20:.0f} MB)")
+
+            with self._lock:
+                self._entries[size] = entry
+                self._make_room(0, keep=size)
+            return value
+
+    def _touch(self, size: str) -> Optional[ModelEntry]:
+        entry = self._entries.get(size)
+        if entry is not None:
+            entry.last_used = time.time()
+            entry.uses += 1
+            self._entries.move_to_end(size)
+        return entry
+
+    def _measure(self):
+        for entry in self._entries.values():
+            entry.memory_bytes = self.memory_of(entry.value)
+
+    def _check_fits(self, size: str):
+        if size in self._entries:
+            return
+        pinned = sum(e.memory_bytes for e in self._entries.values() if e.pinned)
+        needed = estimate_bytes(size, self.quantized)
+        if pinned + needed > self.budget_bytes:
+            raise ModelTooLarge(
+                f"Model '{size}' needs about {needed >> 20} MB, but the memory budget leaves "
+                f"{max(0, self.budget_bytes - pinned) >> 20} MB beside the resident models"
+            )
+
+    def _make_room(self, incoming: int, keep: Optional[str] = None):
+        self._measure()
+        resident = sum(e.memory_bytes for e in self._entries.values())
+        for size in list(self._entries):
+            if resident + incoming <= self.budget_bytes:
+                break
+            entry = self._entries[size]
+            if entry.pinned or size == keep:
+                continue
+            del self._entries[size]
+            resident -= entry.memory_bytes
+            self.evictions += 1
+            logger.info(f"Evicted model '{size}' to stay within the memory budget")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._measure()
+            resident = [
+                {
+                    "model": e.size,
+                    "memory_mb": round(e.memory_bytes / 2**20, 1),
+                    "load_seconds": round(e.load_seconds, 3),
+                    "loaded_at": e.loaded_at,
+                    "last_used": e.last_used,
+                    "uses": e.uses,
+                    "pinned": e.pinned,
+                }
+                for e in reversed(self._entries.values())
+            ]
+        return {
+            "resident_models": resident,
+            "resident_memory_mb": round(sum(r["memory_mb"] for r in resident), 1),
+            "memory_budget_mb": round(self.budget_bytes / 2**20, 1),
+            "evictions": self.evictions,
+        }
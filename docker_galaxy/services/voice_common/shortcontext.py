@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Reduced audio context for short clips
+Runs Whisper's encoder over a window sized to the clip instead of the fixed 30 seconds
+
+Usage:
+    python -m voice_common.shortcontext benchmark --corpus /app/models/corpus --size base
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+import whisper
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = whisper.audio.SAMPLE_RATE
+# The encoder's second convolution halves the 100 Hz mel frame rate
+CONTEXT_PER_SECOND = whisper.audio.FRAMES_PER_SECOND // 2
+
+# Same quality gate transcribe() uses before retrying at higher temperature,
+# with a stricter log-probability bound since a miss falls back to full context
+COMPRESSION_RATIO_THRESHOLD = 2.4
+DEFAULT_MIN_LOGPROB = -0.7
+
+
+def audio_context(num_samples: int, margin_seconds: float = 1.0, full_context: int = 1500) -> int:
+    """Encoder positions needed for a clip plus a trailing margin of padding"""
+    seconds = num_samples / SAMPLE_RATE + margin_seconds
+    return min(full_context, max(CONTEXT_PER_SECOND, math.ceil(seconds * CONTEXT_PER_SECOND)))
+
+
+def log_mel(model, audio, n_ctx: int) -> torch.Tensor:
+    """Log-mel spectrogram padded to exactly ``n_ctx`` encoder positions"""
+    audio = whisper.pad_or_trim(audio, n_ctx * 2 * whisper.audio.HOP_LENGTH)
+    return whisper.log_mel_spectrogram(audio, n_mels=model.dims.n_mels, device=model.device)
+
+
+@torch.no_grad()
+def embed_audio(model, mel: torch.Tensor) -> torch.Tensor:
+    """AudioEncoder.forward without its fixed-length assertion.
+
+    The positional embedding is sliced to the number of frames; the
+    attention blocks themselves work on any sequence length.
+    """
+    encoder = model.encoder
+    x = F.gelu(encoder.conv1(mel))
+    x = F.gelu(encoder.conv2(x))
+    x = x.permute(0, 2, 1)
+    x = (x + encoder.positional_embedding[:x.shape[1]]).to(x.dtype)
+    for block in encoder.blocks:
+        x = block(x)
+    return encoder.ln_post(x)
+
+
+@contextlib.contextmanager
+def reduced_context(model, n_ctx: int):
+    """Make whisper.decode treat ``n_ctx``-long features as already encoded.
+
+    decode() only skips the encoder when the input shape matches
+    ``dims.n_audio_ctx``. The model must not be used by another thread
+    meanwhile, which holds for per-worker replicas and the batch worker.
+    """
+    full = model.dims.n_audio_ctx
+    model.dims.n_audio_ctx = n_ctx
+    try:
+        yield
+    finally:
+        model.dims.n_audio_ctx = full
+
+
+def acceptable(decoded, min_logprob: float = DEFAULT_MIN_LOGPROB) -> bool:
+    """Guard rail: reject output that looks truncated, looping or unsure"""
+    return (
+        bool(decoded.text.strip())
+        and decoded.compression_ratio <= COMPRESSION_RATIO_THRESHOLD
+        and decoded.avg_logprob >= min_logprob
+    )
+
+
+def decode(model, features: torch.Tensor, n_ctx: int, options: "whisper.DecodingOptions"):
+    with reduced_context(model, n_ctx):
+        return whisper.decode(model, features, options)
+
+
+def to_result(decoded, duration: float) -> Dict[str, Any]:
+    """Shape a DecodingResult like a one-segment transcribe() result"""
+    return {
+        "text": decoded.text,
+        "language": decoded.language,
+        "segments": [{
+            "id": 0,
+            "seek": 0,
+            "start": 0.0,
+            "end": duration,
+            "text": decoded.text,
+            "tokens": decoded.tokens,
+            "temperature": decoded.temperature,
+            "avg_logprob": decoded.avg_logprob,
+            "compression_ratio": decoded.compression_ratio,
+            "no_speech_prob": decoded.no_speech_prob,
+        }],
+    }
+
+
+def transcribe_short(model, audio, language: Optional[str] = None, task: str = "transcribe",
+                     margin_seconds: float = 1.0, min_logprob: float = DEFAULT_MIN_LOGPROB) -> Optional[Dict[str, Any]]:
+    """Transcribe a short clip on a reduced context, or None if the guard rails trip"""
+    n_ctx = audio_context(len(audio), margin_seconds, model.dims.n_audio_ctx)
+    features = embed_audio(model, log_mel(model, audio, n_ctx).unsqueeze(0))
+    options = whisper.DecodingOptions(
+        task=task,
+        language=language,
+        without_timestamps=True,
+        fp16=model.device.type == "cuda"
+    )
+    decoded = decode(model, features, n_ctx, options)[0]
+    if not acceptable(decoded, min_logprob):
+        return None
+    return to_result(decoded, len(audio) / SAMPLE_RATE)
+
+
+BUCKETS = [(0, 2), (2, 4), (4, 8), (8, 15), (15, 30)]
+
+
+def benchmark(size: str, corpus_dir: str, models_dir: str, language: str, quantize: bool,
+              margin_seconds: float, min_logprob: float, repeats: int) -> List[Dict[str, Any]]:
+    """Latency and WER of full vs reduced context, grouped by clip length"""
+    from .quantize import load_corpus, load_whisper, word_error_rate
+
+    model = load_whisper(size, "cpu", quantize, models_dir)
+    clips = [c for c in load_corpus(corpus_dir) if len(c["audio"]) <= whisper.audio.N_SAMPLES]
+    options = whisper.DecodingOptions(language=language, without_timestamps=True, fp16=False)
+
+    def timed(fn):
+        best, result = float("inf"), None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - start)
+        return best, result
+
+    rows = []
+    for low, high in BUCKETS:
+        bucket = [c for c in clips if low < len(c["audio"]) / SAMPLE_RATE <= high]
+        if not bucket:
+            continue
+        full_latency, short_latency, full_wer, short_wer, agreement = [], [], [], [], []
+        fallbacks = 0
+        for clip in bucket:
+            audio = clip["audio"]
+            mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=model.dims.n_mels)
+            seconds, full = timed(lambda: whisper.decode(model, mel, options))
+            full_latency.append(seconds)
+
+            seconds, short = timed(lambda: transcribe_short(model, audio, language, "transcribe", margin_seconds, min_logprob))
+            if short is None:
+                # What a request would pay: the reduced attempt plus the full pass
+                fallbacks += 1
+                seconds += full_latency[-1]
+                short_text = full.text
+            else:
+                short_text = short["text"]
+            short_latency.append(seconds)
+
+            agreement.append(word_error_rate(full.text, short_text))
+            if clip["reference"]:
+                full_wer.append(word_error_rate(clip["reference"], full.text))
+                short_wer.append(word_error_rate(clip["reference"], short_text))
+
+        def mean(values):
+            return round(sum(values) / len(values), 4) if values else None
+
+        rows.append({
+            "bucket": f"{low}-{high}s",
+            "clips": len(bucket),
+            "full_ms": round(mean(full_latency) * 1000, 1),
+            "reduced_ms": round(mean(short_latency) * 1000, 1),
+            "speedup": round(mean(full_latency) / mean(short_latency), 2),
+            "fallback_rate": round(fallbacks / len(bucket), 3),
+            "full_wer": mean(full_wer),
+            "reduced_wer": mean(short_wer),
+            "reduced_vs_full_wer": mean(agreement),
+        })
+    return rows
+
+
+def print_table(rows: List[Dict[str, Any]]):
+    header = f"{'clip length':<12}{'clips':>6}{'full ms':>10}{'reduced ms':>12}{'speedup':>9}{'fallback':>10}{'WER full':>10}{'WER red.':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        full_wer = f"{r['full_wer']:.3f}" if r["full_wer"] is not None else "-"
+        short_wer = f"{r['reduced_wer']:.3f}" if r["reduced_wer"] is not None else "-"
+        print(f"{r['bucket']:<12}{r['clips']:>6}{r['full_ms']:>10.1f}{r['reduced_ms']:>12.1f}"
+              f"{r['speedup']:>9.2f}{r['fallback_rate']:>10.1%}{full_wer:>10}{short_wer:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reduced audio context tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("benchmark", help="Compare latency and WER of full vs reduced context by clip length")
+    bench.add_argument("--corpus", required=True, help="Directory of audio files with optional .txt references")
+    bench.add_argument("--size", default=os.getenv("MODEL_SIZE", "base"))
+    bench.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "/app/models"))
+    bench.add_argument("--language", default=os.getenv("LANGUAGE", "en"))
+    bench.add_argument("--int8", action="store_true", help="Benchmark the int8 quantized model")
+    bench.add_argument("--margin", type=float, default=1.0, help="Seconds of padding after the clip")
+    bench.add_argument("--min-logprob", type=float, default=DEFAULT_MIN_LOGPROB)
+    bench.add_argument("--repeats", type=int, default=3, help="Best-of-N timing per clip")
+    bench.add_argument("--threads", type=int, default=None)
+    bench.add_argument("--output", help="Write the JSON report here")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    rows = benchmark(args.size, args.corpus, args.models_dir, args.language, args.int8,
+                     args.margin, args.min_logprob, args.repeats)
+    print_table(rows)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+In-flight request coalescing for the STT services
+Identical requests that arrive while one is being transcribed wait for its result instead of running again
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+def flight_key(audio: bytes, **options) -> str:
+    """Hash the audio bytes together with every option that changes the output"""
+    digest = hashlib.blake2b(audio, digest_size=20)
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """At most one call per key at a time; callers with the same key share its outcome.
+
+    The call runs as its own task, so a caller that disconnects or is
+    cancelled does not take the result away from the others waiting on
+    it. Errors are shared like results: every waiter sees the same one.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Await ``fn()``, or the identical call already running; returns (result, shared)"""
+        task = self._pending.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            self.started += 1
+            task = asyncio.ensure_future(fn())
+            self._pending[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if not task.cancelled():
+            # Mark the error retrieved in case every waiter has gone away
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._pending), "started": self.started, "coalesced": self.coalesced}
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Local Coqui TTS model store
+Resolves models on a pre-populated volume, verifies their checksums and caches the model catalog
+
+Usage:
+    python -m voice_common.ttsstore prepare --model tts_models/en/ljspeech/tacotron2-DDC --models-dir /app/models
+    python -m voice_common.ttsstore verify --model tts_models/en/ljspeech/tacotron2-DDC --models-dir /app/models
+"""
+
+import argparse
+import hashlib
+import logging
+import mmap
+import os
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# sha256sum-format list of a model directory's files, written by "prepare"
+CHECKSUMS_FILE = "SHA256SUMS"
+HASH_CHUNK = 1 << 24
+
+
+class ModelUnavailable(RuntimeError):
+    """Raised when a model is not on the volume and downloads are off"""
+
+
+class ChecksumMismatch(RuntimeError):
+    """Raised when a model file does not hash to its recorded checksum"""
+
+
+def use_models_dir(models_dir: str):
+    """Point Coqui's model cache at the volume; it keeps models under $TTS_HOME/tts"""
+    os.environ.setdefault("TTS_HOME", models_dir)
+
+
+@lru_cache(maxsize=1)
+def manager():
+    from TTS.utils.manage import ModelManager
+    return ModelManager(progress_bar=False, verbose=False)
+
+
+@lru_cache(maxsize=1)
+def catalog() -> List[str]:
+    """Names of every model Coqui knows; read once from its bundled models file"""
+    return list(manager().list_models())
+
+
+def model_dir(model_name: str) -> Path:
+    return Path(manager().output_prefix) / model_name.replace("/", "--")
+
+
+def required_models(model_name: str) -> List[str]:
+    """The model plus the vocoder Coqui pairs it with by default"""
+    model_type, lang, dataset, model = model_name.split("/")
+    try:
+        entry = manager().models_dict[model_type][lang][dataset][model]
+    except KeyError:
+        return [model_name]
+    vocoder = entry.get("default_vocoder")
+    return [model_name] + ([vocoder] if vocoder else [])
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(view), HASH_CHUNK):
+                    digest.update(view[offset:offset + HASH_CHUNK])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def read_checksums(directory: Path) -> Dict[str, str]:
+    path = directory / CHECKSUMS_FILE
+    sums = {}
+    if path.exists():
+        for line in path.read_text().splitlines():
+            parts = line.split(maxsplit=1)
+            if len(parts) == 2:
+                sums[parts[1].strip().lstrip("*")] = parts[0].lower()
+    return sums
+
+
+def write_checksums(directory: Path) -> Dict[str, str]:
+    sums = {
+        str(path.relative_to(directory)): sha256_file(path)
+        for path in sorted(directory.rglob("*")) if path.is_file() and path.name != CHECKSUMS_FILE
+    }
+    tmp = directory / (CHECKSUMS_FILE + ".tmp")
+    tmp.write_text("".join(f"{digest}  {name}\n" for name, digest in sums.items()))
+    os.replace(tmp, directory / CHECKSUMS_FILE)
+    return sums
+
+
+def verify_dir(directory: Path):
+    sums = read_checksums(directory)
+    if not sums:
+        logger.warning(f"No {CHECKSUMS_FILE} in {directory}; run 'python -m voice_common.ttsstore prepare' to add one")
+        return
+    start = time.perf_counter()
+    for name, expected in sums.items():
+        actual = sha256_file(directory / name)
+        if actual != expected:
+            raise ChecksumMismatch(f"{directory / name} has sha256 {actual}, expected {expected}")
+    logger.info(f"Verified {len(sums)} files in {directory.name} in {time.perf_counter() - start:.1f}s")
+
+
+def ensure_local(model_name: str, verify: bool = True, allow_download: bool = True):
+    """Check that ``model_name`` and its vocoder are on the volume before TTS() loads them.
+
+    Coqui skips the download for a model whose directory exists, so with
+    every directory present construction never touches the network.
+    """
+    for name in required_models(model_name):
+        directory = model_dir(name)
+        if not directory.is_dir():
+            if not allow_download:
+                raise ModelUnavailable(f"{name} is not in {directory.parent} and downloads are disabled")
+            logger.warning(f"{name} is not on the models volume, it will be downloaded")
+            continue
+        if verify:
+            verify_dir(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coqui TTS models volume tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("prepare", "Download models and checksum them for the volume"),
+                            ("verify", "Check a model's files against its SHA256SUMS")):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument("--model", default=os.getenv("MODEL_NAME", "tts_models/en/ljspeech/tacotron2-DDC"))
+        command.add_argument("--models-dir", default=os.getenv("MODELS_DIR", "/app/models"))
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    use_models_dir(args.models_dir)
+
+    if args.command == "prepare":
+        for name in required_models(args.model):
+            manager().download_model(name)
+            sums = write_checksums(model_dir(name))
+            print(f"{name}: {len(sums)} files checksummed")
+    else:
+        try:
+            ensure_local(args.model, verify=True, allow_download=False)
+        except (ModelUnavailable, ChecksumMismatch, OSError) as e:
+            sys.exit(f"FAILED: {e}")
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()